@@ -2,12 +2,70 @@
 
 import pandas as pd
 from datetime import date
-import statsmodels.api as sm
 import numpy as np
 from ropacea.data import get_in_sample_data
+from ropacea.covariance import FactorCovariance
 
 def single_factor(data):
-    '''Create unique dates to numbers'''
+    '''Single factor covariance estimate from monthly-return-capitalization data.
+
+    The market return of a month is the average return of the tickers that month.
+    Every ticker is regressed on the market return over the months it has data.
+    '''
+
+    # months x tickers, tickers in alphabetical order
+    returns = data.pivot_table(values='Monthly Total Return',
+                               index='Monthly Calendar Date',
+                               columns='Ticker').values
+
+    _, B, column_omega, varM = single_factor_regression(returns)
+
+    return single_factor_covariance(B, varM, column_omega)
+
+
+def single_factor_regression(returns: np.ndarray,
+                             market: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    '''Fit every ticker on the market return in one least squares pass.
+
+    Parameters:
+        returns: (T x N) monthly returns, NaN where a ticker has no data
+        market: (T,) market return of each month, by default the average return of
+            the tickers with data that month
+
+    Returns alpha, beta and residual variance of each ticker, and the market variance.
+    '''
+    observed = ~np.isnan(returns)
+    n_obs = observed.sum(axis=0)
+
+    # market return of each month and its variance
+    rM = np.nanmean(returns, axis=1) if market is None else market
+    varM = np.var(rM, ddof=1)
+
+    # center both sides over the months each ticker has data
+    rM = np.where(observed, rM[:, None], 0.0)
+    y = np.where(observed, returns, 0.0)
+    mean_rM = rM.sum(axis=0) / n_obs
+    mean_y = y.sum(axis=0) / n_obs
+    x_c = np.where(observed, rM - mean_rM, 0.0)
+    y_c = np.where(observed, y - mean_y, 0.0)
+
+    beta = (x_c * y_c).sum(axis=0) / (x_c**2).sum(axis=0)
+    alpha = mean_y - beta * mean_rM
+
+    epsilon = y_c - beta * x_c
+    omega = (epsilon**2).sum(axis=0) / n_obs
+
+    return alpha, beta, omega, varM
+
+
+def single_factor_statsmodels(data):
+    '''Reference implementation fitting one statsmodels OLS per ticker.
+
+    Only used to check single_factor(), which should agree to rounding error.
+    '''
+    import statsmodels.api as sm
+
+    data = data.copy()
 
     # Creating a mapping of unique dates to numbers
     date_to_number = {date: i + 1 for i, date in enumerate(data['Monthly Calendar Date'].unique())}
@@ -15,74 +73,40 @@ def single_factor(data):
     # Assigning numbers based on the mapping
     data['Month'] = data['Monthly Calendar Date'].map(date_to_number)
 
-    ### Find rM for each month and overall std
     # Grouping by 'Month' and calculating the mean of each month
     mkt = data.groupby('Month')['Monthly Total Return'].mean().reset_index()
-
-    # Renaming the columns for clarity
     mkt.columns = ['Month', 'rM']
 
-    # Displaying the resulting DataFrame
-    # print(mkt)
-
     #Find std of market
     stdM = mkt['rM'].std()
 
-    # Displaying the resulting DataFrame
-    # print(stdM)
-
     # Merging the two DataFrames based on the 'Number' column
     data = pd.merge(data, mkt, on='Month', how='left')
 
-    # Creating an empty DataFrame to store regression results
-    regression_results = pd.DataFrame(columns=['Ticker', 'Alpha', 'Beta', 'Omega'])
-
-    # Grouping by 'Group' column
-    grouped = data.groupby('Ticker')
+    betas = []
+    omegas = []
 
     # Performing linear regression within each group
-    for group, group_df in grouped:
+    for group, group_df in data.groupby('Ticker'):
         # Adding a constant term for the intercept (alpha)
         X = sm.add_constant(group_df['rM'])
         y = group_df['Monthly Total Return']
 
-        # Performing linear regression
         model = sm.OLS(y, X).fit()
 
-        # Extracting coefficients
-        alpha = model.params['const']
-        beta = model.params['rM']
-        epsilon = model.resid.values
-        omega = epsilon.var()
-
-        # Create a new DataFrame with the new data
-        new_data = pd.DataFrame({
-            'Ticker': [group],
-            'Alpha': [alpha],
-            'Beta': [beta],
-            'Omega': [omega]
-        })
-
-        # Concatenate the new data with the existing DataFrame
-        regression_results = pd.concat([regression_results, new_data], ignore_index=True)
-
-    # Displaying the results
-    # print(regression_results)
-
-    # Extracting the column as a NumPy array
-    B = regression_results['Beta'].to_numpy()
-    column_alpha = regression_results['Alpha'].to_numpy()
-    column_omega = regression_results['Omega'].to_numpy()
+        betas.append(model.params['rM'])
+        omegas.append(model.resid.values.var())
 
-    # Creating a diagonal matrix from omega and square it
-    D = np.diag(column_omega)
+    return single_factor_covariance(np.array(betas), stdM**2, np.array(omegas))
 
-    # Displaying the resulting diagonal matrix
 
-    V = stdM**2 * np.dot(B, B.T) + D
-    # print(V)
+def single_factor_covariance(B: np.ndarray, varM: float, omega: np.ndarray) -> FactorCovariance:
+    """Covariance matrix of the single factor model from the betas B, the market
+    variance varM and the residual variances omega.
 
-    return V
+    V = varM * B B' + diag(omega), kept in factored form."""
+    B = np.asarray(B, dtype=float)
+    return FactorCovariance(B[:, None], [[varM]], omega)
 
 # test functionality
 if __name__ == '__main__':
@@ -91,4 +115,6 @@ if __name__ == '__main__':
     data = get_in_sample_data(mark_date, sample_months)
     out = single_factor(data)
 
-    print(out)
+    print(np.asarray(out))
+    print("max abs difference to statsmodels:",
+          np.abs(np.asarray(out) - np.asarray(single_factor_statsmodels(data))).max())
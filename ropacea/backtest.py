@@ -1,12 +1,23 @@
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
 from datetime import date
 from dateutil.relativedelta import relativedelta
-import statistics
 import math
+import logging
 
-from ropacea.portfolios import Portfolio, PortfolioStrategy, calculate_portfolio
-from ropacea.data import get_market_returns, get_risk_free_rate
+import numpy as np
 
+from ropacea.portfolios import Portfolio, PortfolioStrategy, calculate_portfolio, calculate_frontier
+from ropacea.data import TRADING_DAYS_PER_YEAR, Frequency, get_market_returns, get_returns_panel, get_risk_free_return
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
+from ropacea.batch import prefetch_estimates
+from ropacea.instrumentation import configure_logging, count, instrumented, stage
+
+if TYPE_CHECKING:
+    from ropacea.results import BacktestResults
+
+
+logger = logging.getLogger(__name__)
 
 BASIS_POINT = 0.0001
 
@@ -30,79 +41,179 @@ class BacktestSummary():
 def backtest(mark_date: date,
              strategy: PortfolioStrategy,
              frequency: relativedelta,
-             min_return_ratio: float) -> BacktestResult:
+             min_return_ratio: float,
+             sample_months: int = 60,
+             universe: UniverseRule = DEFAULT_UNIVERSE) -> BacktestResult:
 
-    portfolio = calculate_portfolio(mark_date, strategy, min_return_ratio)
-    market_returns = get_market_returns(mark_date, mark_date+frequency)
+    portfolio = calculate_portfolio(mark_date, strategy, min_return_ratio, sample_months, universe)
 
-    monthly_portfolio_return = portfolio.calc_portfolio_return(market_returns)
-    print(f"{monthly_portfolio_return = :.4f}")
+    return _evaluate(mark_date, [portfolio], frequency)[0]
 
-    risk_free_return = get_risk_free_rate(mark_date)
-    print(f"{risk_free_return = :.4f}")
 
-    excess_return = monthly_portfolio_return - risk_free_return
+def backtest_frontier(mark_date: date,
+                      strategy: PortfolioStrategy,
+                      frequency: relativedelta,
+                      min_return_ratios: list[float],
+                      sample_months: int = 60,
+                      universe: UniverseRule = DEFAULT_UNIVERSE) -> list[BacktestResult]:
+    """Backtest the portfolios of several min_return_ratios on one mark_date"""
 
-    return BacktestResult(
-        mark_date,
-        portfolio,
-        market_returns,
-        excess_return,
-    )
+    portfolios = calculate_frontier(mark_date, strategy, min_return_ratios, sample_months, universe)
+
+    return _evaluate(mark_date, portfolios, frequency)
+
+
+def _evaluate(mark_date: date,
+              portfolios: list[Portfolio],
+              frequency: relativedelta) -> list[BacktestResult]:
+    """Value each portfolio over the period starting at mark_date, with the returns
+    compounded over the months or trading days of the period.
+    The portfolios of one mark date hold the same tickers."""
+
+    with stage('evaluate'):
+        market_returns = get_market_returns(mark_date, mark_date+frequency, portfolios[0].tickers)
+
+        risk_free_return = get_risk_free_return(mark_date, mark_date+frequency)
+
+        results = []
+        for portfolio in portfolios:
+            period_portfolio_return = portfolio.calc_portfolio_return(market_returns)
+
+            excess_return = period_portfolio_return - risk_free_return
+
+            results.append(BacktestResult(
+                mark_date,
+                portfolio,
+                market_returns,
+                excess_return,
+            ))
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("evaluated %s", mark_date,
+                     extra={'mark_date': mark_date, 'risk_free_return': round(risk_free_return, 6),
+                            'portfolio_returns': [round(float(r.excess_return + risk_free_return), 6) for r in results]})
+
+    return results
 
 
 def backtest_loop(start_date: date, 
                   end_date: date, 
                   strategy: PortfolioStrategy,
                   frequency = relativedelta(months=1),
-                  min_return_ratio: float =1) -> list[BacktestResult]:
+                  min_return_ratio: float | list[float] = 1,
+                  sample_months: int = 60,
+                  universe: UniverseRule = DEFAULT_UNIVERSE) -> list[BacktestResult] | dict[float, list[BacktestResult]]:
+    """Backtest a strategy on every mark date from start_date (inclusive) to end_date (exclusive).
+    Min risk strategies estimate from the sample_months before each mark date.
+    At each mark date the strategy invests in the tickers chosen by universe.
+
+    Given a list of min_return_ratios, every ratio is backtested in the same pass over
+    the mark dates and the results are returned as a dict from ratio to results.
+
+    On daily data the windows are sample_months of 21 trading days and frequency may be
+    as short as relativedelta(days=1); mark dates whose period has no trading day are
+    skipped. Annualize the results with rebalances_per_year(frequency).
+
+    Estimates of the complete windows are computed up front in one batch, see
+    ropacea.batch.prefetch_estimates(). Each stage is timed into the shared
+    ropacea.instrumentation.Instrumentation.
+
+    Sample usage:
+        >>> results = backtest_loop(date(2017, 1, 1), date(2022, 1, 1),
+        ...                         PortfolioStrategy.SAMPLE_COVARIANCE,
+        ...                         min_return_ratio=[1.0, 1.5, 2.0])
+        >>> summarize_results(results[1.5])
+    """
+    ratios = min_return_ratio if isinstance(min_return_ratio, (list, tuple, np.ndarray)) else None
 
-    mark_date = start_date
     backtest_results = []
+    frontier_results = {ratio: [] for ratio in ratios} if ratios is not None else None
 
-    while (mark_date < end_date):
-        print(f"{mark_date = }")
-        backtest_result = backtest(mark_date, strategy, frequency, min_return_ratio)
-        backtest_results.append(backtest_result)
+    dates = mark_dates(start_date, end_date, frequency)
+    with stage('prefetch'):
+        count('prefetched_estimates', prefetch_estimates(dates, strategy, sample_months, universe))
+    count('mark_dates', len(dates))
+
+    for mark_date in dates:
+        logger.debug("mark date %s", mark_date, extra={'mark_date': mark_date, 'strategy': strategy.name})
+        if ratios is None:
+            backtest_result = backtest(mark_date, strategy, frequency, min_return_ratio, sample_months, universe)
+            backtest_results.append(backtest_result)
+        else:
+            for ratio, backtest_result in zip(ratios, backtest_frontier(mark_date, strategy, frequency, ratios, sample_months, universe)):
+                frontier_results[ratio].append(backtest_result)
 
+    return backtest_results if ratios is None else frontier_results
+
+
+def mark_dates(start_date: date, end_date: date, frequency: relativedelta) -> list[date]:
+    """Mark dates from start_date (inclusive) to end_date (exclusive), frequency apart.
+    On daily data, mark dates without a trading day before the next one are left out."""
+    dates = []
+    mark_date = start_date
+    while (mark_date < end_date):
+        dates.append(mark_date)
         mark_date = mark_date + frequency
 
-    return backtest_results
+    panel = get_returns_panel()
+    if panel.frequency is Frequency.DAILY and dates:
+        first = np.searchsorted(panel.months, np.array(dates, dtype='datetime64[D]'))
+        stop = np.searchsorted(panel.months, np.array([d + frequency for d in dates], dtype='datetime64[D]'))
+        dates = [mark_date for mark_date, has_days in zip(dates, first < stop) if has_days]
+    return dates
 
 
-def summarize_results(backtest_results: list[BacktestResult]) -> BacktestSummary:
+def rebalances_per_year(frequency: relativedelta) -> float:
+    """Mark dates per year of a frequency, counting 252 trading days per year for frequencies in days"""
+    months = frequency.years * 12 + frequency.months
+    if months and not frequency.days:
+        return 12 / months
+    if frequency.days % 7 == 0:
+        return 52 / (frequency.days // 7)
+    return TRADING_DAYS_PER_YEAR / frequency.days
 
-    print(f"{'='*10} SUMMARY {'='*10}")
+
+def summarize_results(backtest_results: 'list[BacktestResult] | BacktestResults',
+                      periods_per_year: float = 12) -> BacktestSummary:
+    """Summarize a list of results or a ropacea.results.BacktestResults, logged at INFO level.
+    The excess returns are annualized with periods_per_year, see rebalances_per_year()."""
+
+    excess_returns = getattr(backtest_results, 'excess_returns', None)
+    if excess_returns is None:
+        excess_returns = np.array([br.excess_return for br in backtest_results], dtype=float)
 
     # monhtly returns (bp)
-    monthly_returns_bp_mean = statistics.mean([
-      br.excess_return/BASIS_POINT for br in backtest_results  
-    ])
+    monthly_returns_bp_mean = float(np.mean(excess_returns / BASIS_POINT))
+    monthly_returns_bp_std = float(np.std(excess_returns / BASIS_POINT, ddof=1))
+
+    out = summary_from_moments(monthly_returns_bp_mean, monthly_returns_bp_std, periods_per_year)
+
+    logger.info("summary: monthly mean %.2f bp, monthly std %.2f bp, annualized mean %.2f%%, "
+                "annualized std %.2f%%, sharpe ratio %.2f",
+                out.monthly_returns_bp_mean, out.monthly_returns_bp_std, out.annualized_mean_pct,
+                out.annualized_std_pct, out.sharpe_ratio, extra=vars(out))
+
+    return out
 
-    monthly_returns_bp_std = statistics.stdev([
-      br.excess_return/BASIS_POINT for br in backtest_results  
-    ])
 
-    print(f"{monthly_returns_bp_mean = :>.2f}")
-    print(f"{monthly_returns_bp_std = :>.2f}")
+def summary_from_moments(monthly_returns_bp_mean: float,
+                         monthly_returns_bp_std: float,
+                         periods_per_year: float = 12) -> BacktestSummary:
+    """Annualize the mean and standard deviation of the excess returns (bp) of each
+    period, monthly by default"""
 
     # annualized mean
     annualized_mean_pct = (
-        (1+ monthly_returns_bp_mean * BASIS_POINT) ** 12 - 1
+        (1+ monthly_returns_bp_mean * BASIS_POINT) ** periods_per_year - 1
     ) * 100
     # annualized STD
     annualized_std_pct = (
-        (monthly_returns_bp_std * BASIS_POINT) * math.sqrt(12)
+        (monthly_returns_bp_std * BASIS_POINT) * math.sqrt(periods_per_year)
     ) * 100
 
-    print(f"{annualized_mean_pct = :>.2f}")
-    print(f"{annualized_std_pct = :>.2f}")
-
     sharpe_ratio = annualized_mean_pct / annualized_std_pct
 
-    print(f"{sharpe_ratio = :>.2f}")
-
-    out =  BacktestSummary(
+    return BacktestSummary(
         monthly_returns_bp_mean,
         monthly_returns_bp_std,
         annualized_mean_pct,
@@ -110,18 +221,17 @@ def summarize_results(backtest_results: list[BacktestResult]) -> BacktestSummary
         sharpe_ratio
     )
 
-    return out
-
 
 
 
 if __name__ == '__main__':
-    results = backtest_loop(
-        start_date = date(year = 2017, month=1, day=1),
-        end_date = date(year = 2023, month=1, day=1),
-        strategy=PortfolioStrategy.SINGLE_FACTOR,
-        min_return_ratio=1
-    )
+    configure_logging('INFO')
+    with instrumented():
+        results = backtest_loop(
+            start_date = date(year = 2017, month=1, day=1),
+            end_date = date(year = 2023, month=1, day=1),
+            strategy=PortfolioStrategy.SINGLE_FACTOR,
+            min_return_ratio=1
+        )
 
     summarize_results(results)
-
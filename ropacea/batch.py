@@ -0,0 +1,277 @@
+"""Covariance estimates of many mark dates in one pass.
+
+A historical backtest knows all of its windows up front. batch_estimates() views every
+window of the returns panel as one (D x T x N) array without copying it, and computes
+the estimates of all D mark dates with stacked matrix products instead of one window
+at a time:
+ - SAMPLE_COVARIANCE: a (D x N x N) array of Ledoit-Wolf shrunk covariances
+ - SINGLE_FACTOR, CONSTANT_CORRELATION: stacked factor loadings, factor variances
+   and idiosyncratic variances
+
+    >>> dates = mark_dates(date(2016, 1, 1), date(2023, 1, 1), relativedelta(months=1))
+    >>> estimates = batch_estimates(dates, PortfolioStrategy.SAMPLE_COVARIANCE)
+    >>> estimates.covariance.shape, estimates.shrinkage
+    >>> expected_returns, covariance = estimates[0]
+
+prefetch_estimates() fills the shared ropacea.estimate_cache.EstimateStore with batch
+estimates, which backtest_loop() does before its first mark date. Windows with missing
+returns are left to the per mark date estimators. STATISTICAL_FACTOR has no batch form,
+its number of factors varies between mark dates.
+"""
+
+
+from datetime import date
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ropacea.data import UNIVERSE, ReturnsPanel, estimable_tickers, get_returns_panel
+from ropacea.scs import ledoit_wolf_intensity, shrink_covariance
+from ropacea.covariance import FactorCovariance
+from ropacea.estimate_cache import get_estimate_store
+from ropacea.portfolios import PortfolioStrategy
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
+
+
+@dataclass
+class BatchEstimates:
+    """Expected returns and covariances of D mark dates over the same N tickers"""
+
+    mark_dates: list[date]
+    tickers: tuple
+    expected_returns: np.ndarray
+    """(D x N)"""
+    covariance: np.ndarray = None
+    """(D x N x N) for SAMPLE_COVARIANCE"""
+    shrinkage: np.ndarray = None
+    """(D,) Ledoit-Wolf intensities for SAMPLE_COVARIANCE"""
+    loadings: np.ndarray = None
+    """(D x N x K) for the factor models"""
+    factor_covariance: np.ndarray = None
+    """(D x K x K) for the factor models"""
+    idiosyncratic: np.ndarray = None
+    """(D x N) for the factor models"""
+
+    def __len__(self) -> int:
+        return len(self.mark_dates)
+
+    def __getitem__(self, d: int) -> tuple[np.ndarray, np.ndarray | FactorCovariance]:
+        """(expected_returns, covariance) of the d-th mark date, like ropacea.portfolios._estimate()"""
+        if self.covariance is not None:
+            return self.expected_returns[d], self.covariance[d]
+        return self.expected_returns[d], FactorCovariance(self.loadings[d], self.factor_covariance[d],
+                                                          self.idiosyncratic[d])
+
+    def dense(self) -> np.ndarray:
+        """(D x N x N) covariance matrices"""
+        if self.covariance is not None:
+            return self.covariance
+        common = np.einsum('dik,dkl,djl->dij', self.loadings, self.factor_covariance, self.loadings)
+        return common + self.idiosyncratic[:, :, None] * np.eye(len(self.tickers))
+
+
+def window_view(returns: np.ndarray, ends: np.ndarray, sample_months: int) -> np.ndarray:
+    """(D x sample_months x N) windows of the rows of returns before each row in ends.
+
+    A view of returns when the ends are evenly spaced, as for mark dates at a fixed
+    frequency, a copy otherwise.
+    """
+    ends = np.asarray(ends)
+    # (rows - sample_months + 1) x sample_months x N, window k starting at row k
+    windows = sliding_window_view(returns, sample_months, axis=0).transpose(0, 2, 1)
+
+    starts = ends - sample_months
+    steps = np.diff(starts)
+    if len(starts) > 1 and (steps == steps[0]).all() and steps[0] > 0:
+        return windows[starts[0]:starts[-1] + 1:steps[0]]
+    return windows[starts]
+
+
+def batch_sample_covariance(windows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Ledoit-Wolf shrunk covariance (D x N x N) and shrinkage intensity (D,) of each window, see ropacea.scs"""
+    n = windows.shape[1]
+    mean = windows.mean(axis=1)
+
+    # in place, one (D x N x N) array less
+    sample_cov = np.matmul(windows.transpose(0, 2, 1), windows)
+    sample_cov -= n * mean[:, :, None] * mean[:, None, :]
+    sample_cov /= n - 1
+
+    # squared norms of the demeaned months, without demeaning the windows
+    row_norms_sq = (np.einsum('dti,dti->dt', windows, windows) - 2 * np.einsum('dti,di->dt', windows, mean)
+                    + (mean**2).sum(axis=1)[:, None])
+
+    intensity = ledoit_wolf_intensity(sample_cov, row_norms_sq)
+    return shrink_covariance(sample_cov, intensity), intensity
+
+
+def batch_single_factor(windows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Loadings (D x N x 1), market variance (D x 1 x 1) and residual variances (D x N)
+    of each window, see ropacea.Single_factor"""
+    n = windows.shape[1]
+    mean = windows.mean(axis=1)
+    market = windows.mean(axis=2)
+    market_mean = market.mean(axis=1)
+
+    # centered sums of squares and cross products
+    s_mm = ((market - market_mean[:, None])**2).sum(axis=1)
+    s_xm = np.einsum('dti,dt->di', windows, market) - n * mean * market_mean[:, None]
+    s_xx = np.einsum('dti,dti->di', windows, windows) - n * mean**2
+
+    beta = s_xm / s_mm[:, None]
+    # variance of the regression residuals
+    omega = (s_xx - beta * s_xm) / n
+
+    return beta[:, :, None], (s_mm / (n - 1))[:, None, None], omega
+
+
+def batch_constant_correlation(windows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Loadings (D x N x 1), average correlation (D x 1 x 1) and idiosyncratic
+    variances (D x N) of each window, see ropacea.const_corr"""
+    n, n_assets = windows.shape[1:]
+    mean = windows.mean(axis=1)
+    sigma = np.sqrt((np.einsum('dti,dti->di', windows, windows) - n * mean**2) / (n - 1))
+
+    # sum over tickers of the standardized returns of each month
+    z_sum = np.einsum('dti,di->dt', windows, 1 / sigma) - (mean / sigma).sum(axis=1)[:, None]
+    sum_corr = (z_sum**2).sum(axis=1) / (n - 1)
+    avg_corr = (sum_corr - n_assets) / (n_assets * (n_assets - 1))
+
+    return sigma[:, :, None], avg_corr[:, None, None], (1 - avg_corr)[:, None] * sigma**2
+
+
+def batch_estimates(mark_dates: list[date],
+                    strategy: PortfolioStrategy,
+                    sample_months: int = 60,
+                    tickers: tuple = tuple(UNIVERSE)) -> BatchEstimates:
+    """Estimates of the tickers at every mark date, from the sample_months before each.
+
+    Raises ValueError if a window has missing returns or the strategy has no batch form.
+    """
+    if strategy not in _BATCH_ESTIMATORS:
+        raise ValueError(f"No batch estimator for {strategy}")
+
+    panel = get_returns_panel()
+    tickers = tuple(tickers)
+    columns = panel.columns(tickers)
+    returns = panel.total_return[:, columns]
+
+    ends = np.array([panel.row_index(mark_date) for mark_date in mark_dates])
+    incomplete = [mark_date for mark_date, end in zip(mark_dates, ends)
+                  if not _complete_window(panel, columns, end, sample_months)]
+    if incomplete:
+        raise ValueError(f"Missing returns in the windows before {incomplete}")
+
+    windows = window_view(returns, ends, panel.sample_rows(sample_months))
+    estimates = BatchEstimates(list(mark_dates), tickers, windows.mean(axis=1))
+    if strategy == PortfolioStrategy.SAMPLE_COVARIANCE:
+        estimates.covariance, estimates.shrinkage = batch_sample_covariance(windows)
+    else:
+        estimates.loadings, estimates.factor_covariance, estimates.idiosyncratic = \
+            _BATCH_ESTIMATORS[strategy](windows)
+    return estimates
+
+
+def prefetch_estimates(mark_dates: list[date],
+                       strategy: PortfolioStrategy,
+                       sample_months: int = 60,
+                       universe: UniverseRule = DEFAULT_UNIVERSE) -> int:
+    """Put the batch estimates of every mark date with a complete window and no cached
+    estimate in the shared EstimateStore. Returns the number of estimates added.
+
+    The tickers of a mark date are those of the universe the min risk strategies can
+    estimate, see ropacea.data.estimable_tickers().
+
+    Consecutive mark dates with the same tickers are estimated in batches of at most
+    BATCH_BYTES, counting the windows and the (N x N) arrays of each estimate, see
+    batch_size(). Dense SAMPLE_COVARIANCE estimates of more tickers than the store
+    keeps are not prefetched.
+    """
+    if strategy not in _BATCH_ESTIMATORS:
+        return 0
+
+    panel, store = get_returns_panel(), get_estimate_store()
+
+    # runs of consecutive mark dates to estimate with the same tickers
+    runs, columns_of = [], {}
+    for mark_date in mark_dates:
+        tickers = estimable_tickers(mark_date, sample_months, universe.select(mark_date, sample_months))
+        if tickers not in columns_of:
+            columns_of[tickers] = panel.columns(tickers)
+        if (not _complete_window(panel, columns_of[tickers], panel.row_index(mark_date), sample_months)
+                or store.contains(strategy.name, mark_date, sample_months, tickers)):
+            runs.append(None)
+        elif runs and runs[-1] is not None and runs[-1][0] == tickers:
+            runs[-1][1].append(mark_date)
+        else:
+            runs.append((tickers, [mark_date]))
+
+    added = 0
+    for tickers, dates in filter(None, runs):
+        if strategy == PortfolioStrategy.SAMPLE_COVARIANCE and len(tickers) > store.max_dense_assets:
+            continue
+        size = batch_size(strategy, panel.sample_rows(sample_months), len(tickers))
+        for first in range(0, len(dates), size):
+            batch = dates[first:first + size]
+            estimates = batch_estimates(batch, strategy, sample_months, tickers)
+            for d, mark_date in enumerate(batch):
+                store.get_or_compute(strategy.name, mark_date, sample_months, lambda: estimates[d], tickers=tickers)
+        added += len(dates)
+    return added
+
+
+def batch_size(strategy: PortfolioStrategy, sample_rows: int, n_assets: int) -> int:
+    """Number of windows of sample_rows x n_assets whose estimates take at most BATCH_BYTES"""
+    date_bytes = 8 * sample_rows * n_assets
+    if strategy == PortfolioStrategy.SAMPLE_COVARIANCE:
+        date_bytes += 8 * _DENSE_ARRAYS * n_assets**2
+    return max(1, BATCH_BYTES // date_bytes)
+
+
+BATCH_BYTES = 256 * 2**20
+"""Memory prefetch_estimates() estimates with at once"""
+
+_DENSE_ARRAYS = 5
+"""Most (N x N) arrays per window alive at once in batch_sample_covariance(), in
+shrink_covariance(): the sample covariance, the target, its two weighted terms and their sum"""
+
+
+_BATCH_ESTIMATORS = {
+    PortfolioStrategy.SAMPLE_COVARIANCE: batch_sample_covariance,
+    PortfolioStrategy.SINGLE_FACTOR: batch_single_factor,
+    PortfolioStrategy.CONSTANT_CORRELATION: batch_constant_correlation,
+}
+"""Strategies with a batch form and their estimator of a (D x T x N) stack of windows"""
+
+
+def _complete_window(panel: ReturnsPanel, columns: np.ndarray, end: int, sample_months: int) -> bool:
+    """Whether the columns of the panel have a return in each row of the window of sample_months before row end"""
+    sample_rows = panel.sample_rows(sample_months)
+    return (sample_rows <= end <= len(panel.months)
+            and panel.coverage.complete(slice(end - sample_rows, end))[columns].all())
+
+
+# compare with the per mark date estimates
+if __name__ == '__main__':
+    import time
+    from dateutil.relativedelta import relativedelta
+    from ropacea import portfolios
+    from ropacea.backtest import mark_dates
+    from ropacea.estimate_cache import EstimateStore, set_estimate_store
+
+    set_estimate_store(EstimateStore(persist=False))
+    dates = mark_dates(date(2016, 1, 1), date(2023, 1, 1), relativedelta(months=1))
+    for strategy in _BATCH_ESTIMATORS:
+        start = time.perf_counter()
+        estimates = batch_estimates(dates, strategy)
+        batch_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        single = [portfolios._compute_estimate(mark_date, strategy) for mark_date in dates]
+        single_seconds = time.perf_counter() - start
+
+        dense = estimates.dense()
+        error = max(np.abs(dense[d] - np.asarray(covariance)).max() for d, (_, covariance) in enumerate(single))
+        print(f"{strategy.name:20s} batch {batch_seconds * 1e3:6.1f} ms, one at a time {single_seconds * 1e3:6.1f} ms, "
+              f"max abs difference {error:.1e}")
@@ -0,0 +1,507 @@
+"""Benchmarks of the data, estimator and solver paths on synthetic data.
+
+synthetic_panel() builds a ReturnsPanel like the one of the data files, with any number
+of tickers. Returns follow a one factor model, and tickers list and delist at random
+months so that histories are ragged. scaling_benchmark() times a short backtest on
+panels of increasing size:
+ - data: choosing the universe and slicing returns
+ - estimate: the rolling estimate of each min risk strategy
+ - solve: the min risk model
+
+Only the lookups served by the panel use the synthetic data, so the universe rules
+should require full histories (the batch fallback estimators read the data files).
+
+benchmark_suite() goes through the data files instead. write_synthetic_data() writes
+monthly-return-capitalization.csv and risk-free.csv with the schema of the real ones,
+and each size runs in a fresh interpreter reading them through ROPACEA_DATA_DIR, which
+times every stage from the CSV ingest to a full backtest_loop(). Results are written
+as JSON, one file per commit, and compare_benchmarks() lists the stages that got
+slower. check_golden() backtests every strategy on a small synthetic data set and
+compares with the results in benchmarks/golden.json, so an optimization can be checked
+not to change any number. daily_benchmark() times a backtest of several years on
+synthetic daily data files, rebalanced every week.
+
+    $ python -m ropacea.benchmarks suite
+    $ python -m ropacea.benchmarks golden
+    $ python -m ropacea.benchmarks scaling
+    $ python -m ropacea.benchmarks daily
+"""
+
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import date, datetime
+from dataclasses import dataclass
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from ropacea import data, portfolios
+from ropacea.data import Frequency, ReturnsPanel, get_in_sample_returns, get_market_returns, set_returns_panel
+from ropacea.portfolios import PortfolioStrategy
+from ropacea.universe import TopMarketCap
+from ropacea.estimate_cache import EstimateStore, get_estimate_store, set_estimate_store
+from ropacea.solvers import get_session
+from ropacea.instrumentation import StageTimer, instrumented
+
+
+def synthetic_panel(n_tickers: int,
+                    n_months: int = 156,
+                    first_month: str = '2010-01',
+                    ragged: float = 0.2,
+                    seed: int = 0,
+                    periods_per_month: int = 1) -> ReturnsPanel:
+    """ReturnsPanel of n_tickers over n_months generated from a one factor model.
+
+    A fraction ragged of the tickers list after the first month or delist before the last.
+    With periods_per_month > 1, n_months counts periods of returns scaled to that many
+    periods per month, e.g. 21 for trading days; the rows are still labelled by month.
+    """
+    rng = np.random.default_rng(seed)
+
+    market = rng.normal(0.008 / periods_per_month, 0.045 / np.sqrt(periods_per_month), n_months)
+    beta = rng.normal(1.0, 0.3, n_tickers)
+    alpha = rng.normal(0.0, 0.003 / periods_per_month, n_tickers)
+    idiosyncratic = rng.uniform(0.03, 0.10, n_tickers) / np.sqrt(periods_per_month)
+    total_return = alpha + np.outer(market, beta) + rng.normal(size=(n_months, n_tickers)) * idiosyncratic
+
+    initial_cap = rng.lognormal(11, 1.5, n_tickers)
+    market_cap = initial_cap * np.cumprod(1 + total_return, axis=0)
+
+    # ragged histories
+    listed = np.zeros(n_tickers, dtype=int)
+    delisted = np.full(n_tickers, n_months)
+    is_ragged = rng.random(n_tickers) < ragged
+    listed[is_ragged] = rng.integers(0, n_months // 2, is_ragged.sum())
+    delisted[is_ragged] = np.minimum(listed[is_ragged] + rng.integers(36 * periods_per_month, n_months, is_ragged.sum()),
+                                     n_months)
+    rows = np.arange(n_months)[:, None]
+    missing = (rows < listed) | (rows >= delisted)
+    total_return[missing] = np.nan
+    market_cap[missing] = np.nan
+
+    months = np.arange(np.datetime64(first_month, 'M'), np.datetime64(first_month, 'M') + n_months)
+    risk_free = np.full(n_months, 0.002 / periods_per_month)
+
+    return ReturnsPanel(
+        months=months,
+        tickers=tuple(f'T{j:05d}' for j in range(n_tickers)),
+        total_return=total_return,
+        market_cap=market_cap,
+        risk_free=risk_free,
+        # no rows of the data files belong to the synthetic panel
+        row_offsets=np.zeros(n_months + 1, dtype=int),
+    )
+
+
+@dataclass
+class ScalingResult:
+    n_tickers: int
+    n_universe: int
+    """Tickers picked by the universe rule"""
+    data_seconds: float
+    estimate_seconds: float
+    solve_seconds: float
+    n_mark_dates: int
+
+    def __str__(self) -> str:
+        per_date = 1e3 / self.n_mark_dates
+        return (f"N={self.n_tickers:5d} universe={self.n_universe:5d}  "
+                f"data {self.data_seconds * per_date:8.2f} ms  "
+                f"estimate {self.estimate_seconds * per_date:8.2f} ms  "
+                f"solve {self.solve_seconds * per_date:8.2f} ms  per mark date and strategy")
+
+
+def scaling_benchmark(n_tickers: list[int] = (30, 250, 1000, 2000),
+                      strategies: list[PortfolioStrategy] = (PortfolioStrategy.SINGLE_FACTOR,
+                                                             PortfolioStrategy.CONSTANT_CORRELATION,
+                                                             PortfolioStrategy.STATISTICAL_FACTOR),
+                      start_date: date = date(2017, 1, 1),
+                      n_mark_dates: int = 12,
+                      sample_months: int = 60,
+                      backend: str = 'numpy') -> list[ScalingResult]:
+    """Time the data, estimate and solve steps of monthly rebalances over synthetic panels.
+
+    The sample covariance of more tickers than sample_months is singular, so
+    SAMPLE_COVARIANCE is left out of the default strategies.
+    """
+    saved_panel, saved_store = data._returns_panel, get_estimate_store()
+    results = []
+    try:
+        for n in n_tickers:
+            set_returns_panel(synthetic_panel(n))
+            # estimates of synthetic data must not reach the shared cache
+            set_estimate_store(EstimateStore(maxsize=1, persist=False))
+            portfolios._rolling_estimators.clear()
+
+            universe = TopMarketCap(n)
+            timings = np.zeros(3)
+            n_universe = 0
+            for strategy in strategies:
+                for k in range(n_mark_dates):
+                    mark_date = start_date + relativedelta(months=k)
+
+                    start = time.perf_counter()
+                    tickers = universe.select(mark_date, sample_months)
+                    get_in_sample_returns(mark_date, sample_months, tickers)
+                    get_market_returns(mark_date, mark_date + relativedelta(months=1), tickers)
+                    selected = time.perf_counter()
+                    expected_returns, covariance = portfolios._estimate(mark_date, strategy, sample_months, tickers)
+                    estimated = time.perf_counter()
+                    session = get_session(len(tickers), backend)
+                    session.relabel(tickers)
+                    session.solve(expected_returns, covariance, expected_returns.mean())
+                    solved = time.perf_counter()
+
+                    timings += (selected - start, estimated - selected, solved - estimated)
+                    n_universe = len(tickers)
+
+            result = ScalingResult(n, n_universe, *timings, n_mark_dates * len(strategies))
+            print(result)
+            results.append(result)
+    finally:
+        set_returns_panel(saved_panel)
+        set_estimate_store(saved_store)
+        portfolios._rolling_estimators.clear()
+
+    return results
+
+
+def write_synthetic_data(directory: Path,
+                         n_tickers: int,
+                         n_months: int,
+                         first_month: str = '2000-01',
+                         ragged: float = 0.2,
+                         seed: int = 0,
+                         frequency: Frequency = Frequency.MONTHLY) -> Path:
+    """Write monthly-return-capitalization.csv and risk-free.csv of a synthetic_panel()
+    to directory, with the columns and date format of the real data files.
+
+    With Frequency.DAILY, the daily data files of 21 trading days (weekdays) per month
+    are written instead.
+    """
+    import pandas as pd
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    n_periods = n_months * frequency.periods_per_month
+    panel = synthetic_panel(n_tickers, n_periods, first_month, ragged, seed, frequency.periods_per_month)
+    rng = np.random.default_rng(seed + 1)
+
+    if frequency is Frequency.MONTHLY:
+        # last day of each month, formatted like 1/29/2010
+        days = (panel.months + 1).astype('datetime64[D]') - 1
+    else:
+        days = np.busday_offset(np.datetime64(first_month, 'D'), np.arange(n_periods), roll='forward')
+    dates = np.array([f'{d.month}/{d.day}/{d.year}' for d in days.astype(object)])
+    prefix = 'Monthly' if frequency is Frequency.MONTHLY else 'Daily'
+
+    rows, cols = np.nonzero(~np.isnan(panel.total_return.T))
+    shares = rng.integers(10_000, 10_000_000, n_tickers)
+    market_cap = panel.market_cap.T[rows, cols]
+    mrc = pd.DataFrame({
+        'Header CUSIP -8 Characters': np.array([f'{k:08d}' for k in rng.integers(0, 10**8, n_tickers)])[rows],
+        'Ticker': np.array(panel.tickers)[rows],
+        'PERMCO': rng.integers(10_000, 60_000, n_tickers)[rows],
+        f'{prefix} Calendar Date': dates[cols],
+        f'{prefix} Price': market_cap / shares[rows],
+        f'{prefix} Market Capitalization': market_cap,
+        f'{prefix} Total Return': panel.total_return.T[rows, cols],
+        'Shares Outstanding': shares[rows],
+    })
+    returns_file, risk_free_file = frequency.data_files
+    mrc.to_csv(directory / returns_file, index=False)
+
+    bonds = ['30 Year Bond Returns', '20 Year Bond Returns', '10 Year Bond Returns', '7 Year Bond Returns',
+             '5 Year Bond Returns', '2 Year Bond Returns', '1 Year Bond Returns', '90 Day Bill Returns',
+             '30 Day Bill Returns', 'Rate of Change in Consumer Price Index']
+    risk_free = pd.DataFrame({'Calendar Date': dates,
+                              **{name: rng.normal(0.002, 0.01, n_periods) for name in bonds}})
+    risk_free['10 Year Bond Returns'] = panel.risk_free
+    risk_free.to_csv(directory / risk_free_file, index=False)
+
+    return directory
+
+
+@dataclass
+class BenchmarkSize:
+    n_tickers: int
+    sample_months: int
+    """Months in each estimation window, the data has n_mark_dates + 1 months more"""
+    n_mark_dates: int = 6
+
+    @property
+    def n_months(self) -> int:
+        return self.sample_months + self.n_mark_dates + 1
+
+
+DEFAULT_SIZES = (BenchmarkSize(30, 60), BenchmarkSize(300, 120), BenchmarkSize(1000, 240), BenchmarkSize(3000, 600))
+"""From the size of the real data to a large universe with a long history"""
+
+BENCHMARK_DIR = Path(__file__).resolve().parent.parent / 'benchmarks'
+"""benchmarks/ next to the ropacea/ package, for results and golden outputs"""
+
+
+def time_stages(size: BenchmarkSize,
+                strategies: list[PortfolioStrategy] = tuple(PortfolioStrategy),
+                backend: str = 'numpy') -> dict:
+    """Time each stage of the pipeline on the data files of ROPACEA_DATA_DIR.
+
+    Meant for a fresh interpreter, so that the first load ingests the CSV files. The
+    universe at each mark date is every ticker with a full window (FullHistory).
+    """
+    from ropacea.universe import FullHistory
+    from ropacea.solvers import set_default_backend
+    from ropacea.backtest import backtest_loop
+    from ropacea.statistical_factor import statistical_factor
+    from ropacea.Single_factor import single_factor
+    from ropacea.const_corr import constant_corr
+    from ropacea.scs import scs
+
+    set_default_backend(backend)
+    set_estimate_store(EstimateStore(persist=False))
+    timer = StageTimer()
+
+    with timer.time('ingest'):
+        data.get_returns_panel()
+    # again from the columnar copies
+    data.reload_data()
+    with timer.time('load'):
+        data.get_returns_panel()
+        data.read_monthly_return_capitalization()
+
+    panel = data.get_returns_panel()
+    first_mark_date = panel.months[size.sample_months].astype(object)
+    mark_dates = [first_mark_date + relativedelta(months=k) for k in range(size.n_mark_dates)]
+    universe = FullHistory()
+    batch_estimators = {
+        PortfolioStrategy.SINGLE_FACTOR: single_factor,
+        PortfolioStrategy.CONSTANT_CORRELATION: constant_corr,
+        PortfolioStrategy.SAMPLE_COVARIANCE: scs,
+        PortfolioStrategy.STATISTICAL_FACTOR: statistical_factor,
+    }
+
+    for mark_date in mark_dates:
+        tickers = universe.select(mark_date, size.sample_months)
+        with timer.time('get_in_sample_data'):
+            in_sample = data.get_in_sample_data(mark_date, size.sample_months, tickers)
+
+        for strategy in strategies:
+            if strategy not in batch_estimators:
+                continue
+            with timer.time(f'estimator {strategy.name}'):
+                batch_estimators[strategy](in_sample)
+            with timer.time(f'rolling_estimate {strategy.name}'):
+                expected_returns, covariance = portfolios._compute_estimate(
+                    mark_date, strategy, size.sample_months, tickers)
+            with timer.time(f'_min_risk_model {strategy.name}'):
+                portfolios._min_risk_model(expected_returns, covariance, expected_returns.mean(), tickers=tickers)
+
+    portfolios._rolling_estimators.clear()
+    for strategy in strategies:
+        set_estimate_store(EstimateStore(persist=False))
+        with timer.time(f'backtest_loop {strategy.name}'), instrumented() as run:
+            backtest_loop(mark_dates[0], mark_dates[-1] + relativedelta(days=1), strategy,
+                          sample_months=size.sample_months, universe=universe)
+        # where the time of the backtest went
+        for stage, (seconds, calls) in run.timer.stages.items():
+            timer.add(f'backtest_loop {strategy.name} {stage}', seconds, calls)
+
+    return {'n_tickers': size.n_tickers, 'sample_months': size.sample_months, 'n_months': size.n_months,
+            'n_mark_dates': size.n_mark_dates, 'n_universe': len(tickers), 'backend': backend,
+            'stages': timer.to_dict()}
+
+
+def benchmark_suite(sizes: list[BenchmarkSize] = DEFAULT_SIZES,
+                    backend: str = 'numpy',
+                    output: Path = None,
+                    seed: int = 0) -> dict:
+    """Run time_stages() on synthetic data files of every size, each in a fresh interpreter.
+
+    Writes the results to output, by default benchmarks/<commit>.json.
+    """
+    report = {'commit': _git_commit(), 'created': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'numpy': np.__version__, 'results': []}
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            write_synthetic_data(directory, size.n_tickers, size.n_months, seed=seed)
+            result = _run_in_data_dir(directory, f"time_stages(BenchmarkSize{(size.n_tickers, size.sample_months, size.n_mark_dates)}, backend={backend!r})")
+        report['results'].append(result)
+
+        print(f"N={size.n_tickers:5d} T={size.sample_months:4d}")
+        for stage, timing in result['stages'].items():
+            print(f"    {stage:<40s} {timing['ms_per_call']:10.2f} ms x {timing['calls']}")
+
+    output = Path(output) if output is not None else BENCHMARK_DIR / f"{report['commit'] or 'results'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=1))
+    print(f"written to {output}")
+    return report
+
+
+def compare_benchmarks(old: Path, new: Path, threshold: float = 1.2) -> list[tuple]:
+    """Stages at least threshold times slower in the benchmark_suite() results new than in old"""
+    old_results, new_results = (
+        {(r['n_tickers'], r['sample_months']): r['stages'] for r in json.loads(Path(path).read_text())['results']}
+        for path in (old, new)
+    )
+    regressions = []
+    for size, stages in new_results.items():
+        for stage, timing in stages.items():
+            before = old_results.get(size, {}).get(stage)
+            if before is not None and timing['ms_per_call'] >= threshold * before['ms_per_call']:
+                regressions.append((size, stage, before['ms_per_call'], timing['ms_per_call']))
+
+    for (n_tickers, sample_months), stage, before, after in regressions:
+        print(f"N={n_tickers} T={sample_months} {stage}: {before:.2f} ms -> {after:.2f} ms")
+    return regressions
+
+
+GOLDEN_SIZE = BenchmarkSize(40, 36, n_mark_dates=24)
+GOLDEN_PATH = BENCHMARK_DIR / 'golden.json'
+
+
+def golden_outputs(size: BenchmarkSize = GOLDEN_SIZE) -> dict:
+    """Monthly excess returns and last holdings of every strategy backtested on the data
+    files of ROPACEA_DATA_DIR, with the deterministic numpy solver"""
+    from ropacea.universe import FullHistory
+    from ropacea.solvers import set_default_backend
+    from ropacea.backtest import backtest_loop
+
+    set_default_backend('numpy')
+    set_estimate_store(EstimateStore(persist=False))
+
+    panel = data.get_returns_panel()
+    start_date = panel.months[size.sample_months].astype(object)
+    end_date = start_date + relativedelta(months=size.n_mark_dates)
+
+    outputs = {}
+    for strategy in PortfolioStrategy:
+        results = backtest_loop(start_date, end_date, strategy, sample_months=size.sample_months,
+                                universe=FullHistory())
+        outputs[strategy.name] = {
+            'excess_returns': [float(result.excess_return) for result in results],
+            'holdings': [float(h) for h in results[-1].portfolio.holdings],
+        }
+    return outputs
+
+
+def check_golden(update: bool = False, rtol: float = 1e-8, path: Path = GOLDEN_PATH) -> bool:
+    """Compare golden_outputs() of synthetic data with those saved in path, or save them if update"""
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_data(directory, GOLDEN_SIZE.n_tickers, GOLDEN_SIZE.n_months)
+        outputs = _run_in_data_dir(directory, 'golden_outputs()')
+
+    if update:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(outputs, indent=1))
+        print(f"golden outputs written to {path}")
+        return True
+
+    golden = json.loads(path.read_text())
+    ok = True
+    for strategy, expected in golden.items():
+        if strategy not in outputs:
+            print(f"{strategy:<22s} missing")
+            ok = False
+            continue
+        difference = max(np.abs(np.subtract(outputs[strategy][key], expected[key])).max() for key in expected)
+        scale = max(np.abs(expected[key]).max() for key in expected)
+        same = difference <= rtol * scale
+        ok &= same
+        print(f"{strategy:<22s} max abs difference {difference:.1e}  {'ok' if same else 'CHANGED'}")
+    return ok
+
+
+def time_daily_backtest(years: int,
+                        sample_months: int,
+                        strategies: list[PortfolioStrategy],
+                        frequency: relativedelta) -> dict:
+    """Seconds of a backtest_loop() of each strategy over years of the daily data files
+    of ROPACEA_DATA_DIR from the first full window, meant for a fresh interpreter with
+    ROPACEA_FREQUENCY=daily"""
+    from ropacea.universe import FullHistory
+    from ropacea.solvers import set_default_backend
+    from ropacea.backtest import backtest_loop
+
+    set_default_backend('numpy')
+    timer = StageTimer()
+    with timer.time('load'):
+        panel = data.get_returns_panel()
+
+    start_date = panel.months[panel.sample_rows(sample_months)].astype(object)
+    end_date = start_date + relativedelta(years=years)
+    for strategy in strategies:
+        set_estimate_store(EstimateStore(persist=False))
+        with timer.time(f'backtest_loop {strategy.name}'), instrumented() as run:
+            n_mark_dates = len(backtest_loop(start_date, end_date, strategy, frequency,
+                                             sample_months=sample_months, universe=FullHistory()))
+        for stage, (seconds, calls) in run.timer.stages.items():
+            timer.add(f'backtest_loop {strategy.name} {stage}', seconds, calls)
+
+    return {'n_rows': len(panel.months), 'n_tickers': len(panel.tickers), 'n_mark_dates': n_mark_dates,
+            'stages': timer.to_dict()}
+
+
+def daily_benchmark(n_tickers: int = 100,
+                    years: int = 10,
+                    sample_months: int = 12,
+                    strategies: list[PortfolioStrategy] = tuple(PortfolioStrategy),
+                    frequency: relativedelta = relativedelta(weeks=1),
+                    seed: int = 0) -> dict:
+    """Time a weekly rebalanced backtest of years on synthetic daily data files of n_tickers"""
+    with tempfile.TemporaryDirectory() as directory:
+        # 21 trading days per month, a few weeks more to cover the calendar years
+        write_synthetic_data(directory, n_tickers, years * 13 + sample_months, seed=seed,
+                             frequency=Frequency.DAILY)
+        result = _run_in_data_dir(directory, f"time_daily_backtest({years}, {sample_months}, "
+                                             f"[{', '.join(f'PortfolioStrategy.{s.name}' for s in strategies)}], "
+                                             f"{frequency!r})",
+                                  frequency=Frequency.DAILY)
+
+    print(f"{result['n_mark_dates']} mark dates, {result['n_rows']} days x {result['n_tickers']} tickers")
+    for stage, timing in result['stages'].items():
+        print(f"    {stage:<50s} {timing['seconds']:10.2f} s")
+    return result
+
+
+def _run_in_data_dir(directory: Path, call: str, frequency: Frequency = Frequency.MONTHLY):
+    """Evaluate call in this module in a fresh interpreter reading its data files of
+    frequency from directory"""
+    with tempfile.TemporaryDirectory() as output_directory:
+        output = Path(output_directory) / 'output.json'
+        script = (
+            "import json\n"
+            "from ropacea.benchmarks import *\n"
+            f"open({str(output)!r}, 'w').write(json.dumps({call}))\n"
+        )
+        subprocess.run([sys.executable, '-c', script], check=True,
+                       env={**os.environ, 'ROPACEA_DATA_DIR': str(directory), 'ROPACEA_FREQUENCY': frequency.value})
+        return json.loads(output.read_text())
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'scaling'
+    if command == 'suite':
+        benchmark_suite()
+    elif command == 'golden':
+        sys.exit(0 if check_golden(update='--update' in sys.argv) else 1)
+    elif command == 'daily':
+        daily_benchmark()
+    else:
+        scaling_benchmark()
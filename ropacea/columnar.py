@@ -0,0 +1,172 @@
+"""Columnar binary copies of the CSV data files.
+
+The first read of a CSV ingests it once into a directory of .npy files, one per column:
+ - string columns are stored as categorical int32 codes plus their categories
+ - date columns are stored as datetime64[D]
+ - float columns are stored as float64, or float32 if requested
+
+Later reads memory-map only the columns they need. A manifest records the size,
+modification time and digest of the source file, and the copy is rebuilt when the
+source changes.
+
+    >>> table = load_table(DATA_DIR / 'risk-free.csv', CACHE_DIR / 'columnar',
+    ...                    TableSpec(date_columns=('Calendar Date',)))
+    >>> table.columns['10 Year Bond Returns']
+"""
+
+
+import json
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    """How to ingest a CSV file"""
+
+    date_columns: tuple = ()
+    date_format: str = '%m/%d/%Y'
+    unique_columns: tuple = ()
+    """Drop rows repeating these columns, keeping the first"""
+    sort_column: str = None
+    """Stable sort of the rows by this column"""
+    float_dtype: str = 'float64'
+
+
+@dataclass
+class ColumnarTable:
+    """Columns of an ingested file. Categorical columns hold codes into categories."""
+
+    columns: dict = field(default_factory=dict)
+    categories: dict = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def decode(self, name: str) -> np.ndarray:
+        """Values of a categorical column"""
+        return self.categories[name][self.columns[name]]
+
+    def take(self, rows) -> 'ColumnarTable':
+        """Table with a subset of the rows"""
+        return ColumnarTable({name: column[rows] for name, column in self.columns.items()},
+                             self.categories)
+
+    def to_frame(self) -> 'pd.DataFrame':
+        import pandas as pd
+
+        return pd.DataFrame({
+            name: self.decode(name) if name in self.categories else column
+            for name, column in self.columns.items()
+        })
+
+
+def load_table(source: Path, cache_dir: Path, spec: TableSpec, columns: list[str] = None) -> ColumnarTable:
+    """Memory-map the requested columns (all if None) of the binary copy of source,
+    ingesting it first if the copy is missing or stale."""
+    directory = Path(cache_dir) / Path(source).stem
+    manifest = _read_manifest(directory)
+
+    if not _is_fresh(manifest, Path(source), spec):
+        manifest = ingest(source, directory, spec)
+
+    table = ColumnarTable()
+    for name in columns if columns is not None else manifest['columns']:
+        if name not in manifest['columns']:
+            raise KeyError(f"{name!r} is not a column of {source}")
+        table.columns[name] = np.load(directory / manifest['columns'][name], mmap_mode='r')
+        if name in manifest['categories']:
+            table.categories[name] = np.load(directory / manifest['categories'][name])
+    return table
+
+
+def ingest(source: Path, directory: Path, spec: TableSpec) -> dict:
+    """Write the columns of source to .npy files in directory and return the manifest"""
+    import pandas as pd
+
+    source = Path(source)
+    frame = pd.read_csv(source)
+
+    for name in spec.date_columns:
+        frame[name] = pd.to_datetime(frame[name], format=spec.date_format)
+    if spec.unique_columns:
+        frame = frame.drop_duplicates(subset=list(spec.unique_columns), keep='first')
+    if spec.sort_column is not None:
+        frame = frame.sort_values(spec.sort_column, kind='stable')
+
+    # write everything to a fresh directory, then swap it in
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f'.{directory.name}-'))
+
+    manifest = {'columns': {}, 'categories': {}, 'rows': len(frame)}
+    for k, name in enumerate(frame.columns):
+        values = frame[name]
+        file_name = f'{k:03d}.npy'
+        if name in spec.date_columns:
+            array = values.values.astype('datetime64[D]')
+        elif pd.api.types.is_float_dtype(values):
+            array = values.values.astype(spec.float_dtype)
+        elif pd.api.types.is_numeric_dtype(values):
+            array = values.values
+        else:
+            codes, categories = pd.factorize(values.astype(str), sort=True)
+            array = codes.astype(np.int32)
+            categories_file = f'{k:03d}.categories.npy'
+            np.save(staging / categories_file, np.asarray(categories, dtype=str))
+            manifest['categories'][name] = categories_file
+        np.save(staging / file_name, np.ascontiguousarray(array))
+        manifest['columns'][name] = file_name
+
+    stat = source.stat()
+    manifest['source'] = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': _digest(source),
+    }
+    manifest['spec'] = _spec_fields(spec)
+    (staging / 'manifest.json').write_text(json.dumps(manifest, indent=1))
+
+    if directory.exists():
+        shutil.rmtree(directory, ignore_errors=True)
+    try:
+        staging.rename(directory)
+    except OSError:
+        # another process ingested the same file at the same time
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return manifest
+
+
+def _read_manifest(directory: Path) -> dict:
+    try:
+        return json.loads((directory / 'manifest.json').read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _is_fresh(manifest: dict, source: Path, spec: TableSpec) -> bool:
+    if manifest is None or manifest.get('spec') != _spec_fields(spec):
+        return False
+    stat = source.stat()
+    recorded = manifest['source']
+    if (stat.st_size, stat.st_mtime_ns) == (recorded['size'], recorded['mtime_ns']):
+        return True
+    # touched but maybe not changed
+    return stat.st_size == recorded['size'] and _digest(source) == recorded['sha256']
+
+
+def _spec_fields(spec: TableSpec) -> dict:
+    return json.loads(json.dumps(spec.__dict__))
+
+
+def _digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
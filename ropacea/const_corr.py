@@ -1,5 +1,6 @@
 from datetime import date
-import data
+from ropacea.data import get_in_sample_data
+from ropacea.covariance import FactorCovariance
 import numpy as np
 import pandas as pd
 
@@ -29,9 +30,9 @@ def constant_corr(import_data):
 
 
     # Construct Covariance Matrix using Constant Correlation Model
-    V = avg_corr * np.dot(sigma.values, sigma.values.T) + (1 - avg_corr) * np.diag(sigma.values)**2
+    V = constant_corr_covariance(sigma.values, avg_corr)
     #V = rho.values * np.dot(sigma.values, sigma.values.T) + (1 - rho.values) * np.diag(sigma.values)**2
-    V_df = pd.DataFrame(V, index=rho.index, columns=rho.columns)
+    # V_df = pd.DataFrame(np.asarray(V), index=rho.index, columns=rho.columns)
 
     # print("Constant Correlation Covariance Matrix:")
     # print(V_df)
@@ -45,11 +46,20 @@ def constant_corr(import_data):
     # # Export the DataFrame to Excel
     # V_df.to_excel(excel_file_path, index=True)
 
+def constant_corr_covariance(sigma: np.ndarray, avg_corr: float) -> FactorCovariance:
+    """Covariance matrix of the constant correlation model from the individual
+    volatilities sigma and the average pairwise correlation avg_corr.
+
+    V = avg_corr * sigma sigma' + (1 - avg_corr) * diag(sigma**2), kept as a one
+    factor model with loadings sigma."""
+    sigma = np.asarray(sigma, dtype=float)
+    return FactorCovariance(sigma[:, None], [[avg_corr]], (1 - avg_corr) * sigma**2)
+
 # test functionality
 if __name__ == '__main__':
     mark_date = date(year = 2017, month=1, day=1)
     sample_months = 60
-    data = data.get_in_sample_data(mark_date, sample_months)
+    data = get_in_sample_data(mark_date, sample_months)
     out = constant_corr(data)
 
-    print(out)
+    print(np.asarray(out))
@@ -0,0 +1,158 @@
+"""Covariance matrices in the form the estimators produce them.
+
+The single factor and constant correlation models are a low rank part plus a diagonal,
+
+    V = B F B' + diag(D)
+
+with B the (N x K) factor loadings, F the (K x K) factor covariance and D the
+idiosyncratic variances. FactorCovariance keeps the three parts, so storing it and
+multiplying or solving with it costs O(N K) rather than O(N^2) or O(N^3).
+DenseCovariance wraps any other covariance matrix in the same interface, which is
+all the solvers in ropacea.solvers use.
+
+    >>> V = FactorCovariance(beta[:, None], np.array([[market_variance]]), residual_variance)
+    >>> V.solve(np.ones(V.n_assets))
+    >>> np.asarray(V)  # dense N x N matrix
+"""
+
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class FactorCovariance:
+    """V = loadings @ factor_covariance @ loadings.T + diag(idiosyncratic)"""
+
+    loadings: np.ndarray
+    """(N x K) exposure of each asset to each factor"""
+    factor_covariance: np.ndarray
+    """(K x K) covariance of the factors"""
+    idiosyncratic: np.ndarray
+    """(N,) variance of each asset not explained by the factors"""
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'loadings', np.atleast_2d(np.asarray(self.loadings, dtype=float).T).T)
+        object.__setattr__(self, 'factor_covariance', np.atleast_2d(np.asarray(self.factor_covariance, dtype=float)))
+        object.__setattr__(self, 'idiosyncratic', np.asarray(self.idiosyncratic, dtype=float))
+
+    @property
+    def n_assets(self) -> int:
+        return self.loadings.shape[0]
+
+    @property
+    def n_factors(self) -> int:
+        return self.loadings.shape[1]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (self.n_assets, self.n_assets)
+
+    def to_dense(self) -> np.ndarray:
+        return self.loadings @ self.factor_covariance @ self.loadings.T + np.diag(self.idiosyncratic)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self.to_dense().astype(dtype) if dtype is not None else self.to_dense()
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=float)
+        d = self.idiosyncratic if x.ndim == 1 else self.idiosyncratic[:, None]
+        return self.loadings @ (self.factor_covariance @ (self.loadings.T @ x)) + d * x
+
+    def diagonal(self) -> np.ndarray:
+        return np.einsum('ik,kl,il->i', self.loadings, self.factor_covariance, self.loadings) + self.idiosyncratic
+
+    def restrict(self, assets: np.ndarray) -> 'FactorCovariance':
+        """Covariance of a subset of the assets, given as a mask or indices"""
+        return FactorCovariance(self.loadings[assets], self.factor_covariance, self.idiosyncratic[assets])
+
+    def solve(self, rhs: np.ndarray) -> np.ndarray:
+        """V^-1 rhs with the Woodbury identity
+
+            V^-1 = D^-1 - D^-1 B (I + F B' D^-1 B)^-1 F B' D^-1
+
+        which only factors a K x K matrix and does not need F to be invertible.
+        """
+        if (self.idiosyncratic <= 0).any():
+            return np.linalg.solve(self.to_dense(), rhs)
+
+        rhs = np.asarray(rhs, dtype=float)
+        d_inv = 1 / self.idiosyncratic
+        if rhs.ndim == 2:
+            d_inv = d_inv[:, None]
+
+        scaled = d_inv * rhs
+        B, F = self.loadings, self.factor_covariance
+        capacitance = np.eye(self.n_factors) + F @ (B.T @ (B / self.idiosyncratic[:, None]))
+        return scaled - d_inv * (B @ np.linalg.solve(capacitance, F @ (B.T @ scaled)))
+
+    def setflags(self, write: bool) -> None:
+        for array in (self.loadings, self.factor_covariance, self.idiosyncratic):
+            array.setflags(write=write)
+
+
+@dataclass(frozen=True)
+class DenseCovariance:
+    """A plain N x N covariance matrix with the interface of FactorCovariance"""
+
+    matrix: np.ndarray
+
+    @property
+    def n_assets(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.matrix.shape
+
+    def to_dense(self) -> np.ndarray:
+        return self.matrix
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self.matrix.astype(dtype) if dtype is not None else self.matrix
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        return self.matrix @ x
+
+    def diagonal(self) -> np.ndarray:
+        return np.diag(self.matrix)
+
+    def restrict(self, assets: np.ndarray) -> 'DenseCovariance':
+        return DenseCovariance(self.matrix[np.ix_(assets, assets)])
+
+    def solve(self, rhs: np.ndarray) -> np.ndarray:
+        return np.linalg.solve(self.matrix, rhs)
+
+
+Covariance = FactorCovariance | DenseCovariance
+
+
+def as_covariance(covariance) -> Covariance:
+    """FactorCovariance as is, anything else as a DenseCovariance"""
+    if isinstance(covariance, (FactorCovariance, DenseCovariance)):
+        return covariance
+    return DenseCovariance(np.asarray(covariance, dtype=float))
+
+
+def frobenius_inner(a: Covariance | np.ndarray, b: Covariance | np.ndarray) -> float:
+    """Frobenius inner product trace(a b) of two covariances, without forming the
+    N x N matrices when both are FactorCovariance"""
+    a, b = as_covariance(a), as_covariance(b)
+    if not (isinstance(a, FactorCovariance) and isinstance(b, FactorCovariance)):
+        return float((np.asarray(a) * np.asarray(b)).sum())
+
+    # trace(Ba Fa Ba' Bb Fb Bb') with the K x K products only
+    cross = a.loadings.T @ b.loadings
+    common = float(((a.factor_covariance @ cross @ b.factor_covariance) * cross).sum())
+    common_a = a.diagonal() - a.idiosyncratic
+    common_b = b.diagonal() - b.idiosyncratic
+    return (common + float(common_a @ b.idiosyncratic) + float(a.idiosyncratic @ common_b)
+            + float(a.idiosyncratic @ b.idiosyncratic))
+
+
+def relative_change(new: Covariance | np.ndarray, old: Covariance | np.ndarray) -> float:
+    """||new - old||_F / ||old||_F"""
+    old_sq = frobenius_inner(old, old)
+    distance_sq = frobenius_inner(new, new) + old_sq - 2 * frobenius_inner(new, old)
+    return float(np.sqrt(max(distance_sq, 0.0) / old_sq))
@@ -1,24 +1,119 @@
 """Utility functions to read data provided by Dr. Ma.
 
-Also defines the universe of tickers we are using for the rest of analysis.
+Also defines the default universe of tickers we are using for the rest of analysis.
     >>> from ropacea.data import UNIVERSE
+
+The data and the returns panel cover every ticker in the data files. Other universes
+are chosen at each mark date with the rules in ropacea.universe.
+
+Where each ticker has returns is indexed once per panel (ReturnsPanel.coverage), so
+checking a window for missing returns costs O(N). How the estimates treat missing
+returns is a MissingData policy, see set_missing_data_policy().
+
+New data goes into the month partitioned store of ropacea.store instead of replacing
+the data files: ingest_feed() adds the new and changed rows of the files in FEED_DIR,
+and once the store exists the data is read from it.
+    >>> ingest_feed()
+
+The data is monthly, or daily with set_data_frequency(Frequency.DAILY). Daily panels
+have a row per trading day and the in sample windows count 21 trading days per month;
+returns over a holding period are compounded over its rows.
+    >>> set_data_frequency('daily')
 """
 
 
 import os
-import pandas as pd
+import hashlib
+import logging
+import numpy as np
 from pathlib import Path
-from functools import lru_cache
+from functools import lru_cache, cached_property
+from dataclasses import dataclass
+from enum import Enum
+from typing import TYPE_CHECKING
 
 from datetime import date
-from dateutil.relativedelta import relativedelta
 
-# change working directory to be the ropacea/ module folder
-os.chdir(os.path.dirname(__file__))
+from ropacea.columnar import ColumnarTable, TableSpec, load_table
+from ropacea.store import IngestReport, PartitionedTable
+from ropacea.instrumentation import count
+
+if TYPE_CHECKING:
+    # pandas is only imported when a DataFrame is first requested
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(os.environ.get('ROPACEA_DATA_DIR', Path(__file__).resolve().parent.parent / 'data'))
+"""The data/ folder next to the ropacea/ package, unless ROPACEA_DATA_DIR is set"""
+
+DATA_FILES = ('monthly-return-capitalization.csv', 'risk-free.csv')
+"""Files read from DATA_DIR for monthly data"""
+
+DAILY_DATA_FILES = ('daily-return-capitalization.csv', 'daily-risk-free.csv')
+"""Files read from DATA_DIR for daily data, see Frequency"""
+
+CACHE_DIR = DATA_DIR / 'cache'
+"""Where results derived from the data files are cached"""
+
+COLUMNAR_DIR = CACHE_DIR / 'columnar'
+"""Columnar binary copies of the data files, see ropacea.columnar"""
+
+STORE_DIR = DATA_DIR / 'store'
+"""Month partitioned store of the data, see ropacea.store. Read instead of the data
+files once ingest_feed() has created it"""
+
+FEED_DIR = Path(os.environ.get('ROPACEA_FEED_DIR', DATA_DIR / 'feed'))
+"""Local directory of new data files, standing in for the vendor feed"""
+
+class MissingData(Enum):
+    """How estimates treat the returns missing from a ticker's window"""
 
-DATA_DIR = Path('../data')
+    DROP = 'drop'
+    """Leave out the tickers without a return in every month of the window"""
+    FORWARD_FILL = 'ffill'
+    """Repeat a ticker's last return over its gaps, months before its first return stay missing"""
+    PAIRWISE = 'pairwise'
+    """Estimate each variance and covariance from the months with returns of both tickers"""
 
-UNIVERSE= [
+
+_missing_data_policy = MissingData(os.environ.get('ROPACEA_MISSING_DATA', MissingData.PAIRWISE.value))
+
+
+class Frequency(Enum):
+    """Frequency of the rows of the data, and of the returns in them"""
+
+    MONTHLY = 'monthly'
+    """One row per month, from DATA_FILES"""
+    DAILY = 'daily'
+    """One row per trading day, from DAILY_DATA_FILES"""
+
+    @property
+    def data_files(self) -> tuple[str, str]:
+        """Returns and risk free files read from DATA_DIR"""
+        return DATA_FILES if self is Frequency.MONTHLY else DAILY_DATA_FILES
+
+    @property
+    def periods_per_year(self) -> int:
+        return 12 if self is Frequency.MONTHLY else TRADING_DAYS_PER_YEAR
+
+    @property
+    def periods_per_month(self) -> int:
+        """Rows of a window per month of sample_months"""
+        return 1 if self is Frequency.MONTHLY else TRADING_DAYS_PER_YEAR // 12
+
+
+TRADING_DAYS_PER_YEAR = 252
+
+_frequency = Frequency(os.environ.get('ROPACEA_FREQUENCY', Frequency.MONTHLY.value))
+
+MIN_OBSERVATIONS = 2
+"""Fewest returns in its window a ticker needs to be estimated under any policy"""
+
+FLOAT_DTYPE = os.environ.get('ROPACEA_FLOAT_DTYPE', 'float64')
+"""Storage type of the float columns, set ROPACEA_FLOAT_DTYPE=float32 to halve their size"""
+
+UNIVERSE = [
     'AAPL',
     'ABT',
     'ADBE',
@@ -53,118 +148,557 @@ UNIVERSE= [
 
 
 
-@lru_cache(maxsize=None)
-def read_monthly_return_capitalization() -> pd.DataFrame:
+def data_fingerprint() -> str:
     """
-    Returns monthly-return-capitalization filtered to the stock universe.
-
-    Also drops duplicate values
+    Hex digest of the contents of the data files. Changes whenever one of them does,
+    so it can key anything derived from the data.
     """
-    #mrc = pd.read_excel(DATA_DIR / 'monthly-return-capitalization.xlsx')
-    mrc = pd.read_csv(DATA_DIR / 'monthly-return-capitalization.csv', parse_dates=[3])
-    #parse_dates=[4]) # parse the 'Monthly Calendar Date' col as date
-    mrc = mrc[mrc['Ticker'].isin(UNIVERSE)]
+    digest = hashlib.sha256()
+    for name in _frequency.data_files:
+        store = data_store(Path(name).stem)
+        # the manifest lists every part file of the store
+        path = store.manifest_path if store.exists() else DATA_DIR / name
+        digest.update(name.encode())
+        digest.update(_file_digest(path, path.stat().st_mtime_ns, path.stat().st_size))
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _file_digest(path: Path, mtime_ns: int, size: int) -> bytes:
+    # keyed on the modification time and size so unchanged files are hashed once
+    return hashlib.sha256(path.read_bytes()).digest()
 
+
+MRC_SPEC = TableSpec(
+    date_columns=('Monthly Calendar Date',),
     # drop duplicate values, keep the first
-    mrc = mrc.drop_duplicates(subset=['Ticker', 'Monthly Calendar Date'], keep='first')
+    unique_columns=('Ticker', 'Monthly Calendar Date'),
+    # sort by month so windows are contiguous
+    sort_column='Monthly Calendar Date',
+    float_dtype=FLOAT_DTYPE,
+)
+"""Ingestion of monthly-return-capitalization.csv into the columnar store"""
+
+MRC_COLUMNS = ('Ticker', 'Monthly Calendar Date', 'Monthly Market Capitalization', 'Monthly Total Return')
+"""Columns of monthly-return-capitalization used by the analysis"""
+
+DAILY_SPEC = TableSpec(
+    date_columns=('Daily Calendar Date',),
+    unique_columns=('Ticker', 'Daily Calendar Date'),
+    sort_column='Daily Calendar Date',
+    float_dtype=FLOAT_DTYPE,
+)
+"""Ingestion of daily-return-capitalization.csv into the columnar store"""
+
+DAILY_COLUMNS = ('Ticker', 'Daily Calendar Date', 'Daily Market Capitalization', 'Daily Total Return')
+"""Columns of daily-return-capitalization used by the analysis, in the order of MRC_COLUMNS"""
+
+RISK_FREE_SPEC = TableSpec(date_columns=('Calendar Date',), float_dtype=FLOAT_DTYPE)
+"""Ingestion of risk-free.csv into the columnar store"""
+
+_RISK_FREE_STORE_SPEC = TableSpec(date_columns=('Calendar Date',), unique_columns=('Calendar Date',),
+                                  sort_column='Calendar Date', float_dtype=FLOAT_DTYPE)
+
+STORE_SPECS = {
+    'monthly-return-capitalization': MRC_SPEC,
+    'risk-free': _RISK_FREE_STORE_SPEC,
+    'daily-return-capitalization': DAILY_SPEC,
+    'daily-risk-free': _RISK_FREE_STORE_SPEC,
+}
+"""How each data file is kept in the partitioned store, by file stem"""
 
-    return mrc
+
+@lru_cache(maxsize=None)
+def data_store(name: str) -> PartitionedTable:
+    """Partitioned store of the data file with stem name, e.g. 'risk-free'"""
+    return PartitionedTable(STORE_DIR / name, STORE_SPECS[name])
+
+
+@lru_cache(maxsize=None)
+def _monthly_return_capitalization_table() -> ColumnarTable:
+    """Returns of the data frequency, daily ones under the MRC_COLUMNS names"""
+    name = _frequency.data_files[0]
+    spec, columns = (MRC_SPEC, MRC_COLUMNS) if _frequency is Frequency.MONTHLY else (DAILY_SPEC, DAILY_COLUMNS)
+
+    store = data_store(Path(name).stem)
+    table = store.read(columns) if store.exists() else load_table(DATA_DIR / name, COLUMNAR_DIR, spec, columns)
+    if columns is MRC_COLUMNS:
+        return table
+    # the DataFrame estimators read the monthly column names
+    renamed = dict(zip(DAILY_COLUMNS, MRC_COLUMNS))
+    return ColumnarTable({renamed[name]: column for name, column in table.columns.items()},
+                         {renamed[name]: values for name, values in table.categories.items()})
+
+
+@lru_cache(maxsize=None)
+def _risk_free_table() -> ColumnarTable:
+    name = _frequency.data_files[1]
+    store = data_store(Path(name).stem)
+    if store.exists():
+        return store.read()
+    return load_table(DATA_DIR / name, COLUMNAR_DIR, RISK_FREE_SPEC)
+
+
+def set_data_frequency(frequency: Frequency | str) -> None:
+    """Read the data files of the frequency, a Frequency or its value ('monthly' or
+    'daily'). Also set by the ROPACEA_FREQUENCY environment variable, MONTHLY by default."""
+    global _frequency
+    _frequency = Frequency(frequency)
+    reload_data()
+
+
+def get_data_frequency() -> Frequency:
+    return _frequency
+
+
+def ingest_feed(feed_dir: Path = FEED_DIR, mode: str = 'upsert') -> dict[str, IngestReport]:
+    """Ingest the new and changed CSV files of feed_dir into the partitioned store and
+    return what each file changed, by file name.
+
+    A file belongs to the data file whose stem starts its name, e.g.
+    monthly-return-capitalization-2024-06.csv, and has the same columns. Files already
+    ingested with the same contents are skipped. A store is first filled from its data
+    file in DATA_DIR, so the feed only needs the new months. The data read afterwards,
+    in this process or another, comes from the store.
+    """
+    reports = {}
+    for name in _frequency.data_files:
+        store = data_store(Path(name).stem)
+        if not store.exists() and (DATA_DIR / name).exists():
+            reports[name] = store.ingest_file(DATA_DIR / name, mode='append')
+
+    for path in sorted(Path(feed_dir).glob('*.csv')):
+        stems = [stem for stem in STORE_SPECS if path.stem.startswith(stem)]
+        if not stems:
+            logger.warning("Skipping %s, it is not a feed of any data file", path.name)
+            continue
+        reports[path.name] = data_store(max(stems, key=len)).ingest_file(path, mode)
+
+    for name, report in reports.items():
+        logger.info("ingested %s: %s", name, report, extra={'months': len(report.months)})
+    if any(report.months for report in reports.values()):
+        reload_data()
+    return reports
+
+
+def reload_data() -> None:
+    """Forget the data read so far, so the next reads see the latest data. Only the
+    months of the store changed since the last read are loaded again."""
+    for cached in (_monthly_return_capitalization_table, _risk_free_table, _build_returns_panel,
+                   read_monthly_return_capitalization, read_risk_free):
+        cached.cache_clear()
 
 
 @lru_cache(maxsize=None)
-def read_risk_free() -> pd.DataFrame:
+def read_monthly_return_capitalization() -> 'pd.DataFrame':
+    """
+    Returns monthly-return-capitalization of every ticker in the file.
 
-    rf = pd.read_csv(DATA_DIR / "risk-free.csv", parse_dates=[0])
+    Also drops duplicate values. Rows are sorted by month (stable, so the file order is
+    kept within a month) so that any range of months is a contiguous block of rows.
+    Only the MRC_COLUMNS are loaded, from the columnar copy of the CSV.
+    """
+    return _monthly_return_capitalization_table().to_frame()
+
+
+@lru_cache(maxsize=None)
+def read_risk_free() -> 'pd.DataFrame':
+
+    rf = _risk_free_table().to_frame()
 
     return rf
-    
+
+
+@dataclass(frozen=True)
+class Coverage:
+    """Where each ticker of a ReturnsPanel has returns"""
+
+    observed: np.ndarray
+    """(T+1 x N) number of returns of each ticker before each row"""
+    first_month: np.ndarray
+    """(N,) row of each ticker's first return, -1 without any"""
+    last_month: np.ndarray
+    """(N,) row of each ticker's last return, -1 without any"""
+    gaps: np.ndarray
+    """(N,) months without a return between each ticker's first and last"""
+
+    @classmethod
+    def of(cls, total_return: np.ndarray) -> 'Coverage':
+        has_return = ~np.isnan(total_return)
+        observed = np.zeros((total_return.shape[0] + 1, total_return.shape[1]), dtype=np.int32)
+        np.cumsum(has_return, axis=0, out=observed[1:])
+
+        count = observed[-1]
+        first_month = np.where(count > 0, has_return.argmax(axis=0), -1)
+        last_month = np.where(count > 0, len(has_return) - 1 - has_return[::-1].argmax(axis=0), -1)
+        gaps = np.where(count > 0, last_month - first_month + 1 - count, 0)
+        return cls(observed, first_month, last_month, gaps)
+
+    def count(self, rows: slice) -> np.ndarray:
+        """(N,) returns of each ticker in the rows"""
+        return self.observed[rows.stop] - self.observed[rows.start]
+
+    def complete(self, rows: slice) -> np.ndarray:
+        """(N,) mask of the tickers with a return in each of the rows"""
+        return self.count(rows) == rows.stop - rows.start
+
+
+@dataclass(frozen=True)
+class ReturnsPanel:
+    """Dense period-by-ticker view of monthly-return-capitalization, or of the daily data.
+
+    Row t of every array is the period ``months[t]`` and column j is ``tickers[j]``.
+    Monthly rows are contiguous months, so a date maps to its row with integer
+    arithmetic. Daily rows are the trading days in the data, found by binary search.
+    Either way a range of dates is a plain slice. Missing observations are NaN.
+    """
+
+    months: np.ndarray
+    """datetime64[M] month of each row, datetime64[D] day for a daily panel"""
+    tickers: tuple
+    """column order, every ticker in monthly-return-capitalization sorted alphabetically"""
+    total_return: np.ndarray
+    """(T x N) total returns of each period"""
+    market_cap: np.ndarray
+    """(T x N) market capitalizations at the end of each period"""
+    risk_free: np.ndarray
+    """(T,) 10 year bond returns of each period"""
+    row_offsets: np.ndarray
+    """(T+1,) offsets of each period's rows in read_monthly_return_capitalization()"""
+    frequency: Frequency = Frequency.MONTHLY
+
+    @cached_property
+    def coverage(self) -> Coverage:
+        """Index of the returns of each ticker, computed on first use"""
+        return Coverage.of(self.total_return)
+
+    @cached_property
+    def _column_of(self) -> dict:
+        return {ticker: j for j, ticker in enumerate(self.tickers)}
+
+    def columns(self, tickers: list[str]) -> np.ndarray:
+        """Column of each of the given tickers"""
+        try:
+            return np.array([self._column_of[ticker] for ticker in tickers], dtype=np.intp)
+        except KeyError as e:
+            raise KeyError(f"No data for ticker {e.args[0]!r}") from None
+
+    def month_index(self, d: date) -> int:
+        """Row of the month containing d. May fall outside [0, T] for dates outside the data."""
+        first = self.months[0].astype(object)
+        return (d.year - first.year) * 12 + (d.month - first.month)
+
+    def row_index(self, d: date) -> int:
+        """Row of the period containing d: its month, or the first trading day on or after d.
+        May fall outside [0, T] for dates outside the data."""
+        if self.frequency is Frequency.MONTHLY:
+            return self.month_index(d)
+        return int(np.searchsorted(self.months, np.datetime64(d, 'D')))
+
+    def window(self, start_date: date, end_date: date) -> slice:
+        """Rows for the periods from start_date (inclusive) to end_date (exclusive),
+        clipped to the periods available."""
+        return self._clip(self.row_index(start_date), self.row_index(end_date))
+
+    def sample_rows(self, sample_months: int) -> int:
+        """Rows of a window of sample_months, e.g. 21 trading days per month"""
+        return sample_months * self.frequency.periods_per_month
+
+    def rows_before(self, mark_date: date, n_rows: int) -> slice:
+        """The n_rows rows before mark_date, clipped to the periods available"""
+        end = self.row_index(mark_date)
+        return self._clip(end - n_rows, end)
+
+    def sample_window(self, mark_date: date, sample_months: int) -> slice:
+        """Rows of the in sample window of sample_months before mark_date"""
+        return self.rows_before(mark_date, self.sample_rows(sample_months))
+
+    def _clip(self, start: int, end: int) -> slice:
+        n_rows = len(self.months)
+        start = min(max(start, 0), n_rows)
+        return slice(start, min(max(end, start), n_rows))
+
+
+_returns_panel = None
+"""Panel set with set_returns_panel(), used instead of the one built from the data files"""
+
+
+def set_returns_panel(panel: ReturnsPanel) -> None:
+    """Serve all panel lookups from the given panel, e.g. one backed by shared memory.
+    Pass None to go back to the panel built from the data files."""
+    global _returns_panel
+    _returns_panel = panel
+
+
+def get_returns_panel() -> ReturnsPanel:
+    """
+    Return the ReturnsPanel, built once from the monthly-return-capitalization and risk free data.
+
+    Sample usage:
+        >>> panel = get_returns_panel()
+        >>> rows = panel.window(date(2012, 1, 1), date(2017, 1, 1))
+        >>> panel.total_return[rows][:, panel.columns(UNIVERSE)].shape
+        (60, 30)
+    """
+    if _returns_panel is not None:
+        return _returns_panel
+    return _build_returns_panel()
+
+
+@lru_cache(maxsize=None)
+def _build_returns_panel() -> ReturnsPanel:
+    mrc = _monthly_return_capitalization_table()
+    rf = _risk_free_table()
+
+    if _frequency is Frequency.MONTHLY:
+        mrc_months = mrc.columns['Monthly Calendar Date'].astype('datetime64[M]')
+        rf_months = rf.columns['Calendar Date'].astype('datetime64[M]')
+
+        first = min(mrc_months.min(), rf_months.min())
+        last = max(mrc_months.max(), rf_months.max())
+        months = np.arange(first, last + 1)
+
+        rows = (mrc_months - first).astype(int)
+        rf_rows = (rf_months - first).astype(int)
+    else:
+        # the trading days with returns; risk free rates of other days are left out
+        days = mrc.columns['Monthly Calendar Date'].astype('datetime64[D]')
+        rf_days = rf.columns['Calendar Date'].astype('datetime64[D]')
+        months = np.unique(days)
+
+        rows = np.searchsorted(months, days)
+        rf_rows = np.searchsorted(months, rf_days)
+        trading = (rf_rows < len(months)) & (months[np.minimum(rf_rows, len(months) - 1)] == rf_days)
+        rf = rf.take(trading)
+        rf_rows = rf_rows[trading]
+
+    # the categories are sorted, so the ticker codes are the columns
+    tickers = tuple(mrc.categories['Ticker'].tolist())
+    cols = mrc.columns['Ticker']
+
+    total_return = np.full((len(months), len(tickers)), np.nan)
+    total_return[rows, cols] = mrc.columns['Monthly Total Return']
+    market_cap = np.full((len(months), len(tickers)), np.nan)
+    market_cap[rows, cols] = mrc.columns['Monthly Market Capitalization']
+
+    risk_free = np.full(len(months), np.nan)
+    # keep the first value of a month, like the mask + values[0] lookup did
+    risk_free[rf_rows[::-1]] = rf.columns['10 Year Bond Returns'][::-1]
+
+    # mrc is sorted by date so each period is a contiguous block of rows
+    row_offsets = np.searchsorted(rows, np.arange(len(months) + 1))
+
+    return ReturnsPanel(months, tickers, total_return, market_cap, risk_free, row_offsets, _frequency)
+
 
 def subset_monthly_return_capitalization(start_date: date, end_date: date):
     """ Obtain a subset of monthly return capitalization from start_date (inclusive) to end_date (exclusive)
-    Dates are rounded down to the start of the month.
+    Dates are rounded down to the start of the month, or to a trading day for daily data.
     """
-    start_date = start_date.replace(day=1)
-    end_date = end_date.replace(day=1)
+    return _subset_rows(get_returns_panel().window(start_date, end_date))
+
+
+def _subset_rows(rows: slice) -> 'pd.DataFrame':
+    """Rows of read_monthly_return_capitalization() in the given rows of the panel"""
+    panel = get_returns_panel()
 
     # fetch all monthly return capitalizations
     mrc = read_monthly_return_capitalization()
 
-    # filter
-    mrc = mrc[mrc['Monthly Calendar Date'] < pd.to_datetime(end_date)]
-    mrc = mrc[mrc['Monthly Calendar Date'] >= pd.to_datetime(start_date)]
-    
-    return mrc
+    # rows of a period range are contiguous
+    return mrc.iloc[panel.row_offsets[rows.start]:panel.row_offsets[rows.stop]]
 
 
+def get_in_sample_returns(mark_date: date, sample_months: int = 60, tickers: list[str] = UNIVERSE) -> np.ndarray:
+    """
+    Return the (sample_months x N) total returns in the sample_months before mark_date,
+    the rows of ReturnsPanel.sample_window(). Columns are ordered by tickers and missing
+    observations are NaN.
 
-def get_in_sample_data(mark_date: date, sample_months: int = 60) ->  pd.DataFrame:
+    Sample usage:
+        >>> returns = get_in_sample_returns(date(2017, 1, 1), 60)
+    """
+    panel = get_returns_panel()
+    return panel.total_return[panel.sample_window(mark_date, sample_months)][:, panel.columns(tickers)]
+
+
+def set_missing_data_policy(policy: MissingData | str) -> None:
+    """Select how estimates treat missing returns, a MissingData or its value
+    ('drop', 'ffill' or 'pairwise'). Also set by the ROPACEA_MISSING_DATA environment
+    variable, PAIRWISE by default."""
+    global _missing_data_policy
+    _missing_data_policy = MissingData(policy)
+
+
+def get_missing_data_policy() -> MissingData:
+    return _missing_data_policy
+
+
+def estimable_tickers(mark_date: date,
+                      sample_months: int = 60,
+                      tickers: list[str] = UNIVERSE,
+                      policy: MissingData = None) -> tuple[str, ...]:
+    """The tickers that can be estimated from the sample_months before mark_date under
+    the policy, the default one if not given.
+
+    Tickers not in the data or with fewer than MIN_OBSERVATIONS returns are left out,
+    and under DROP every ticker without a return in each month.
+    """
+    panel = get_returns_panel()
+    policy = policy or _missing_data_policy
+    known = [ticker for ticker in tickers if ticker in panel._column_of]
+
+    rows = panel.sample_window(mark_date, sample_months)
+    counts = panel.coverage.count(rows)[panel.columns(known)]
+    needed = panel.sample_rows(sample_months) if policy is MissingData.DROP else MIN_OBSERVATIONS
+
+    kept = tuple(ticker for ticker, n in zip(known, counts) if n >= needed)
+    if len(kept) < len(tickers):
+        logger.debug("%d of %d tickers left out at %s", len(tickers) - len(kept), len(tickers), mark_date,
+                     extra={'mark_date': mark_date, 'policy': policy.value,
+                            'left_out': sorted(set(tickers) - set(kept))})
+    return kept
+
+
+def forward_fill(returns: np.ndarray) -> np.ndarray:
+    """Copy of the (T x N) returns with each NaN replaced by the last return above it.
+    NaNs above a column's first return stay."""
+    observed = ~np.isnan(returns)
+    last = np.where(observed, np.arange(len(returns))[:, None], 0)
+    np.maximum.accumulate(last, axis=0, out=last)
+    return returns[last, np.arange(returns.shape[1])]
+
+
+def get_in_sample_data(mark_date: date,
+                       sample_months: int = 60,
+                       tickers: list[str] = UNIVERSE,
+                       missing: MissingData = None) -> 'pd.DataFrame':
     """
     Return monthly-return-capitalization filtered to include only those date within sample_months 
-    back in time of the given mark_date.
+    back in time of the given mark_date, and only the given tickers.
     
     Parameters:
         mark_date: fetch historical data looking back in time from this date
         sample_month: the number of months back in time to fetch historical data
+        tickers: the universe of tickers to keep
+        missing: policy for the tickers with missing returns, the default one if not given.
+            DROP leaves their rows out, FORWARD_FILL adds rows with the filled returns
+            (the other columns NaN) and PAIRWISE keeps the data as is.
 
     Sample usage:
         >>> mark_date = date(year = 2017, month=1, day=1)
         >>> sample_months = 60
         >>> sample_data = get_in_sample_data(mark_date, sample_months)
     """
+    import pandas as pd
+
+    missing = missing or _missing_data_policy
 
     # filter to after start of sample period
-    start_date = mark_date - relativedelta(months=sample_months)
+    panel = get_returns_panel()
+    rows = panel.sample_window(mark_date, sample_months)
+    columns = panel.columns(tickers)
 
     # fetch all monthly return capitalizations
-    mrc = subset_monthly_return_capitalization(start_date, mark_date)
+    mrc = _subset_rows(rows)
+
+    complete = panel.coverage.complete(rows)[columns] & (rows.stop - rows.start == panel.sample_rows(sample_months))
+    if complete.all():
+        return mrc[mrc['Ticker'].isin(tickers)]
+
+    incomplete = [ticker for ticker, ok in zip(tickers, complete) if not ok]
+    logger.debug("%d tickers with missing returns at %s", len(incomplete), mark_date,
+                 extra={'mark_date': mark_date, 'policy': missing.value, 'tickers': incomplete})
+
+    if missing is MissingData.DROP:
+        return mrc[mrc['Ticker'].isin([ticker for ticker, ok in zip(tickers, complete) if ok])]
 
-    # validate data
-    ticker_counts = mrc.groupby('Ticker')['Monthly Calendar Date'].count()
-    for ticker in UNIVERSE:
-        count = ticker_counts.get(ticker,0)
-        if count != sample_months:
-            print(f"WARNING: Only {count:2d} out of {sample_months} values found in sample " + 
-                  f"for {ticker:4} at {mark_date}")
+    mrc = mrc[mrc['Ticker'].isin(tickers)]
+    if missing is MissingData.FORWARD_FILL:
+        returns = panel.total_return[rows][:, columns]
+        filled = forward_fill(returns)
+        month, column = np.nonzero(np.isnan(returns) & ~np.isnan(filled))
+
+        # a filled month takes the date the data files give that month
+        offsets = panel.row_offsets[rows.start:rows.stop]
+        has_date = offsets[month] < panel.row_offsets[rows.start + 1:rows.stop + 1][month]
+        month, column = month[has_date], column[has_date]
+        dates = read_monthly_return_capitalization()['Monthly Calendar Date'].values[offsets[month]]
+
+        mrc = pd.concat([mrc, pd.DataFrame({
+            'Monthly Calendar Date': dates,
+            'Ticker': np.asarray(tickers, dtype=object)[column],
+            'Monthly Total Return': filled[month, column],
+        })], ignore_index=True)
 
     return mrc
 
 
 def get_risk_free_rate(mark_date: date) -> float:
     """
-    Get the risk free rate of the month of given mark_date
+    Get the risk free rate of the month of given mark_date, or of its trading day
     """
+    panel = get_returns_panel()
+    row = panel.row_index(mark_date)
+
+    if not 0 <= row < len(panel.months) or np.isnan(panel.risk_free[row]):
+        raise IndexError(f"No risk free rate found for {mark_date}")
 
-    rf = read_risk_free()
-    start_of_month = mark_date.replace(day=1)
-    start_of_next_month = start_of_month + relativedelta(months=1) 
-    # subset to month of mark_dt
-    rf = rf[rf['Calendar Date'] < pd.to_datetime(start_of_next_month)]
-    rf = rf[rf['Calendar Date'] >= pd.to_datetime(start_of_month)]
-    
     # return monthly treasury bill return
-    return rf['10 Year Bond Returns'].values[0]
+    return panel.risk_free[row]
 
 
 
-def get_market_returns(start_date, end_date):
-    """Get the return rate for each ticker in UNIVERSE over the given period.
+def get_risk_free_return(start_date: date, end_date: date) -> float:
+    """
+    Get the risk free return compounded over the periods from start_date (inclusive)
+    to end_date (exclusive)
+    """
+    panel = get_returns_panel()
+    rows = panel.window(start_date, end_date)
+
+    if rows.stop == rows.start or np.isnan(panel.risk_free[rows]).any():
+        raise IndexError(f"No risk free rate found from {start_date} to {end_date}")
+
+    return float(np.prod(1 + panel.risk_free[rows]) - 1)
+
+
+def get_market_returns(start_date, end_date, tickers: list[str] = UNIVERSE):
+    """Get the return rate for each of the tickers over the given period,
+    compounded over its periods.
 
     Arguments:
         state_date: inclusive
         end_date: exclusive
+        tickers: defaults to UNIVERSE
     """
-    out_of_sample_data = subset_monthly_return_capitalization(start_date, end_date)
+    panel = get_returns_panel()
+    out_of_sample = panel.total_return[panel.window(start_date, end_date)][:, panel.columns(tickers)]
 
-    # series with Tickers as indices and total returns as values
-    returns = out_of_sample_data.groupby('Ticker')['Monthly Total Return'].prod()
-    # order by UNIVERSE
-    returns = [returns.get(ticker, 0.0) for ticker in UNIVERSE]
+    # compounded observed returns, periods without a return count as 0.0
+    returns = np.nanprod(1 + out_of_sample, axis=0) - 1
+    missing = np.isnan(out_of_sample).all(axis=0)
+    returns[missing] = 0.0
 
-    return returns
+    if missing.any():
+        count('missing_market_returns', int(missing.sum()))
+        logger.info("No return from %s to %s for %d tickers, counted as 0.0", start_date, end_date, missing.sum(),
+                    extra={'tickers': [ticker for ticker, m in zip(tickers, missing) if m]})
 
+    return returns.tolist()
 
-# test functionality
+
+# test functionality, `python -m ropacea.data ingest [feed_dir]` ingests the feed
 if __name__ == '__main__':
+    import sys
+    from ropacea import data
+    from ropacea.instrumentation import configure_logging
+
+    if sys.argv[1:2] == ['ingest']:
+        configure_logging('INFO')
+        data.ingest_feed(*sys.argv[2:3])
+        sys.exit()
+
     mark_date = date(year = 2017, month=1, day=1)
     sample_months = 60
     out = get_in_sample_data(mark_date, sample_months)
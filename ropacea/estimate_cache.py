@@ -0,0 +1,179 @@
+"""Memoized expected returns and covariance estimates.
+
+Estimates are cached at two levels: an in-memory LRU bounded in number of entries,
+backed by one compressed .npz file per estimate on disk that survives across sessions.
+Factor model covariances are stored in their factored form. Dense covariances of more
+than MAX_DENSE_ASSETS tickers are not cached at all, each would take 8 N^2 bytes in memory
+and on disk.
+Keys combine the estimator, the month (or day, on daily data) of the mark date, the sample window, the tickers
+estimated, the missing data policy, the float type of the data, the fingerprint of the data files and a
+digest of the estimator sources, so a changed CSV, setting or estimator never serves a stale estimate.
+
+    >>> store = get_estimate_store()
+    >>> print(store.stats)
+"""
+
+
+import os
+import hashlib
+import tempfile
+from pathlib import Path
+from datetime import date
+from functools import lru_cache
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from ropacea.data import (CACHE_DIR, FLOAT_DTYPE, UNIVERSE, Frequency, data_fingerprint, get_data_frequency,
+                          get_missing_data_policy)
+from ropacea.covariance import FactorCovariance
+
+
+ESTIMATE_CACHE_DIR = CACHE_DIR / 'estimates'
+
+MAX_DENSE_ASSETS = 500
+"""Most tickers of the dense covariances EstimateStore keeps, 2 MB each"""
+
+_ESTIMATOR_SOURCES = ('scs.py', 'const_corr.py', 'Single_factor.py', 'statistical_factor.py', 'rolling.py',
+                      'portfolios.py', 'covariance.py', 'data.py')
+"""Modules whose code determines the estimates"""
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.hits} hits ({self.disk_hits} from disk), {self.misses} misses, "
+                f"{self.hit_rate:.1%} hit rate")
+
+
+class EstimateStore:
+    """Two level cache of (expected_returns, covariance) pairs"""
+
+    def __init__(self, maxsize: int = 512, directory: Path = ESTIMATE_CACHE_DIR, persist: bool = True,
+                 max_dense_assets: int = None) -> None:
+        self.maxsize = maxsize
+        self.directory = Path(directory)
+        self.persist = persist
+        self.max_dense_assets = max_dense_assets if max_dense_assets is not None else MAX_DENSE_ASSETS
+        """Most tickers of a dense covariance the store keeps"""
+        self.stats = CacheStats()
+        self._memory = OrderedDict()
+
+    def get_or_compute(self,
+                       estimator: str,
+                       mark_date: date,
+                       sample_months: int,
+                       compute: Callable[[], tuple[np.ndarray, np.ndarray | FactorCovariance]],
+                       tickers: tuple = tuple(UNIVERSE)) -> tuple[np.ndarray, np.ndarray | FactorCovariance]:
+        """Cached estimate of the tickers over the sample_months before mark_date, computed on a miss"""
+        key = self.key(estimator, mark_date, sample_months, tickers)
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return self._memory[key]
+
+        path = self.directory / f'{key}.npz'
+        if self.persist and path.exists():
+            with np.load(path) as npz:
+                if 'covariance' in npz.files:
+                    covariance = npz['covariance']
+                else:
+                    covariance = FactorCovariance(npz['loadings'], npz['factor_covariance'], npz['idiosyncratic'])
+                estimate = (npz['expected_returns'], covariance)
+            self.stats.disk_hits += 1
+        else:
+            expected_returns, covariance = compute()
+            if not isinstance(covariance, FactorCovariance):
+                covariance = np.asarray(covariance, dtype=float)
+            estimate = (np.asarray(expected_returns, dtype=float), covariance)
+            self.stats.misses += 1
+            if not isinstance(covariance, FactorCovariance) and len(covariance) > self.max_dense_assets:
+                return estimate
+            if self.persist:
+                self._write(path, *estimate)
+
+        # shared between callers, so make sure nobody modifies it
+        for array in estimate:
+            array.setflags(write=False)
+
+        self._memory[key] = estimate
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+        return estimate
+
+    def contains(self, estimator: str, mark_date: date, sample_months: int, tickers: tuple = tuple(UNIVERSE)) -> bool:
+        """Whether the estimate is cached, in memory or on disk"""
+        key = self.key(estimator, mark_date, sample_months, tickers)
+        return key in self._memory or (self.persist and (self.directory / f'{key}.npz').exists())
+
+    @staticmethod
+    def key(estimator: str, mark_date: date, sample_months: int, tickers: tuple = tuple(UNIVERSE)) -> str:
+        """Estimates only depend on the month of mark_date, or its day on daily data"""
+        period = (mark_date.isoformat() if get_data_frequency() is Frequency.DAILY
+                  else f'{mark_date.year:04d}-{mark_date.month:02d}')
+        fields = (estimator, period, str(sample_months), ','.join(tickers), get_missing_data_policy().value,
+                  FLOAT_DTYPE, data_fingerprint(), _estimator_version())
+        return hashlib.sha256('|'.join(fields).encode()).hexdigest()
+
+    def clear(self, disk: bool = False) -> None:
+        """Empty the in-memory cache, and the on-disk store if disk"""
+        self._memory.clear()
+        if disk and self.directory.exists():
+            for path in self.directory.glob('*.npz'):
+                path.unlink()
+
+    def _write(self, path: Path, expected_returns: np.ndarray, covariance: np.ndarray | FactorCovariance) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if isinstance(covariance, FactorCovariance):
+            arrays = {'loadings': covariance.loadings, 'factor_covariance': covariance.factor_covariance,
+                      'idiosyncratic': covariance.idiosyncratic}
+        else:
+            arrays = {'covariance': covariance}
+
+        # write to a unique temporary file first, other processes may write the same key
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, expected_returns=expected_returns, **arrays)
+        os.replace(tmp_path, path)
+
+
+@lru_cache(maxsize=None)
+def _estimator_version() -> str:
+    digest = hashlib.sha256()
+    for name in _ESTIMATOR_SOURCES:
+        digest.update((Path(__file__).parent / name).read_bytes())
+    return digest.hexdigest()
+
+
+_estimate_store = None
+
+
+def get_estimate_store() -> EstimateStore:
+    """Shared EstimateStore used by ropacea.portfolios, created on first use"""
+    global _estimate_store
+    if _estimate_store is None:
+        _estimate_store = EstimateStore()
+    return _estimate_store
+
+
+def set_estimate_store(store: EstimateStore) -> None:
+    """Replace the shared EstimateStore, e.g. with EstimateStore(persist=False)"""
+    global _estimate_store
+    _estimate_store = store
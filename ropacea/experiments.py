@@ -0,0 +1,160 @@
+"""Parameter sweeps with results cached on disk.
+
+An Experiment is one cell of a sweep over strategy x min_return_ratio x sample window x
+rebalance frequency x universe rule. run_grid() only backtests the cells without a cached result, so an
+interrupted or extended sweep only costs the new cells.
+
+Every result is stored under a key built from the experiment, the backtest period, the
+settings the backtest reads (missing data policy, float type, rebalancer and solver
+backend), the version of the ropacea source code and the fingerprint of the data files.
+Changing any of them computes the cell again.
+
+    >>> grid = experiment_grid([PortfolioStrategy.SAMPLE_COVARIANCE, PortfolioStrategy.SINGLE_FACTOR],
+    ...                        min_return_ratios=np.linspace(1.5, 2.5, 10),
+    ...                        sample_months=[36, 60])
+    >>> results = run_grid(grid, date(2017, 1, 1), date(2022, 1, 1))
+    >>> results[grid[0]].summary.sharpe_ratio
+"""
+
+
+import os
+import json
+import pickle
+import hashlib
+import itertools
+from pathlib import Path
+from datetime import date
+from functools import lru_cache
+from dataclasses import dataclass
+
+from dateutil.relativedelta import relativedelta
+
+from ropacea.data import CACHE_DIR, FLOAT_DTYPE, data_fingerprint, get_missing_data_policy
+from ropacea.portfolios import PortfolioStrategy
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
+from ropacea.solvers import get_default_backend
+from ropacea.rebalancing import get_rebalancer
+from ropacea.backtest import BacktestResult, BacktestSummary, backtest_loop, summarize_results
+
+
+EXPERIMENT_CACHE_DIR = CACHE_DIR / 'experiments'
+
+
+@dataclass(frozen=True)
+class Experiment:
+    """One cell of a parameter sweep"""
+
+    strategy: PortfolioStrategy
+    min_return_ratio: float
+    sample_months: int = 60
+    frequency_months: int = 1
+    """Months between rebalances"""
+    universe: UniverseRule = DEFAULT_UNIVERSE
+
+    def __post_init__(self) -> None:
+        # numpy scalars would make equal experiments hash differently
+        object.__setattr__(self, 'min_return_ratio', float(self.min_return_ratio))
+        object.__setattr__(self, 'sample_months', int(self.sample_months))
+        object.__setattr__(self, 'frequency_months', int(self.frequency_months))
+
+    def key(self, start_date: date, end_date: date) -> str:
+        """Content address of this experiment's result"""
+        rebalancer = get_rebalancer()
+        fields = {
+            'strategy': self.strategy.name,
+            'min_return_ratio': self.min_return_ratio,
+            'sample_months': self.sample_months,
+            'frequency_months': self.frequency_months,
+            'universe': self.universe.key,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'missing_data': get_missing_data_policy().value,
+            'float_dtype': FLOAT_DTYPE,
+            'rebalancer': rebalancer.key if rebalancer is not None else None,
+            'solver': get_default_backend(),
+            'code_version': code_version(),
+            'data_fingerprint': data_fingerprint(),
+        }
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+@dataclass
+class ExperimentResult:
+    experiment: Experiment
+    backtest_results: list[BacktestResult]
+    summary: BacktestSummary
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    """Hex digest of the ropacea source code"""
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob('*.py')):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def experiment_grid(strategies: list[PortfolioStrategy],
+                    min_return_ratios: list[float] = (1,),
+                    sample_months: list[int] = (60,),
+                    frequency_months: list[int] = (1,),
+                    universes: list[UniverseRule] = (DEFAULT_UNIVERSE,)) -> list[Experiment]:
+    """Every combination of the given parameters"""
+    return [
+        Experiment(strategy, ratio, months, frequency, universe)
+        for strategy, ratio, months, frequency, universe
+        in itertools.product(strategies, min_return_ratios, sample_months, frequency_months, universes)
+    ]
+
+
+def run_grid(experiments: list[Experiment],
+             start_date: date,
+             end_date: date,
+             cache_dir: Path = EXPERIMENT_CACHE_DIR,
+             backtester = None) -> dict[Experiment, ExperimentResult]:
+    """
+    Backtest every experiment from start_date (inclusive) to end_date (exclusive),
+    loading cached results where available and caching the new ones.
+
+    Missing cells that only differ in min_return_ratio share one pass over the mark
+    dates. Pass a ropacea.parallel.ParallelBacktester as backtester to run them in parallel.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    missing = {}
+    for experiment in experiments:
+        path = cache_dir / f'{experiment.key(start_date, end_date)}.pkl'
+        if path.exists():
+            with open(path, 'rb') as f:
+                results[experiment] = pickle.load(f)
+        else:
+            group = (experiment.strategy, experiment.sample_months, experiment.frequency_months, experiment.universe)
+            missing.setdefault(group, []).append(experiment)
+
+    run = backtester.backtest_loop if backtester is not None else backtest_loop
+    for (strategy, sample_months, frequency_months, universe), group in missing.items():
+        ratios = sorted({experiment.min_return_ratio for experiment in group})
+        frontier = run(start_date, end_date, strategy,
+                       frequency=relativedelta(months=frequency_months),
+                       min_return_ratio=ratios,
+                       sample_months=sample_months,
+                       universe=universe)
+
+        for experiment in group:
+            backtest_results = frontier[experiment.min_return_ratio]
+            result = ExperimentResult(experiment, backtest_results, summarize_results(backtest_results))
+            _store(result, cache_dir / f'{experiment.key(start_date, end_date)}.pkl')
+            results[experiment] = result
+
+    return {experiment: results[experiment] for experiment in experiments}
+
+
+def _store(result: ExperimentResult, path: Path) -> None:
+    # write to a temporary file first so an interrupted sweep never leaves a partial result
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(tmp_path, path)
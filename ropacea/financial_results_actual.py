@@ -1,6 +1,10 @@
 import yfinance as yf
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from ropacea.columnar import TableSpec
+from ropacea.data import STORE_DIR
+from ropacea.store import PartitionedTable
 
 # Define the list of ticker symbols
 ticker_symbols = [
@@ -13,11 +17,33 @@ ticker_symbols = [
 end_date = datetime.now()
 start_date = end_date.replace(year=end_date.year - 10)
 
+# Prices downloaded by earlier runs, so only the days since the last one are downloaded
+prices = PartitionedTable(STORE_DIR / 'prices',
+                          TableSpec(date_columns=('Date',), unique_columns=('Ticker', 'Date'), sort_column='Date'))
+
+
+def download(tickers: list[str], start: datetime) -> pd.DataFrame:
+    """Adjusted close of the tickers from start, one row per ticker and day"""
+    close = yf.download(tickers, start=start, end=end_date)['Adj Close']
+    return close.stack().rename('Adj Close').rename_axis(['Date', 'Ticker']).reset_index()
+
+
+stored = prices.read().to_frame() if prices.exists() else pd.DataFrame(columns=['Date', 'Ticker', 'Adj Close'])
+known = [ticker for ticker in ticker_symbols if ticker in set(stored['Ticker'])]
+new = [ticker for ticker in ticker_symbols if ticker not in set(stored['Ticker'])]
+
+if known:
+    # again from the last stored day, which may have been downloaded before the close
+    prices.ingest(download(known, max(start_date, stored['Date'].max() - timedelta(days=1))), mode='upsert')
+if new:
+    prices.ingest(download(new, start_date), mode='upsert')
+
 # Fetch historical data for each stock
-historical_data = yf.download(ticker_symbols, start=start_date, end=end_date)['Adj Close']
+historical_data = prices.read().to_frame().pivot(index='Date', columns='Ticker', values='Adj Close')
+historical_data = historical_data.loc[historical_data.index >= start_date, ticker_symbols]
 
 # Calculate annual returns
-annual_returns = historical_data.resample('Y').ffill().pct_change()
+annual_returns = historical_data.resample('YE').ffill().pct_change()
 
 # Display the annual returns
 print(annual_returns)
@@ -33,4 +59,4 @@ print("Average Annual Returns for All Stocks:")
 print(average_returns_all)
 
 print("\nAverage Annual Returns for Each Stock:")
-print(average_returns_individual)
\ No newline at end of file
+print(average_returns_individual)
@@ -0,0 +1,84 @@
+"""Check that importing the ropacea modules stays fast and free of side effects.
+
+Each module is imported in a fresh interpreter under `python -X importtime`. The check
+fails if the cumulative import time is over IMPORT_BUDGET_SECONDS, if a heavy
+dependency is imported eagerly, or if the import changes the working directory.
+
+    $ python -m ropacea.import_budget
+"""
+
+
+import sys
+import subprocess
+from dataclasses import dataclass
+
+
+IMPORT_BUDGET_SECONDS = 0.3
+"""Cumulative import time allowed for each module, numpy being most of it"""
+
+CHECKED_MODULES = (
+    'ropacea.data',
+    'ropacea.portfolios',
+    'ropacea.backtest',
+    'ropacea.parallel',
+    'ropacea.experiments',
+    'ropacea.pipeline',
+)
+
+LAZY_DEPENDENCIES = ('pandas', 'gurobipy', 'statsmodels', 'scipy')
+"""Only imported by the code paths that use them"""
+
+
+@dataclass
+class ImportReport:
+    module: str
+    seconds: float
+    eager_dependencies: list[str]
+    changed_directory: bool
+
+    @property
+    def ok(self) -> bool:
+        return (self.seconds <= IMPORT_BUDGET_SECONDS
+                and not self.eager_dependencies
+                and not self.changed_directory)
+
+    def __str__(self) -> str:
+        problems = [f"imports {name}" for name in self.eager_dependencies]
+        if self.changed_directory:
+            problems.append("changes the working directory")
+        if self.seconds > IMPORT_BUDGET_SECONDS:
+            problems.append(f"over the {IMPORT_BUDGET_SECONDS * 1e3:.0f}ms budget")
+        status = 'ok' if self.ok else ', '.join(problems)
+        return f"{self.module:<22} {self.seconds * 1e3:7.1f}ms  {status}"
+
+
+def measure_import(module: str) -> ImportReport:
+    """Import module in a fresh interpreter and report what it cost"""
+    script = (
+        "import os, sys\n"
+        "cwd = os.getcwd()\n"
+        f"import {module}\n"
+        f"print(os.getcwd() != cwd, *[m for m in {LAZY_DEPENDENCIES!r} if m in sys.modules])\n"
+    )
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script],
+                            capture_output=True, text=True, check=True)
+
+    # lines look like "import time: self [us] | cumulative | imported package"
+    seconds = None
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            seconds = int(fields[1]) / 1e6
+    if seconds is None:
+        # renamed, or imported before the script runs
+        raise RuntimeError(f"python -X importtime reported no import of {module}")
+
+    changed_directory, *eager_dependencies = result.stdout.split()
+    return ImportReport(module, seconds, eager_dependencies, changed_directory == 'True')
+
+
+if __name__ == '__main__':
+    reports = [measure_import(module) for module in CHECKED_MODULES]
+    for report in reports:
+        print(report)
+    sys.exit(0 if all(report.ok for report in reports) else 1)
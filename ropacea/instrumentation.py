@@ -0,0 +1,258 @@
+"""Timers, counters and logging of backtest runs.
+
+The backtest hot path times each of its stages with stage(), adding to the shared
+Instrumentation (see get_instrumentation()):
+ - universe: choosing the tickers of a mark date
+ - prefetch: the batch estimates of a backtest_loop(), see ropacea.batch
+ - data: slicing the in sample returns and data
+ - expected_returns, covariance: the estimates of the min risk strategies
+ - solve: the min risk model
+ - evaluate: market returns and the value of the portfolios
+ - resample: the bootstrap estimates of ropacea.resampling
+ - moments, sample_covariance and per strategy stages: ropacea.pipeline
+
+Solvers report every solve with record_solve(). instrumented() measures one run on a
+fresh Instrumentation, optionally under cProfile and tracemalloc, and logs its report:
+
+    >>> with instrumented(profile=True, trace_memory=True) as run:
+    ...     results = backtest_loop(date(2017, 1, 1), date(2022, 1, 1), PortfolioStrategy.SAMPLE_COVARIANCE)
+    >>> print(run.report())
+
+Modules log to the 'ropacea' logger instead of printing. configure_logging() attaches a
+handler writing one line per record, with the extra fields of the record as key=value
+pairs or as JSON. The level and format default to the ROPACEA_LOG_LEVEL (WARNING) and
+ROPACEA_LOG_FORMAT ('text' or 'json') environment variables.
+"""
+
+
+import os
+import sys
+import json
+import time
+import logging
+import contextlib
+from dataclasses import dataclass, field
+
+
+logger = logging.getLogger('ropacea')
+
+
+@dataclass
+class StageTimer:
+    """Total seconds and number of calls of each timed stage"""
+
+    stages: dict = field(default_factory=dict)
+
+    @contextlib.contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float, calls: int = 1) -> None:
+        total, count = self.stages.get(stage, (0.0, 0))
+        self.stages[stage] = (total + seconds, count + calls)
+
+    def merge(self, other: 'StageTimer') -> None:
+        for stage, (seconds, calls) in other.stages.items():
+            self.add(stage, seconds, calls)
+
+    def to_dict(self) -> dict:
+        return {stage: {'seconds': seconds, 'calls': calls, 'ms_per_call': seconds * 1e3 / calls}
+                for stage, (seconds, calls) in self.stages.items()}
+
+
+@dataclass
+class SolverSummary:
+    """Solves of one backend"""
+
+    n_solves: int = 0
+    iterations: int = 0
+    seconds: float = 0.0
+    """Time the solver reports it spent optimizing"""
+    statuses: dict = field(default_factory=dict)
+    """Number of solves ending with each status"""
+
+    def merge(self, other: 'SolverSummary') -> None:
+        self.n_solves += other.n_solves
+        self.iterations += other.iterations
+        self.seconds += other.seconds
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+@dataclass
+class Instrumentation:
+    """Stage timings, counters and solver statistics of a run"""
+
+    timer: StageTimer = field(default_factory=StageTimer)
+    counters: dict = field(default_factory=dict)
+    solvers: dict = field(default_factory=dict)
+    """SolverSummary of each backend by name"""
+    wall_seconds: float = None
+    """Of the run, set by instrumented()"""
+    peak_memory: int = None
+    """Bytes, with instrumented(trace_memory=True)"""
+    profile: str = None
+    """Functions with the most cumulative time, with instrumented(profile=True)"""
+
+    def count(self, counter: str, n: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def merge(self, other: 'Instrumentation') -> None:
+        """Add the timings and counts of another run, e.g. of a worker process"""
+        self.timer.merge(other.timer)
+        for counter, n in other.counters.items():
+            self.count(counter, n)
+        for backend, summary in other.solvers.items():
+            self.solvers.setdefault(backend, SolverSummary()).merge(summary)
+
+    def to_dict(self) -> dict:
+        return {
+            'wall_seconds': self.wall_seconds,
+            'stages': self.timer.to_dict(),
+            'counters': dict(self.counters),
+            'solvers': {backend: vars(summary) for backend, summary in self.solvers.items()},
+            'peak_memory': self.peak_memory,
+        }
+
+    def report(self) -> str:
+        """Where the time went, stage by stage"""
+        stages = sorted(self.timer.stages.items(), key=lambda item: -item[1][0])
+        timed = sum(seconds for _, (seconds, _) in stages)
+        total = self.wall_seconds or timed or 1.0
+
+        width = max([20] + [len(stage) for stage, _ in stages])
+        lines = [f"{'stage':<{width}s} {'total ms':>10s} {'calls':>7s} {'ms/call':>9s} {'share':>6s}"]
+        for stage, (seconds, calls) in stages:
+            lines.append(f"{stage:<{width}s} {seconds*1e3:10.1f} {calls:7d} {seconds*1e3/calls:9.3f} {seconds/total:6.1%}")
+        if self.wall_seconds is not None:
+            lines.append(f"{'untimed':<{width}s} {(self.wall_seconds - timed)*1e3:10.1f}")
+            lines.append(f"{'wall':<{width}s} {self.wall_seconds*1e3:10.1f}")
+
+        for backend, summary in self.solvers.items():
+            statuses = ', '.join(f"{status} {count}" for status, count in summary.statuses.items())
+            lines.append(f"{backend} solver: {summary.n_solves} solves, {summary.iterations} iterations, "
+                         f"{summary.seconds*1e3:.1f} ms optimizing ({statuses})")
+        if self.counters:
+            lines.append(', '.join(f"{counter} {n}" for counter, n in sorted(self.counters.items())))
+        if self.peak_memory is not None:
+            lines.append(f"peak traced memory {self.peak_memory / 2**20:.1f} MiB")
+        if self.profile is not None:
+            lines.append(self.profile)
+        return '\n'.join(lines)
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    """Instrumentation the stages are currently timed into"""
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation) -> None:
+    """Replace the shared instrumentation, e.g. to measure a run on its own"""
+    global _instrumentation
+    _instrumentation = instrumentation
+
+
+def stage(name: str) -> contextlib.AbstractContextManager:
+    """Context manager adding its time to the stage of the current instrumentation"""
+    return _instrumentation.timer.time(name)
+
+
+def count(counter: str, n: int = 1) -> None:
+    _instrumentation.count(counter, n)
+
+
+def record_solve(backend: str, status: str, iterations: int, seconds: float) -> None:
+    """Add one solve to the statistics of the backend"""
+    summary = _instrumentation.solvers.get(backend)
+    if summary is None:
+        summary = _instrumentation.solvers[backend] = SolverSummary()
+    summary.n_solves += 1
+    summary.iterations += iterations
+    summary.seconds += seconds
+    summary.statuses[status] = summary.statuses.get(status, 0) + 1
+
+
+@contextlib.contextmanager
+def instrumented(profile: bool = False, trace_memory: bool = False, profile_lines: int = 20):
+    """Measure the enclosed run on a fresh Instrumentation and log its report.
+
+    With profile, the run goes under cProfile and the report lists the profile_lines
+    functions with the most cumulative time. With trace_memory, tracemalloc records the
+    peak memory of the run.
+    """
+    run = Instrumentation()
+    previous = get_instrumentation()
+    set_instrumentation(run)
+
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start = time.perf_counter()
+    try:
+        yield run
+    finally:
+        run.wall_seconds = time.perf_counter() - start
+        if profiler is not None:
+            import io
+            import pstats
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(profile_lines)
+            run.profile = stream.getvalue()
+        if trace_memory:
+            run.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        set_instrumentation(previous)
+        logger.info("run report\n%s", run.report())
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: the message followed by the extra fields of the record,
+    as key=value pairs or as a JSON object"""
+
+    _STANDARD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def __init__(self, as_json: bool = False) -> None:
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in self._STANDARD_FIELDS}
+        if self.as_json:
+            return json.dumps({'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                               'message': record.getMessage(), **fields}, default=str)
+        line = super().format(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging(level: str | int = None, fmt: str = None, stream=None) -> None:
+    """Log the ropacea logger to stream (stderr) at level with a StructuredFormatter,
+    fmt 'text' or 'json'. Replaces the handler of an earlier call."""
+    level = level or os.environ.get('ROPACEA_LOG_LEVEL', 'WARNING')
+    fmt = fmt or os.environ.get('ROPACEA_LOG_FORMAT', 'text')
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(StructuredFormatter(as_json=fmt == 'json'))
+    handler._ropacea = True
+
+    for previous in [h for h in logger.handlers if getattr(h, '_ropacea', False)]:
+        logger.removeHandler(previous)
+    logger.addHandler(handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
@@ -0,0 +1,149 @@
+"""Run backtests over a pool of worker processes.
+
+Each backtest() call only needs the data before its mark date, so the mark dates of a
+backtest_loop are split into contiguous chunks that run in parallel. The returns panel
+is written once to memory-mapped .npy files (in /dev/shm where available) that every
+worker maps read-only, instead of pickling DataFrames to each worker.
+
+    >>> with ParallelBacktester(max_workers=4) as backtester:
+    ...     results = backtester.backtest_loop(date(2017, 1, 1), date(2022, 1, 1),
+    ...                                        PortfolioStrategy.SAMPLE_COVARIANCE)
+
+Results come back in mark date order, and the stage timings of the workers are added to
+the shared ropacea.instrumentation.Instrumentation of the parent. Rolling estimates do not depend on where a chunk
+starts, and the NumPy solver's answer only depends on the final working set, so with
+that backend results are identical to backtest_loop(). Gurobi warm starts can change
+its answers within the solver tolerance.
+"""
+
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from ropacea.data import Frequency, ReturnsPanel, get_returns_panel, set_returns_panel
+from ropacea.portfolios import PortfolioStrategy
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
+from ropacea.batch import prefetch_estimates
+from ropacea.instrumentation import Instrumentation, count, get_instrumentation, set_instrumentation, stage
+from ropacea.backtest import BacktestResult, backtest, backtest_frontier, mark_dates
+
+
+_PANEL_ARRAYS = ('months', 'total_return', 'market_cap', 'risk_free', 'row_offsets')
+"""ReturnsPanel fields stored as arrays"""
+
+
+def _share_panel(panel: ReturnsPanel, directory: Path) -> None:
+    """Write the arrays of the panel to .npy files in directory"""
+    for name in _PANEL_ARRAYS:
+        np.save(directory / f'{name}.npy', getattr(panel, name))
+
+
+def _attach_panel(directory: str, tickers: tuple, frequency: Frequency) -> None:
+    """Worker initializer: serve all lookups from the memory-mapped panel"""
+    arrays = {name: np.load(Path(directory) / f'{name}.npy', mmap_mode='r')
+              for name in _PANEL_ARRAYS}
+    set_returns_panel(ReturnsPanel(tickers=tickers, frequency=frequency, **arrays))
+
+
+def _backtest_chunk(dates: list[date],
+                    strategy: PortfolioStrategy,
+                    frequency: relativedelta,
+                    min_return_ratio: float | list[float],
+                    sample_months: int,
+                    universe: UniverseRule) -> tuple[list, Instrumentation]:
+    """Backtest consecutive mark dates in a worker, with the instrumentation of the chunk"""
+    set_instrumentation(Instrumentation())
+    with stage('prefetch'):
+        count('prefetched_estimates', prefetch_estimates(dates, strategy, sample_months, universe))
+    count('mark_dates', len(dates))
+
+    if isinstance(min_return_ratio, list):
+        results = [backtest_frontier(mark_date, strategy, frequency, min_return_ratio, sample_months, universe)
+                   for mark_date in dates]
+    else:
+        results = [backtest(mark_date, strategy, frequency, min_return_ratio, sample_months, universe)
+                   for mark_date in dates]
+    return results, get_instrumentation()
+
+
+class ParallelBacktester:
+    """Process pool with the returns panel shared between its workers"""
+
+    def __init__(self, max_workers: int = None, chunks_per_worker: int = 1) -> None:
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunks_per_worker = chunks_per_worker
+
+        panel = get_returns_panel()
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        self._directory = Path(tempfile.mkdtemp(prefix='ropacea-panel-', dir=shm))
+        _share_panel(panel, self._directory)
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_attach_panel,
+            initargs=(str(self._directory), panel.tickers, panel.frequency),
+        )
+
+    def backtest_loop(self,
+                      start_date: date,
+                      end_date: date,
+                      strategy: PortfolioStrategy,
+                      frequency = relativedelta(months=1),
+                      min_return_ratio: float | list[float] = 1,
+                      sample_months: int = 60,
+                      universe: UniverseRule = DEFAULT_UNIVERSE) -> list[BacktestResult] | dict[float, list[BacktestResult]]:
+        """Same as ropacea.backtest.backtest_loop, with the mark dates run in parallel"""
+        ratios = list(min_return_ratio) if isinstance(min_return_ratio, (list, tuple, np.ndarray)) else None
+
+        dates = mark_dates(start_date, end_date, frequency)
+        n_chunks = min(len(dates), self.max_workers * self.chunks_per_worker)
+        chunks = [list(chunk) for chunk in np.array_split(np.array(dates, dtype=object), max(n_chunks, 1))]
+
+        results = []
+        for chunk_results, chunk_instrumentation in self._executor.map(
+            _backtest_chunk,
+            chunks,
+            [strategy] * len(chunks),
+            [frequency] * len(chunks),
+            [ratios if ratios is not None else min_return_ratio] * len(chunks),
+            [sample_months] * len(chunks),
+            [universe] * len(chunks),
+        ):
+            results.extend(chunk_results)
+            get_instrumentation().merge(chunk_instrumentation)
+
+        if ratios is None:
+            return results
+        return {ratio: [frontier[k] for frontier in results] for k, ratio in enumerate(ratios)}
+
+    def close(self) -> None:
+        """Shut down the workers and remove the shared panel"""
+        self._executor.shutdown()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self) -> 'ParallelBacktester':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def parallel_backtest_loop(start_date: date,
+                           end_date: date,
+                           strategy: PortfolioStrategy,
+                           frequency = relativedelta(months=1),
+                           min_return_ratio: float | list[float] = 1,
+                           sample_months: int = 60,
+                           max_workers: int = None,
+                           universe: UniverseRule = DEFAULT_UNIVERSE) -> list[BacktestResult] | dict[float, list[BacktestResult]]:
+    """backtest_loop() on a temporary ParallelBacktester"""
+    with ParallelBacktester(max_workers) as backtester:
+        return backtester.backtest_loop(start_date, end_date, strategy, frequency, min_return_ratio,
+                                        sample_months, universe)
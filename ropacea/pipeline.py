@@ -0,0 +1,212 @@
+"""All strategies of one mark date from inputs computed once.
+
+Comparing strategies with calculate_portfolio() slices the in sample window, pivots it
+and takes its means again for every strategy. run_strategies() goes through shared
+stages instead, each timed once:
+ - universe: the tickers of the mark date and those the estimates can use
+ - data: the (T x N) in sample returns, the same matrix the estimators pivot
+ - moments: means, standard deviations, demeaned returns and the market return
+ - sample_covariance: shared by SAMPLE_COVARIANCE and CONSTANT_CORRELATION
+and runs each estimator and solver on those arrays, in the stages
+'covariance <STRATEGY>' and 'solve <STRATEGY>':
+
+    >>> result = run_strategies(date(2017, 1, 1), [PortfolioStrategy.SINGLE_FACTOR, PortfolioStrategy.SAMPLE_COVARIANCE])
+    >>> result.portfolios[PortfolioStrategy.SINGLE_FACTOR].holdings
+    >>> print(result.report())
+
+The estimates are those of ropacea.portfolios._compute_estimate() from the same window,
+up to rounding. The estimate store and the lazy rebalancer are not used, every strategy
+is estimated and solved.
+"""
+
+
+from datetime import date
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+from ropacea.data import MissingData, forward_fill, get_in_sample_returns, get_missing_data_policy
+from ropacea.portfolios import (Portfolio, PortfolioStrategy, _equally_weighted_portfolio, _estimable,
+                                _value_weighted_portfolio)
+from ropacea.covariance import FactorCovariance
+from ropacea.solvers import get_session
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
+from ropacea.instrumentation import Instrumentation, get_instrumentation, instrumented, stage
+
+
+@dataclass
+class SharedInputs:
+    """In sample returns of one mark date and the moments every estimator uses"""
+
+    mark_date: date
+    sample_months: int
+    tickers: tuple
+    returns: np.ndarray
+    """(T x N) returns ordered by tickers, NaN where missing, without the months no ticker has a return"""
+    expected_returns: np.ndarray
+    """(N,) mean return of each ticker over the months it has returns"""
+    std: np.ndarray
+    """(N,) sample standard deviation of each ticker"""
+    centered: np.ndarray
+    """(T x N) returns minus the mean of each ticker, 0.0 where missing"""
+    market: np.ndarray
+    """(T,) average return of the tickers each month"""
+
+    @property
+    def complete(self) -> bool:
+        """Whether every ticker has a return in every month"""
+        return not np.isnan(self.returns).any()
+
+    @cached_property
+    def sample_covariance(self) -> np.ndarray:
+        """(N x N) unbiased sample covariance, from the months each pair has returns"""
+        if self.complete:
+            return self.centered.T @ self.centered / (len(self.returns) - 1)
+        import pandas as pd
+        return pd.DataFrame(self.returns).cov().values
+
+
+def shared_inputs(mark_date: date, sample_months: int, tickers: tuple) -> SharedInputs:
+    """Slice the in sample returns of the tickers once and take their moments"""
+    with stage('data'):
+        returns = get_in_sample_returns(mark_date, sample_months, tickers)
+        if get_missing_data_policy() is MissingData.FORWARD_FILL:
+            returns = forward_fill(returns)
+        # like the pivot of the in sample data, which has no row for them
+        returns = returns[~np.isnan(returns).all(axis=1)]
+
+    with stage('moments'):
+        expected_returns = np.nanmean(returns, axis=0)
+        std = np.nanstd(returns, axis=0, ddof=1)
+        centered = np.nan_to_num(returns - expected_returns)
+        market = np.nanmean(returns, axis=1)
+
+    return SharedInputs(mark_date, sample_months, tickers, returns, expected_returns, std, centered, market)
+
+
+def shared_covariance(inputs: SharedInputs, strategy: PortfolioStrategy) -> np.ndarray | FactorCovariance:
+    """Covariance estimate of a min risk strategy from the shared inputs, as the
+    estimator of the strategy computes it from the in sample data"""
+    match strategy:
+        case PortfolioStrategy.SINGLE_FACTOR:
+            from ropacea.Single_factor import single_factor_covariance, single_factor_regression
+            _, beta, omega, market_variance = single_factor_regression(inputs.returns, inputs.market)
+            return single_factor_covariance(beta, market_variance, omega)
+        case PortfolioStrategy.CONSTANT_CORRELATION:
+            from ropacea.const_corr import constant_corr_covariance
+            if inputs.complete:
+                correlation = inputs.sample_covariance / np.outer(inputs.std, inputs.std)
+            else:
+                import pandas as pd
+                correlation = pd.DataFrame(inputs.returns).corr().values
+            avg_corr = correlation[np.triu_indices(len(inputs.tickers), k=1)].mean()
+            return constant_corr_covariance(inputs.std, avg_corr)
+        case PortfolioStrategy.SAMPLE_COVARIANCE:
+            from ropacea.scs import clip_eigenvalues, ledoit_wolf_intensity, shrink_covariance
+            sample_covariance = inputs.sample_covariance
+            if not inputs.complete:
+                sample_covariance = clip_eigenvalues(sample_covariance)
+            intensity = ledoit_wolf_intensity(sample_covariance, (inputs.centered**2).sum(axis=1))
+            return shrink_covariance(sample_covariance, intensity)
+        case PortfolioStrategy.STATISTICAL_FACTOR:
+            from ropacea.statistical_factor import statistical_factor_covariance
+            covariance, _ = statistical_factor_covariance(inputs.centered, inputs.std**2)
+            return covariance
+    raise ValueError(f"{strategy} does not depend on estimates")
+
+
+@dataclass
+class PipelineResult:
+    mark_date: date
+    portfolios: dict
+    """Portfolio of each strategy"""
+    covariances: dict
+    """Covariance estimate of each min risk strategy"""
+    inputs: SharedInputs
+    """None without a min risk strategy"""
+    instrumentation: Instrumentation
+    """Time of each stage"""
+
+    def report(self) -> str:
+        return self.instrumentation.report()
+
+
+_SHARED_COVARIANCE = (PortfolioStrategy.SAMPLE_COVARIANCE, PortfolioStrategy.CONSTANT_CORRELATION)
+"""Strategies estimated from the sample covariance"""
+
+
+def run_strategies(mark_date: date,
+                   strategies: list[PortfolioStrategy] = tuple(PortfolioStrategy),
+                   min_return_ratio: float = 1,
+                   sample_months: int = 60,
+                   universe: UniverseRule = DEFAULT_UNIVERSE) -> PipelineResult:
+    """Portfolios of the strategies at mark_date, the same as calculate_portfolio() of
+    each, with the shared inputs computed once.
+
+    Every min risk strategy solves for min_return_ratio times the average expected
+    return, and its stages add to the current instrumentation as well.
+    """
+    portfolios, covariances, inputs = {}, {}, None
+    previous = get_instrumentation()
+    with instrumented() as run:
+        with stage('universe'):
+            tickers = universe.select(mark_date, sample_months)
+
+        min_risk = [strategy for strategy in strategies
+                    if strategy not in (PortfolioStrategy.VALUE_WEIGHTED, PortfolioStrategy.EQUALLY_WEIGHTED)]
+        if min_risk:
+            estimable = _estimable(mark_date, sample_months, tickers)
+            inputs = shared_inputs(mark_date, sample_months, estimable)
+            if any(strategy in _SHARED_COVARIANCE for strategy in min_risk):
+                with stage('sample_covariance'):
+                    inputs.sample_covariance
+            min_return = inputs.expected_returns.mean() * min_return_ratio
+
+        for strategy in strategies:
+            match strategy:
+                case PortfolioStrategy.VALUE_WEIGHTED:
+                    with stage(f'portfolio {strategy.name}'):
+                        portfolios[strategy] = _value_weighted_portfolio(mark_date, tickers)
+                case PortfolioStrategy.EQUALLY_WEIGHTED:
+                    with stage(f'portfolio {strategy.name}'):
+                        portfolios[strategy] = _equally_weighted_portfolio(tickers)
+                case _:
+                    with stage(f'covariance {strategy.name}'):
+                        covariances[strategy] = shared_covariance(inputs, strategy)
+                    with stage(f'solve {strategy.name}'):
+                        session = get_session(len(inputs.tickers))
+                        session.relabel(inputs.tickers)
+                        holdings = session.solve(inputs.expected_returns, covariances[strategy], min_return)
+                    portfolios[strategy] = Portfolio(holdings, inputs.tickers)
+
+    previous.merge(run)
+    return PipelineResult(mark_date, portfolios, covariances, inputs, run)
+
+
+# compare with one calculate_portfolio() per strategy
+if __name__ == '__main__':
+    import time
+    from ropacea import portfolios
+    from ropacea.portfolios import calculate_portfolio
+    from ropacea.estimate_cache import EstimateStore, set_estimate_store
+
+    mark_date = date(2017, 1, 1)
+    # warm up the data and the solver sessions
+    run_strategies(mark_date)
+
+    set_estimate_store(EstimateStore(persist=False))
+    portfolios._rolling_estimators.clear()
+    start = time.perf_counter()
+    separate = {strategy: calculate_portfolio(mark_date, strategy, 1) for strategy in PortfolioStrategy}
+    separate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = run_strategies(mark_date)
+    shared_seconds = time.perf_counter() - start
+
+    print(result.report())
+    for strategy, portfolio in result.portfolios.items():
+        difference = np.abs(np.subtract(portfolio.holdings, separate[strategy].holdings)).max()
+        print(f"{strategy.name:22s} max abs difference {difference:.1e}")
+    print(f"shared stages {shared_seconds*1e3:.1f} ms, one calculate_portfolio() per strategy {separate_seconds*1e3:.1f} ms")
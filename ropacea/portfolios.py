@@ -1,52 +1,69 @@
-""" Contains all 5 different portfolio strategies.
+""" Contains all 6 different portfolio strategies.
 
-See calculate_portfolio() for how to use.
+See calculate_portfolio() for how to use. Every strategy invests in the tickers chosen by
+a ropacea.universe rule at each mark date, ropacea.data.UNIVERSE by default. Min risk
+strategies leave out the tickers they cannot estimate under the missing data policy,
+see ropacea.data.estimable_tickers().
+
+The covariance estimators and solver backends are imported when first used, so
+importing this module stays cheap.
 """
 
 
 from datetime import date
 from enum import Enum
-from collections import defaultdict
 
-import gurobipy as gp
-from gurobipy import GRB
 import numpy as np
 
-from ropacea.data import UNIVERSE, get_in_sample_data
-from ropacea.Single_factor import single_factor
-from ropacea.const_corr import constant_corr
-from ropacea.scs import scs
+from ropacea.data import (UNIVERSE, MissingData, estimable_tickers, forward_fill, get_in_sample_data,
+                          get_in_sample_returns, get_missing_data_policy, get_returns_panel)
+from ropacea.solvers import MinRiskSolver, get_session
+from ropacea.covariance import FactorCovariance
+from ropacea.estimate_cache import get_estimate_store
+from ropacea.instrumentation import stage
+from ropacea.rebalancing import get_rebalancer
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
 
 
 class Portfolio:
     """Wrapper class for a portfolio of holdings"""
 
     holdings: list
-    """Percentage holdings of each ticker in ropacea.data.UNIVERSE"""
+    """Percentage holdings of each ticker in tickers"""
+    tickers: tuple
+    """Tickers held, ropacea.data.UNIVERSE by default"""
 
-    def __init__(self, holdings) -> None:
-        assert len(holdings) == len(UNIVERSE)
+    def __init__(self, holdings, tickers: tuple = None) -> None:
+        self.tickers = tuple(tickers) if tickers is not None else tuple(UNIVERSE)
+        assert len(holdings) == len(self.tickers)
         assert abs(sum(holdings)-1) < 1e-6
         self.holdings = holdings
 
     def calc_portfolio_return(self, returns) -> float:
-        """Value the portfolio at a given set of returns"""
-        return sum([r*h for r,h in zip(returns, self.holdings)])
+        """Value the portfolio at a given set of returns, ordered like tickers"""
+        return float(np.dot(returns, self.holdings))
 
 
 class PortfolioStrategy(Enum):
     # two benchmark strategies
     VALUE_WEIGHTED = 0
     EQUALLY_WEIGHTED = 1
-    # three min risk strategies
+    # four min risk strategies
     SINGLE_FACTOR = 2
     CONSTANT_CORRELATION = 3
     SAMPLE_COVARIANCE = 4
+    STATISTICAL_FACTOR = 5
 
 
-def calculate_portfolio(mark_date: date, strategy: PortfolioStrategy, min_return_ratio: float) -> Portfolio:
+def calculate_portfolio(mark_date: date,
+                        strategy: PortfolioStrategy,
+                        min_return_ratio: float,
+                        sample_months: int = 60,
+                        universe: UniverseRule = DEFAULT_UNIVERSE) -> Portfolio:
     """
     Calculate a portfolio on the given mark_date and using the given strategy.
+    Min risk strategies estimate from the sample_months before mark_date.
+    The portfolio holds the tickers universe selects at mark_date.
 
     Sample usage:
         >>> from datetime import date
@@ -56,110 +73,252 @@ def calculate_portfolio(mark_date: date, strategy: PortfolioStrategy, min_return
         >>> my_portfolio = calculate_portfolio(mark_date, strategy)
     """
     portfolio = None
+    with stage('universe'):
+        tickers = universe.select(mark_date, sample_months)
 
     match strategy:
         case PortfolioStrategy.VALUE_WEIGHTED:
-            portfolio = _value_weighted_portfolio(mark_date)
+            portfolio = _value_weighted_portfolio(mark_date, tickers)
         case PortfolioStrategy.EQUALLY_WEIGHTED:
-            portfolio = _equally_weighted_portfolio()
+            portfolio = _equally_weighted_portfolio(tickers)
         case PortfolioStrategy.CONSTANT_CORRELATION | \
              PortfolioStrategy.SINGLE_FACTOR | \
-             PortfolioStrategy.SAMPLE_COVARIANCE:
-            portfolio = _min_risk_portfolio(mark_date, strategy, min_return_ratio)
+             PortfolioStrategy.SAMPLE_COVARIANCE | \
+             PortfolioStrategy.STATISTICAL_FACTOR:
+            portfolio = _min_risk_portfolio(mark_date, strategy, min_return_ratio, sample_months, tickers)
         case _:
             raise ValueError("Invalid PortfolioStrategy specified")
 
     return portfolio
 
 
-def _value_weighted_portfolio(mark_date) -> Portfolio:
+def calculate_frontier(mark_date: date,
+                       strategy: PortfolioStrategy,
+                       min_return_ratios: list[float],
+                       sample_months: int = 60,
+                       universe: UniverseRule = DEFAULT_UNIVERSE) -> list[Portfolio]:
+    """
+    Calculate the portfolio of every min_return_ratio on the given mark_date.
+
+    Min risk strategies share one expected return and covariance estimate across all
+    ratios and solve the targets as a sequence of warm-started problems.
+    The benchmark strategies do not depend on the ratio.
+
+    Sample usage:
+        >>> mark_date = date(2017, 1, 1)
+        >>> strategy = PortfolioStrategy.SAMPLE_COVARIANCE
+        >>> portfolios = calculate_frontier(mark_date, strategy, [1.0, 1.5, 2.0])
+    """
+    match strategy:
+        case PortfolioStrategy.CONSTANT_CORRELATION | \
+             PortfolioStrategy.SINGLE_FACTOR | \
+             PortfolioStrategy.SAMPLE_COVARIANCE | \
+             PortfolioStrategy.STATISTICAL_FACTOR:
+            with stage('universe'):
+                tickers = universe.select(mark_date, sample_months)
+            return _min_risk_frontier(mark_date, strategy, min_return_ratios, sample_months, tickers)
+        case _:
+            portfolio = calculate_portfolio(mark_date, strategy, None, sample_months, universe)
+            return [portfolio] * len(min_return_ratios)
+
 
-    # get data for the last month
-    last_month = get_in_sample_data(mark_date, sample_months=1)
+def _value_weighted_portfolio(mark_date, tickers: tuple = tuple(UNIVERSE)) -> Portfolio:
 
-    # get a mapping from ticker to market cap
-    # group by is to sort in alphabetical order
-    market_caps = last_month.groupby('Ticker')['Monthly Market Capitalization'].mean()
+    # market caps of the last month, ordered by tickers
+    panel = get_returns_panel()
+    last_month = panel.market_cap[panel.rows_before(mark_date, 1)][:, panel.columns(tickers)]
+    if last_month.shape[0] != 1 or np.isnan(last_month).any():
+        raise ValueError(f"Market capitalizations missing for the period before {mark_date}")
+    market_caps = last_month[0]
 
-    total_market_cap = sum(market_caps)
+    total_market_cap = market_caps.sum()
     holdings = (market_caps / total_market_cap).tolist()
 
-    return Portfolio(holdings)
+    return Portfolio(holdings, tickers)
 
 
-def _equally_weighted_portfolio() -> Portfolio:
-    N = len(UNIVERSE)
+def _equally_weighted_portfolio(tickers: tuple = tuple(UNIVERSE)) -> Portfolio:
+    N = len(tickers)
     holdings = [1/N] * N
-    return Portfolio(holdings)
+    return Portfolio(holdings, tickers)
 
 
 def _min_risk_model(expected_returns: np.ndarray,
-                    covariance: np.ndarray,
-                    min_return: float):
-    
-    model = gp.Model()
-
-    # check input shape
-    n_assets = len(expected_returns)
-    if covariance.shape != (n_assets, n_assets):
-        raise ValueError(f"{covariance.shape = } incompatible with {expected_returns.shape = }")
-
-    # allocation vairables
-    holdings = model.addMVar(
-        shape = n_assets,
-        lb = 0.0, # long only
-        ub = float('inf'),
-        name = 'holdings'
-    )
+                    covariance: np.ndarray | FactorCovariance,
+                    min_return: float,
+                    session: MinRiskSolver = None,
+                    tickers: tuple = tuple(UNIVERSE)):
+    """Solve the long only min risk model.
+
+    Reuses the shared solver of the default backend (see ropacea.solvers) for this
+    number of assets unless one is given.
+    """
+    with stage('solve'):
+        if session is None:
+            session = get_session(len(expected_returns))
+        session.relabel(tickers)
 
-    # set objective to minimize risk
-    model.setObjective(holdings @ covariance @ holdings, GRB.MINIMIZE)
+        return session.solve(expected_returns, covariance, min_return)
 
-    # fully invested constraint
-    model.addConstr(sum([x for x in holdings]) == 1)
 
-    # minimum return constraint
-    model.addConstr(expected_returns.T @ holdings >= min_return)
+_ROLLING_ESTIMATORS = {
+    PortfolioStrategy.SINGLE_FACTOR: 'RollingSingleFactor',
+    PortfolioStrategy.CONSTANT_CORRELATION: 'RollingConstantCorrelation',
+    PortfolioStrategy.SAMPLE_COVARIANCE: 'RollingSampleCovariance',
+    PortfolioStrategy.STATISTICAL_FACTOR: 'RollingStatisticalFactor',
+}
+"""Online estimator of each min risk strategy, by class name in ropacea.rolling"""
 
-    # diversification constraint
-    #model.addConstrs( holdings[i] >= 0.0 for i in range(n_assets) )
+_rolling_estimators = {}
+"""Rolling estimator kept between calls with its tickers, panel and their panel columns, keyed by (strategy, sample_months)"""
 
-    model.optimize()
 
-    return holdings.X
+def _estimate(mark_date: date,
+              strategy: PortfolioStrategy,
+              sample_months: int = 60,
+              tickers: tuple = tuple(UNIVERSE)) -> tuple[np.ndarray, np.ndarray | FactorCovariance]:
+    """Expected returns and covariance estimate of the tickers over the sample_months before mark_date.
+
+    Estimates are memoized in the shared ropacea.estimate_cache.EstimateStore.
+    """
+    return get_estimate_store().get_or_compute(
+        strategy.name, mark_date, sample_months,
+        lambda: _compute_estimate(mark_date, strategy, sample_months, tickers),
+        tickers=tickers,
+    )
+
+
+def _compute_estimate(mark_date: date,
+                      strategy: PortfolioStrategy,
+                      sample_months: int = 60,
+                      tickers: tuple = tuple(UNIVERSE)) -> tuple[np.ndarray, np.ndarray | FactorCovariance]:
+    """Estimate expected returns and covariance of the tickers over the sample_months before mark_date.
+
+    Complete windows are served by a rolling estimator that slides along with
+    consecutive mark dates while the tickers stay the same. Windows with missing data
+    fall back to the batch estimators, after forward filling under the FORWARD_FILL
+    policy or else from the pairwise complete months.
+    """
+    panel = get_returns_panel()
+    with stage('data'):
+        returns = get_in_sample_returns(mark_date, sample_months, tickers)
+        complete = returns.shape[0] == panel.sample_rows(sample_months) and not np.isnan(returns).any()
+
+    if complete:
+        key = (strategy, sample_months)
+        cached = _rolling_estimators.get(key)
+        if cached is None or cached[0] != tickers or cached[1] is not panel:
+            from ropacea import rolling
+            estimator_class = getattr(rolling, _ROLLING_ESTIMATORS[strategy])
+            _rolling_estimators[key] = (tickers, panel, panel.columns(tickers),
+                                        estimator_class(len(tickers), panel.sample_rows(sample_months)))
+
+        _, _, columns, estimator = _rolling_estimators[key]
+        # sliding the window updates the sums both estimates use, reading only its rows
+        with stage('covariance'):
+            estimator.at(panel.total_return, panel.row_index(mark_date), columns)
+            covariance = estimator.covariance()
+        with stage('expected_returns'):
+            return estimator.expected_returns(), covariance
+
+    # DROP leaves incomplete tickers out before they get here, see estimable_tickers()
+    missing = MissingData.FORWARD_FILL if get_missing_data_policy() is MissingData.FORWARD_FILL else MissingData.PAIRWISE
+    with stage('data'):
+        data = get_in_sample_data(mark_date, sample_months, tickers, missing)
+        if missing is MissingData.FORWARD_FILL:
+            returns = forward_fill(returns)
+
+    # get average returns for each ticker, ordered by tickers
+    with stage('expected_returns'):
+        expected_returns = np.nanmean(returns, axis=0)
+
+    covariance = None
+    with stage('covariance'):
+        match strategy:
+            case PortfolioStrategy.SINGLE_FACTOR:
+                from ropacea.Single_factor import single_factor
+                covariance = single_factor(data)
+            case PortfolioStrategy.CONSTANT_CORRELATION:
+                from ropacea.const_corr import constant_corr
+                covariance = constant_corr(data)
+            case PortfolioStrategy.SAMPLE_COVARIANCE:
+                from ropacea.scs import scs
+                covariance = scs(data)
+            case PortfolioStrategy.STATISTICAL_FACTOR:
+                from ropacea.statistical_factor import statistical_factor
+                covariance = statistical_factor(data)
+
+        # the estimators pivot the data, which orders the tickers alphabetically
+        if list(tickers) != sorted(tickers):
+            position = np.argsort(np.argsort(tickers))
+            covariance = (covariance.restrict(position) if isinstance(covariance, FactorCovariance)
+                          else covariance[np.ix_(position, position)])
+
+    return expected_returns, covariance
 
 
 def _min_risk_portfolio(mark_date: date, 
                        strategy: PortfolioStrategy,
-                       min_return_ratio: float) -> Portfolio:
+                       min_return_ratio: float,
+                       sample_months: int = 60,
+                       tickers: tuple = tuple(UNIVERSE)) -> Portfolio:
     """Calculate a portfolio using the min risk model and 
     one of the three covariance estimation strategies"""
 
-    data = get_in_sample_data(mark_date)
-
-    # get average returns for each ticker
-    expected_returns = data.groupby('Ticker')['Monthly Total Return'].mean()
-    # convert from pandas series to numpy array
-    expected_returns = np.array(
-        [expected_returns[ticker] for ticker in UNIVERSE]
-    )
-
-    covariance = None
-    match strategy:
-        case PortfolioStrategy.SINGLE_FACTOR:
-            covariance = single_factor(data)
-        case PortfolioStrategy.CONSTANT_CORRELATION:
-            covariance = constant_corr(data)
-        case PortfolioStrategy.SAMPLE_COVARIANCE:
-            covariance = scs(data)
+    tickers = _estimable(mark_date, sample_months, tickers)
+    expected_returns, covariance = _estimate(mark_date, strategy, sample_months, tickers)
 
     # TODO: is this a good min_return?
     min_return = expected_returns.mean() * min_return_ratio
-    holdings = _min_risk_model(expected_returns, covariance, min_return)
+    rebalancer = get_rebalancer()
+    if rebalancer is None:
+        holdings = _min_risk_model(expected_returns, covariance, min_return, tickers=tickers)
+    else:
+        # keeps the last holdings while the estimates barely moved, see ropacea.rebalancing
+        holdings, = rebalancer.holdings(
+            (strategy, sample_months, (min_return_ratio,)), tickers, expected_returns, covariance, [min_return],
+            lambda: [_min_risk_model(expected_returns, covariance, min_return, tickers=tickers)])
+
+    return Portfolio(holdings, tickers)
 
-    return Portfolio(holdings)
+
+def _min_risk_frontier(mark_date: date,
+                       strategy: PortfolioStrategy,
+                       min_return_ratios: list[float],
+                       sample_months: int = 60,
+                       tickers: tuple = tuple(UNIVERSE)) -> list[Portfolio]:
+    """Calculate min risk portfolios for several min_return_ratios from one estimate"""
+
+    tickers = _estimable(mark_date, sample_months, tickers)
+    expected_returns, covariance = _estimate(mark_date, strategy, sample_months, tickers)
+
+    min_returns = expected_returns.mean() * np.asarray(min_return_ratios, dtype=float)
+
+    def solve_frontier() -> list[np.ndarray]:
+        with stage('solve'):
+            session = get_session(len(expected_returns))
+            session.relabel(tickers)
+            return session.solve_frontier(expected_returns, covariance, min_returns)
+
+    rebalancer = get_rebalancer()
+    if rebalancer is None:
+        holdings = solve_frontier()
+    else:
+        holdings = rebalancer.holdings((strategy, sample_months, tuple(min_return_ratios)), tickers,
+                                       expected_returns, covariance, min_returns, solve_frontier)
+
+    return [Portfolio(h, tickers) for h in holdings]
 
     
 
+def _estimable(mark_date: date, sample_months: int, tickers: tuple) -> tuple:
+    """The tickers min risk strategies can estimate, see ropacea.data.estimable_tickers()"""
+    with stage('universe'):
+        kept = estimable_tickers(mark_date, sample_months, tickers)
+    if not kept:
+        raise ValueError(f"None of the {len(tickers)} tickers has enough returns before {mark_date}")
+    return kept
+
+
 if __name__ == '__main__':
     print(_equally_weighted_portfolio())
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""Lazy rebalancing: skip the min risk solve when the risk model barely moved.
+
+Rolling estimates of consecutive mark dates share all but one month of their window,
+so the covariance and expected returns often change by a few percent. LazyRebalancer
+keeps the estimates of the last solve of each strategy and keeps its holdings while
+
+    ||V - V_solved||_F <= threshold * ||V_solved||_F
+    ||mu - mu_solved|| <= threshold * ||mu_solved||
+
+and the kept holdings still meet the new minimum return. Both backtest functions use
+the rebalancer set with set_rebalancer():
+
+    >>> set_rebalancer(LazyRebalancer(threshold=0.05))
+    >>> results = backtest_loop(date(2017, 1, 1), date(2022, 1, 1), PortfolioStrategy.SAMPLE_COVARIANCE)
+    >>> print(get_rebalancer().stats)
+
+Accuracy bound: long only holdings summing to one have ||x||^2 <= 1. When the optimum
+x_new of the new model is feasible for the solved one, x_solved' V_solved x_solved <=
+x_new' V_solved x_new, and so
+
+    x_solved' V x_solved <= x_new' V x_new + 2 ||V - V_solved||_F
+
+i.e. keeping the holdings gives up at most 2 * threshold * ||V_solved||_F of variance.
+x_new is feasible for the solved model when mu did not change, when the solved min
+return did not bind (mu_solved' x_solved > min_return_solved), or when every long only
+portfolio meeting the new min return meets the solved one, which holds if
+
+    min_i (mu_solved - mu)_i >= min_return_solved - min_return
+
+Otherwise the bound does not apply and a skip only keeps holdings that are still
+feasible; such skips are counted in RebalanceStats.unbounded, and strict=True solves
+instead of making them. With audit=True every skipped solve is still computed, to
+measure the turnover it saved and the variance it gave up. Workers of a ropacea.parallel.ParallelBacktester each
+keep their own copy of the rebalancer, whose skipped solves show in the instrumentation
+counters of the parent.
+"""
+
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from ropacea.covariance import Covariance, as_covariance, relative_change
+from ropacea.instrumentation import count
+
+
+@dataclass
+class RebalanceStats:
+    solves: int = 0
+    skipped: int = 0
+    unbounded: int = 0
+    """Skipped solves the accuracy bound does not cover, see the module docstring"""
+    turnover_saved: float = 0.0
+    """Sum of |x_new - x_solved| over the skipped solves, with audit"""
+    max_excess_variance: float = 0.0
+    """Largest variance given up by a skipped solve, with audit"""
+
+    def __str__(self) -> str:
+        text = f"{self.solves} solves, {self.skipped} skipped"
+        if self.unbounded:
+            text += f" ({self.unbounded} outside the accuracy bound)"
+        if self.turnover_saved or self.max_excess_variance:
+            text += (f", {self.turnover_saved:.4f} turnover saved, "
+                     f"at most {self.max_excess_variance:.2e} variance given up")
+        return text
+
+
+class LazyRebalancer:
+    """Keeps the holdings of the last solve while the estimates stay within threshold of its estimates"""
+
+    def __init__(self, threshold: float = 0.05, audit: bool = False, strict: bool = False) -> None:
+        self.threshold = threshold
+        self.audit = audit
+        self.strict = strict
+        """Only skip solves covered by the accuracy bound"""
+        self.stats = RebalanceStats()
+        self._solved = {}
+        """(tickers, expected_returns, covariance, holdings, min_returns) of the last solve, by key"""
+
+    @property
+    def key(self) -> str:
+        """Stable description of the settings the holdings depend on, for cache keys"""
+        return f"LazyRebalancer(threshold={self.threshold!r}, strict={self.strict!r})"
+
+    def holdings(self,
+                 key: tuple,
+                 tickers: tuple,
+                 expected_returns: np.ndarray,
+                 covariance: Covariance | np.ndarray,
+                 min_returns: np.ndarray,
+                 solve: Callable[[], list[np.ndarray]]) -> list[np.ndarray]:
+        """Holdings for each of the min_returns, from solve() or those of the last solve under key"""
+        solved = self._solved.get(key)
+        if solved is not None and self._can_keep(solved, tickers, expected_returns, covariance, min_returns):
+            kept = solved[3]
+            self.stats.skipped += 1
+            count('rebalance_skipped')
+            if not self._bounded(solved, expected_returns, min_returns):
+                self.stats.unbounded += 1
+            if self.audit:
+                self._compare(kept, solve(), covariance)
+            return kept
+
+        holdings = [np.asarray(h, dtype=float) for h in solve()]
+        self._solved[key] = (tickers, np.asarray(expected_returns, dtype=float), as_covariance(covariance), holdings,
+                             np.asarray(min_returns, dtype=float))
+        self.stats.solves += 1
+        return holdings
+
+    def _can_keep(self, solved: tuple, tickers: tuple, expected_returns: np.ndarray,
+                  covariance: Covariance | np.ndarray, min_returns: np.ndarray) -> bool:
+        solved_tickers, solved_returns, solved_covariance, holdings, _ = solved
+        if solved_tickers != tickers:
+            return False
+
+        mu_change = np.linalg.norm(expected_returns - solved_returns) / np.linalg.norm(solved_returns)
+        if mu_change > self.threshold:
+            return False
+        if relative_change(covariance, solved_covariance) > self.threshold:
+            return False
+
+        # the kept holdings must still meet the minimum return
+        if not all(expected_returns @ x >= min_return for x, min_return in zip(holdings, min_returns)):
+            return False
+        return not self.strict or self._bounded(solved, expected_returns, min_returns)
+
+    @staticmethod
+    def _bounded(solved: tuple, expected_returns: np.ndarray, min_returns: np.ndarray) -> bool:
+        """Whether the new optimum is feasible for the solved model, so that the accuracy bound holds"""
+        _, solved_returns, _, holdings, solved_min_returns = solved
+        shift = (solved_returns - expected_returns).min()
+        return all(solved_returns @ x > solved_min_return + _SLACK or shift >= solved_min_return - min_return
+                   for x, solved_min_return, min_return in zip(holdings, solved_min_returns, min_returns))
+
+    def _compare(self, kept: list[np.ndarray], fresh: list[np.ndarray], covariance: Covariance | np.ndarray) -> None:
+        covariance = as_covariance(covariance)
+        for x_kept, x_new in zip(kept, fresh):
+            x_new = np.asarray(x_new, dtype=float)
+            self.stats.turnover_saved += float(np.abs(x_new - x_kept).sum())
+            excess = float(x_kept @ (covariance @ x_kept) - x_new @ (covariance @ x_new))
+            self.stats.max_excess_variance = max(self.stats.max_excess_variance, excess)
+
+    def reset(self) -> None:
+        """Forget the last solves, so the next ones are not skipped"""
+        self._solved.clear()
+
+
+_SLACK = 1e-10
+"""Margin over the min return above which the return constraint of a solve did not bind"""
+
+
+_rebalancer = None
+
+
+def set_rebalancer(rebalancer: LazyRebalancer) -> None:
+    """Use the rebalancer for the min risk strategies, None to solve at every mark date"""
+    global _rebalancer
+    _rebalancer = rebalancer
+
+
+def get_rebalancer() -> LazyRebalancer | None:
+    return _rebalancer
+
+
+# compare a lazily rebalanced backtest with the full one
+if __name__ == '__main__':
+    from datetime import date
+    from ropacea import rebalancing
+    from ropacea.backtest import backtest_loop, summarize_results
+    from ropacea.portfolios import PortfolioStrategy
+    from ropacea.universe import FullHistory
+
+    # through the imported module, whose rebalancer ropacea.portfolios uses
+    start_date, end_date = date(2016, 1, 1), date(2023, 1, 1)
+    for strategy in (PortfolioStrategy.SINGLE_FACTOR, PortfolioStrategy.SAMPLE_COVARIANCE,
+                     PortfolioStrategy.STATISTICAL_FACTOR):
+        full = summarize_results(backtest_loop(start_date, end_date, strategy, universe=FullHistory()))
+        for threshold in (0.02, 0.05, 0.1):
+            rebalancing.set_rebalancer(rebalancing.LazyRebalancer(threshold, audit=True))
+            lazy = summarize_results(backtest_loop(start_date, end_date, strategy, universe=FullHistory()))
+            print(f"{strategy.name:20s} threshold {threshold:.2f}: {rebalancing.get_rebalancer().stats}, "
+                  f"sharpe {lazy.sharpe_ratio:.3f} vs {full.sharpe_ratio:.3f}")
+        rebalancing.set_rebalancer(None)
@@ -0,0 +1,242 @@
+"""Bootstrap resampling of the estimates and of the backtest results.
+
+Two uses of the same block bootstrap:
+ - resampled_portfolio(): Michaud style resampled portfolio. The in sample window of
+   a mark date is block-bootstrapped n_draws times, every draw is estimated in one
+   batch with the ropacea.batch estimators (a B x T x N stack of windows), and the min
+   risk holdings of all draws are averaged.
+ - sharpe_interval(): confidence interval of the Sharpe ratio from the excess returns
+   of a backtest, bootstrapping the mark dates.
+
+    >>> resampled = resampled_portfolio(date(2017, 1, 1), PortfolioStrategy.SAMPLE_COVARIANCE, n_draws=1000)
+    >>> resampled.portfolio.holdings, resampled.holdings_std
+    >>> sharpe_interval(backtest_loop(date(2017, 1, 1), date(2022, 1, 1), PortfolioStrategy.SINGLE_FACTOR))
+
+Blocks of consecutive months are drawn circularly, which keeps the autocorrelation
+within block_length months. The draws are solved together by the batched active-set
+method of ropacea.solvers.solve_min_risk_batch(), in chunks over a process pool with
+max_workers > 1.
+"""
+
+
+from datetime import date
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ropacea.data import MissingData, estimable_tickers, get_returns_panel
+from ropacea.portfolios import Portfolio, PortfolioStrategy
+from ropacea.backtest import BacktestResult, summary_from_moments
+from ropacea.solvers import solve_min_risk_batch
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
+from ropacea.instrumentation import count, stage
+
+
+def block_bootstrap_indices(n_obs: int,
+                            n_draws: int,
+                            block_length: int = None,
+                            rng: np.random.Generator = None) -> np.ndarray:
+    """(n_draws x n_obs) row indices of circular block bootstrap samples of n_obs rows.
+
+    Each sample is made of blocks of block_length consecutive rows, wrapping around
+    at the end, by default round(n_obs ** (1/3)) rows.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    block_length = block_length or default_block_length(n_obs)
+    n_blocks = -(-n_obs // block_length)
+
+    starts = rng.integers(0, n_obs, size=(n_draws, n_blocks))
+    indices = (starts[:, :, None] + np.arange(block_length)) % n_obs
+    return indices.reshape(n_draws, -1)[:, :n_obs]
+
+
+def default_block_length(n_obs: int) -> int:
+    return max(1, round(n_obs ** (1 / 3)))
+
+
+@dataclass
+class SharpeInterval:
+    sharpe_ratio: float
+    """Of the excess returns as they are"""
+    low: float
+    high: float
+    confidence: float
+    draws: np.ndarray
+    """(n_draws,) Sharpe ratio of each bootstrap sample"""
+
+    @property
+    def standard_error(self) -> float:
+        return float(np.std(self.draws, ddof=1))
+
+
+def sharpe_interval(excess_returns: 'np.ndarray | list[BacktestResult] | BacktestResults',
+                    n_draws: int = 10_000,
+                    confidence: float = 0.95,
+                    block_length: int = None,
+                    seed: int = 0,
+                    periods_per_year: float = None) -> SharpeInterval:
+    """Percentile bootstrap confidence interval of the annualized Sharpe ratio of
+    summarize_results(), from the excess returns of a backtest. Annualized with the
+    periods_per_year of BacktestResults, or else 12 by default."""
+    if periods_per_year is None:
+        periods_per_year = getattr(excess_returns, 'periods_per_year', 12)
+    if hasattr(excess_returns, 'excess_returns'):
+        excess_returns = excess_returns.excess_returns
+    elif not isinstance(excess_returns, np.ndarray):
+        excess_returns = np.array([result.excess_return for result in excess_returns], dtype=float)
+
+    indices = block_bootstrap_indices(len(excess_returns), n_draws, block_length, np.random.default_rng(seed))
+    draws = _sharpe_ratio(excess_returns[indices], periods_per_year)
+
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(draws, [tail, 1 - tail])
+    return SharpeInterval(float(_sharpe_ratio(excess_returns, periods_per_year)), float(low), float(high),
+                          confidence, draws)
+
+
+def _sharpe_ratio(excess_returns: np.ndarray, periods_per_year: float) -> np.ndarray:
+    """Sharpe ratio of summary_from_moments(), over the last axis"""
+    from ropacea.results import excess_return_moments
+    return summary_from_moments(*excess_return_moments(excess_returns), periods_per_year).sharpe_ratio
+
+
+@dataclass
+class ResampledPortfolio:
+    portfolio: Portfolio
+    """Average holdings of the draws"""
+    draw_holdings: np.ndarray
+    """(n_draws x N) min risk holdings of each draw"""
+    iterations: np.ndarray
+    """(n_draws,) active-set iterations of each draw, 0 when the closed form is optimal"""
+    capped: int = 0
+    """Number of draws whose min return was above their highest expected return, solved
+    for that return instead"""
+
+    @property
+    def holdings_std(self) -> np.ndarray:
+        """(N,) standard deviation of each holding over the draws"""
+        return self.draw_holdings.std(axis=0, ddof=1)
+
+
+def resampled_portfolio(mark_date: date,
+                        strategy: PortfolioStrategy,
+                        min_return_ratio: float = 1,
+                        sample_months: int = 60,
+                        universe: UniverseRule = DEFAULT_UNIVERSE,
+                        n_draws: int = 500,
+                        block_length: int = None,
+                        seed: int = 0,
+                        max_workers: int = None) -> ResampledPortfolio:
+    """Michaud style resampled min risk portfolio of the strategy at mark_date.
+
+    Each draw is a block bootstrap sample of the sample_months before mark_date, solved
+    for the strategy's estimates with min return min_return_ratio times its average
+    expected return. Tickers without a return in every month of the window are left
+    out, as under MissingData.DROP. A draw whose highest expected return is below its
+    min return is solved for its highest expected return, see ResampledPortfolio.capped.
+    """
+    if strategy in (PortfolioStrategy.VALUE_WEIGHTED, PortfolioStrategy.EQUALLY_WEIGHTED):
+        raise ValueError(f"{strategy} does not depend on estimates")
+
+    tickers = estimable_tickers(mark_date, sample_months, universe.select(mark_date, sample_months),
+                                policy=MissingData.DROP)
+    panel = get_returns_panel()
+    returns = panel.total_return[panel.sample_window(mark_date, sample_months)][:, panel.columns(tickers)]
+    if len(returns) < panel.sample_rows(sample_months):
+        raise ValueError(f"Fewer than {sample_months} months of returns before {mark_date}")
+
+    with stage('resample'):
+        indices = block_bootstrap_indices(len(returns), n_draws, block_length, np.random.default_rng(seed))
+        # (n_draws x T x N)
+        windows = returns[indices]
+        expected_returns, covariances = resampled_estimates(windows, strategy)
+
+    min_returns = expected_returns.mean(axis=1) * min_return_ratio
+    # no long only portfolio of such a draw reaches its min return
+    highest = expected_returns.max(axis=1)
+    capped = int((min_returns > highest).sum())
+    min_returns = np.minimum(min_returns, highest)
+    count('resampled_capped', capped)
+    with stage('solve'):
+        holdings, iterations = solve_batch(expected_returns, covariances, min_returns, max_workers)
+
+    return ResampledPortfolio(Portfolio(holdings.mean(axis=0), tickers), holdings, iterations, capped)
+
+
+def resampled_estimates(windows: np.ndarray, strategy: PortfolioStrategy) -> tuple[np.ndarray, np.ndarray]:
+    """(B x N) expected returns and (B x N x N) covariances of a (B x T x N) stack of windows"""
+    from ropacea.batch import _BATCH_ESTIMATORS
+
+    expected_returns = windows.mean(axis=1)
+    if strategy == PortfolioStrategy.SAMPLE_COVARIANCE:
+        covariance, _ = _BATCH_ESTIMATORS[strategy](windows)
+        return expected_returns, covariance
+    if strategy in _BATCH_ESTIMATORS:
+        loadings, factor_covariance, idiosyncratic = _BATCH_ESTIMATORS[strategy](windows)
+        common = np.einsum('bik,bkl,bjl->bij', loadings, factor_covariance, loadings)
+        return expected_returns, common + idiosyncratic[:, :, None] * np.eye(windows.shape[2])
+
+    # the number of statistical factors varies between draws, each is estimated on its own
+    from ropacea.statistical_factor import statistical_factor_covariance
+    covariances, start = [], None
+    for window in windows:
+        covariance, start = statistical_factor_covariance(window - window.mean(axis=0), start=start)
+        covariances.append(covariance.to_dense())
+    return expected_returns, np.stack(covariances)
+
+
+def solve_batch(expected_returns: np.ndarray,
+                covariances: np.ndarray,
+                min_returns: np.ndarray,
+                max_workers: int = None,
+                chunk_size: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """(B x N) long only min risk holdings of B problems and the active-set iterations
+    of each, see ropacea.solvers.solve_min_risk_batch().
+
+    The problems are solved chunk_size at a time, which bounds the memory of the KKT
+    systems, by default to about CHUNK_BYTES. With max_workers > 1 the chunks are
+    solved in a process pool.
+    """
+    n_draws, n_assets = expected_returns.shape
+    chunk_size = chunk_size or max(1, CHUNK_BYTES // (8 * (n_assets + 2)**2))
+    if max_workers is not None and max_workers > 1:
+        chunk_size = min(chunk_size, -(-n_draws // max_workers))
+    chunks = [slice(start, start + chunk_size) for start in range(0, n_draws, chunk_size)]
+    args = ([expected_returns[chunk] for chunk in chunks], [covariances[chunk] for chunk in chunks],
+            [min_returns[chunk] for chunk in chunks])
+
+    if max_workers is not None and max_workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers) as executor:
+            solved = list(executor.map(solve_min_risk_batch, *args))
+    else:
+        solved = list(map(solve_min_risk_batch, *args))
+
+    holdings, iterations = zip(*solved)
+    count('resampled_draws', n_draws)
+    return np.concatenate(holdings), np.concatenate(iterations)
+
+
+CHUNK_BYTES = 256 * 2**20
+"""Memory of the KKT systems solve_batch() solves at once"""
+
+
+# resampled portfolios and Sharpe intervals of each strategy
+if __name__ == '__main__':
+    import time
+    from ropacea.backtest import backtest_loop
+
+    mark_date = date(2017, 1, 1)
+    for strategy in list(PortfolioStrategy)[2:]:
+        start = time.perf_counter()
+        resampled = resampled_portfolio(mark_date, strategy, n_draws=2000)
+        seconds = time.perf_counter() - start
+
+        results = backtest_loop(date(2012, 1, 1), date(2023, 1, 1), strategy)
+        start = time.perf_counter()
+        interval = sharpe_interval(results)
+        print(f"{strategy.name:20s} 2000 draws in {seconds:.2f} s ({resampled.iterations.mean():.1f} iterations per draw), "
+              f"largest holding {resampled.portfolio.holdings.max():.3f} +- {resampled.holdings_std.max():.3f}, "
+              f"{resampled.capped} capped; "
+              f"sharpe {interval.sharpe_ratio:.2f} [{interval.low:.2f}, {interval.high:.2f}] "
+              f"in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,248 @@
+"""Backtest results stored as arrays.
+
+BacktestResults holds a backtest as a (T x N) matrix of holdings, a (T x N) matrix of
+realized returns and a vector of T excess returns, for T mark dates and N tickers. When
+the universe changes between mark dates, the N tickers are all those ever held, and a
+ticker outside the universe of a mark date has zero holdings and returns there.
+Metrics are array operations over the mark date axis, so compare() summarizes a stack
+of runs in one pass instead of looping over each of them. They are annualized with the
+periods_per_year of the results, 12 for monthly mark dates, see
+ropacea.backtest.rebalances_per_year().
+
+    >>> results = BacktestResults.from_results(
+    ...     backtest_loop(date(2017, 1, 1), date(2022, 1, 1), PortfolioStrategy.SAMPLE_COVARIANCE))
+    >>> results.metrics().max_drawdown
+    >>> weekly = BacktestResults.from_results(backtest_loop(date(2017, 1, 1), date(2022, 1, 1), strategy, frequency),
+    ...                                       periods_per_year=rebalances_per_year(frequency))
+    >>> results.to_parquet('scs.parquet')
+"""
+
+
+from pathlib import Path
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ropacea.portfolios import Portfolio
+from ropacea.backtest import BASIS_POINT, BacktestResult, BacktestSummary, summary_from_moments
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass
+class BacktestMetrics(BacktestSummary):
+    """BacktestSummary with risk and trading metrics"""
+
+    max_drawdown: float
+    """Largest fall of the portfolio value from its running peak, as a fraction of the peak"""
+    turnover: float
+    """Average one-way fraction of the portfolio traded at each rebalance"""
+    hit_rate: float
+    """Fraction of periods with a positive excess return"""
+    cumulative_return: float
+    """Compounded portfolio return over the whole backtest"""
+
+
+@dataclass
+class BacktestResults:
+    """Columnar store of the results of one backtest"""
+
+    mark_dates: np.ndarray
+    """(T,) datetime64[D]"""
+    tickers: tuple
+    holdings: np.ndarray
+    """(T x N) holdings chosen at each mark date"""
+    market_returns: np.ndarray
+    """(T x N) returns of each ticker over the period starting at each mark date"""
+    excess_returns: np.ndarray
+    """(T,) portfolio return over the risk free rate"""
+    periods_per_year: float = 12
+    """Mark dates per year, to annualize the metrics"""
+
+    @classmethod
+    def from_results(cls,
+                     backtest_results: list[BacktestResult],
+                     tickers: tuple = None,
+                     periods_per_year: float = 12) -> 'BacktestResults':
+        """Columns are the given tickers, by default every ticker held in alphabetical order"""
+        if tickers is None:
+            tickers = sorted(set().union(*(result.portfolio.tickers for result in backtest_results)))
+        column = {ticker: j for j, ticker in enumerate(tickers)}
+
+        holdings = np.zeros((len(backtest_results), len(tickers)))
+        market_returns = np.zeros((len(backtest_results), len(tickers)))
+        for t, result in enumerate(backtest_results):
+            columns = [column[ticker] for ticker in result.portfolio.tickers]
+            holdings[t, columns] = result.portfolio.holdings
+            market_returns[t, columns] = result.market_returns
+
+        return cls(
+            np.array([result.mark_date for result in backtest_results], dtype='datetime64[D]'),
+            tuple(tickers),
+            holdings,
+            market_returns,
+            np.array([result.excess_return for result in backtest_results], dtype=float),
+            periods_per_year,
+        )
+
+    def to_results(self) -> list[BacktestResult]:
+        return [
+            BacktestResult(mark_date.item(), Portfolio(holdings.tolist(), self.tickers), market_returns.tolist(),
+                           float(excess_return))
+            for mark_date, holdings, market_returns, excess_return
+            in zip(self.mark_dates, self.holdings, self.market_returns, self.excess_returns)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.mark_dates)
+
+    @property
+    def portfolio_returns(self) -> np.ndarray:
+        """(T,) return of the portfolio over each period"""
+        return portfolio_returns(self.holdings, self.market_returns)
+
+    def cumulative_returns(self, excess: bool = False) -> np.ndarray:
+        """(T,) compounded portfolio (or excess) returns up to the end of each period"""
+        returns = self.excess_returns if excess else self.portfolio_returns
+        return np.cumprod(1 + returns) - 1
+
+    def rolling_sharpe(self, window: int = None) -> np.ndarray:
+        """(T,) Sharpe ratio of the window periods ending at each mark date, NaN before the
+        first full window. The window is one year of periods by default."""
+        return rolling_sharpe(self.excess_returns, window, self.periods_per_year)
+
+    def summary(self) -> BacktestSummary:
+        """Same as ropacea.backtest.summarize_results(), without printing"""
+        return summary_from_moments(*excess_return_moments(self.excess_returns), self.periods_per_year)
+
+    def metrics(self) -> BacktestMetrics:
+        values = metrics(self.holdings, self.market_returns, self.excess_returns, self.periods_per_year)
+        return BacktestMetrics(**{name: float(value) for name, value in values.items()})
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """One row per mark date, with a 'holding <ticker>' and a 'return <ticker>' column per ticker"""
+        import pandas as pd
+
+        frame = pd.DataFrame({'excess_return': self.excess_returns},
+                             index=pd.Index(self.mark_dates, name='mark_date'))
+        holdings = pd.DataFrame(self.holdings, index=frame.index,
+                                columns=[f'holding {ticker}' for ticker in self.tickers])
+        market_returns = pd.DataFrame(self.market_returns, index=frame.index,
+                                      columns=[f'return {ticker}' for ticker in self.tickers])
+        frame = pd.concat([frame, holdings, market_returns], axis=1)
+        frame.attrs['periods_per_year'] = self.periods_per_year
+        return frame
+
+    @classmethod
+    def from_frame(cls, frame: 'pd.DataFrame') -> 'BacktestResults':
+        tickers = tuple(column.removeprefix('holding ') for column in frame.columns if column.startswith('holding '))
+        return cls(
+            frame.index.values.astype('datetime64[D]'),
+            tickers,
+            frame[[f'holding {ticker}' for ticker in tickers]].to_numpy(dtype=float),
+            frame[[f'return {ticker}' for ticker in tickers]].to_numpy(dtype=float),
+            frame['excess_return'].to_numpy(dtype=float),
+            frame.attrs.get('periods_per_year', 12),
+        )
+
+    def to_parquet(self, path: Path) -> None:
+        """Write to a Parquet file, needs pyarrow"""
+        self.to_frame().to_parquet(path)
+
+    @classmethod
+    def read_parquet(cls, path: Path) -> 'BacktestResults':
+        import pandas as pd
+
+        return cls.from_frame(pd.read_parquet(path))
+
+
+def compare(runs: dict[str, BacktestResults]) -> 'pd.DataFrame':
+    """Metrics of several backtests over the same mark dates, one row per run"""
+    import pandas as pd
+
+    runs = dict(runs)
+    first = next(iter(runs.values()))
+    for name, run in runs.items():
+        if not np.array_equal(run.mark_dates, first.mark_dates):
+            raise ValueError(f"Run {name!r} does not have the same mark dates as the others")
+        if run.periods_per_year != first.periods_per_year:
+            raise ValueError(f"Run {name!r} does not have the same periods per year as the others")
+
+    # (R x T x N) and (R x T)
+    values = metrics(np.stack([run.holdings for run in runs.values()]),
+                     np.stack([run.market_returns for run in runs.values()]),
+                     np.stack([run.excess_returns for run in runs.values()]),
+                     first.periods_per_year)
+    return pd.DataFrame(values, index=pd.Index(list(runs), name='run'))
+
+
+def portfolio_returns(holdings: np.ndarray, market_returns: np.ndarray) -> np.ndarray:
+    """Portfolio return of each period, over the last axis"""
+    return np.einsum('...i,...i->...', holdings, market_returns)
+
+
+def excess_return_moments(excess_returns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Mean and sample standard deviation (bp) over the last axis"""
+    excess_returns_bp = np.asarray(excess_returns) / BASIS_POINT
+    return excess_returns_bp.mean(axis=-1), excess_returns_bp.std(axis=-1, ddof=1)
+
+
+def max_drawdown(returns: np.ndarray) -> np.ndarray:
+    """Largest fall of the compounded returns from their running peak, over the last axis"""
+    growth = np.cumprod(1 + returns, axis=-1)
+    # the starting value is a peak too
+    peak = np.maximum(np.maximum.accumulate(growth, axis=-1), 1.0)
+    return (1 - growth / peak).max(axis=-1)
+
+
+def turnover(holdings: np.ndarray, market_returns: np.ndarray) -> np.ndarray:
+    """Average one-way turnover of each rebalance over the (T x N) last two axes.
+
+    Holdings drift with the market over each period, so the trade at a rebalance is
+    the difference to the drifted holdings, not to the previous target.
+    """
+    grown = holdings[..., :-1, :] * (1 + market_returns[..., :-1, :])
+    drifted = grown / grown.sum(axis=-1, keepdims=True)
+    return 0.5 * np.abs(holdings[..., 1:, :] - drifted).sum(axis=-1).mean(axis=-1)
+
+
+def rolling_sharpe(excess_returns: np.ndarray, window: int = None, periods_per_year: float = 12) -> np.ndarray:
+    """Sharpe ratio of each window of excess returns, aligned to the last period of the window.
+    The window is one year of periods by default."""
+    window = window or max(2, round(periods_per_year))
+    out = np.full(np.shape(excess_returns), np.nan)
+    if np.shape(excess_returns)[-1] >= window:
+        windows = sliding_window_view(excess_returns, window, axis=-1)
+        out[..., window - 1:] = summary_from_moments(*excess_return_moments(windows), periods_per_year).sharpe_ratio
+    return out
+
+
+def metrics(holdings: np.ndarray,
+            market_returns: np.ndarray,
+            excess_returns: np.ndarray,
+            periods_per_year: float = 12) -> dict[str, np.ndarray]:
+    """Every field of BacktestMetrics, over the mark date axis"""
+    returns = portfolio_returns(holdings, market_returns)
+    summary = summary_from_moments(*excess_return_moments(excess_returns), periods_per_year)
+    return {
+        **summary.__dict__,
+        'max_drawdown': max_drawdown(returns),
+        'turnover': turnover(holdings, market_returns),
+        'hit_rate': (np.asarray(excess_returns) > 0).mean(axis=-1),
+        'cumulative_return': np.prod(1 + returns, axis=-1) - 1,
+    }
+
+
+if __name__ == '__main__':
+    from datetime import date
+    from ropacea.portfolios import PortfolioStrategy
+    from ropacea.backtest import backtest_loop
+
+    runs = {
+        strategy.name: BacktestResults.from_results(backtest_loop(date(2017, 1, 1), date(2022, 1, 1), strategy))
+        for strategy in PortfolioStrategy
+    }
+    print(compare(runs).T.to_string())
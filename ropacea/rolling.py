@@ -0,0 +1,255 @@
+"""Online versions of the covariance estimators.
+
+Each estimator keeps running sums over a sliding window of monthly returns, so moving
+the window one month forward is a rank-one add of the new month and a rank-one remove
+of the oldest one instead of a re-estimate over the whole window.
+
+    >>> from ropacea.rolling import RollingSampleCovariance
+    >>> from ropacea.data import get_returns_panel
+    >>> panel = get_returns_panel()
+    >>> estimator = RollingSampleCovariance(len(panel.tickers), sample_months=60)
+    >>> covariance = estimator.at(panel.total_return, end=84).covariance()
+
+Live runs can instead feed one month at a time with append().
+
+Every resync_every months the sums are rebuilt from the window itself. The months at
+which this happens only depend on the position of the window (and on where returns are
+missing before it), so the estimate for a given window does not depend on the order in
+which windows were visited.
+"""
+
+
+from collections import deque
+
+import numpy as np
+
+from ropacea.scs import ledoit_wolf_intensity, shrink_covariance
+from ropacea.covariance import FactorCovariance
+from ropacea.const_corr import constant_corr_covariance
+from ropacea.Single_factor import single_factor_covariance
+from ropacea.statistical_factor import MAX_FACTORS, statistical_factor_covariance
+
+
+class RollingEstimator:
+    """Base class keeping a window of the last sample_months monthly returns"""
+
+    def __init__(self, n_assets: int, sample_months: int = 60, resync_every: int = 12) -> None:
+        self.n_assets = n_assets
+        self.sample_months = sample_months
+        self.resync_every = resync_every
+
+        self._window = deque()
+        self._source = None
+        self._columns = None
+        self._anchor = None
+        self._end = None
+        self._reset()
+
+    @property
+    def n_obs(self) -> int:
+        return len(self._window)
+
+    def append(self, returns: np.ndarray) -> 'RollingEstimator':
+        """Add one month of returns, dropping the oldest month once the window is full."""
+        returns = np.asarray(returns, dtype=float)
+        if returns.shape != (self.n_assets,):
+            raise ValueError(f"{returns.shape = } incompatible with {self.n_assets = }")
+
+        if len(self._window) == self.sample_months:
+            self._update(self._window.popleft(), -1)
+        self._window.append(returns)
+        self._update(returns, +1)
+
+        # appended months are not tracked against a source array
+        self._source = None
+        return self
+
+    def at(self, returns: np.ndarray, end: int, columns: np.ndarray = None) -> 'RollingEstimator':
+        """Move the window to the sample_months rows of returns before row end.
+
+        With columns, only those columns of returns are estimated, and only the rows
+        the window passes through are read. Slides forward from the current window when
+        possible, otherwise rebuilds from the last resync anchor before end.
+        """
+        if end < self.sample_months or end > len(returns):
+            raise ValueError(f"Window ending at row {end} does not fit in {len(returns)} rows")
+
+        def rows(start: int, stop: int) -> np.ndarray:
+            return returns[start:stop] if columns is None else returns[start:stop, columns]
+
+        anchor = end - end % self.resync_every
+        if anchor < self.sample_months or np.isnan(rows(anchor - self.sample_months, end - self.sample_months)).any():
+            # sliding from the anchor would pass through missing returns
+            anchor = end
+
+        if (returns is not self._source or columns is not self._columns
+                or anchor != self._anchor or end < self._end):
+            self.rebuild(rows(anchor - self.sample_months, anchor))
+            self._anchor = self._end = anchor
+
+        for row in rows(self._end, end):
+            self.append(row)
+        self._source = returns
+        self._columns = columns
+        self._end = end
+
+        return self
+
+    def rebuild(self, window: np.ndarray) -> 'RollingEstimator':
+        """Recompute the running sums from a (T x N) window of returns."""
+        window = np.asarray(window, dtype=float)
+        if window.shape[0] > self.sample_months or window.shape[1:] != (self.n_assets,):
+            raise ValueError(f"{window.shape = } incompatible with {self.sample_months = }, {self.n_assets = }")
+
+        self._window = deque(window)
+        self._reset(window)
+        self._source = self._anchor = self._end = None
+        return self
+
+    def expected_returns(self) -> np.ndarray:
+        """Average return of each ticker over the window"""
+        return self._sum / self.n_obs
+
+    def covariance(self) -> np.ndarray | FactorCovariance:
+        raise NotImplementedError
+
+    def _reset(self, window: np.ndarray = None) -> None:
+        if window is None:
+            window = np.empty((0, self.n_assets))
+        self._sum = window.sum(axis=0)
+
+    def _update(self, returns: np.ndarray, sign: int) -> None:
+        self._sum += sign * returns
+
+
+class _RollingCrossProducts(RollingEstimator):
+    """Running sums of returns and of their cross products"""
+
+    def _reset(self, window: np.ndarray = None) -> None:
+        super()._reset(window)
+        if window is None:
+            window = np.empty((0, self.n_assets))
+        self._cross = window.T @ window
+
+    def _update(self, returns: np.ndarray, sign: int) -> None:
+        super()._update(returns, sign)
+        self._cross += sign * np.outer(returns, returns)
+
+    def sample_covariance(self) -> np.ndarray:
+        """Unbiased sample covariance of the window"""
+        n = self.n_obs
+        return (self._cross - np.outer(self._sum, self._sum) / n) / (n - 1)
+
+
+class RollingSampleCovariance(_RollingCrossProducts):
+    """Online ropacea.scs.scs"""
+
+    def covariance(self) -> np.ndarray:
+        sample_cov = self.sample_covariance()
+        centered = np.array(self._window) - self._sum / self.n_obs
+        return shrink_covariance(sample_cov, ledoit_wolf_intensity(sample_cov, (centered**2).sum(axis=1)))
+
+
+class RollingConstantCorrelation(RollingEstimator):
+    """Online ropacea.const_corr.constant_corr
+
+    Keeps no N x N sums: the average correlation comes from the standardized window
+    in O(N T), since the correlations of all pairs add up to the squared norm of the
+    cross-sectional sums of standardized returns.
+    """
+
+    def _reset(self, window: np.ndarray = None) -> None:
+        super()._reset(window)
+        if window is None:
+            window = np.empty((0, self.n_assets))
+        self._sum_sq = (window**2).sum(axis=0)
+
+    def _update(self, returns: np.ndarray, sign: int) -> None:
+        super()._update(returns, sign)
+        self._sum_sq += sign * returns**2
+
+    def covariance(self) -> FactorCovariance:
+        n, n_assets = self.n_obs, self.n_assets
+        sigma = np.sqrt((self._sum_sq - self._sum**2 / n) / (n - 1))
+
+        z = (np.array(self._window) - self._sum / n) / sigma
+        sum_corr = (z.sum(axis=1)**2).sum() / (n - 1)
+        # leave out the N correlations of each ticker with itself
+        avg_corr = (sum_corr - n_assets) / (n_assets * (n_assets - 1))
+
+        return constant_corr_covariance(sigma, avg_corr)
+
+
+class RollingSingleFactor(RollingEstimator):
+    """Online ropacea.Single_factor.single_factor
+
+    The market return of a month is the average return across tickers. Keeps the
+    market moments and, per ticker, the sums needed for the regression on the market.
+    """
+
+    def _reset(self, window: np.ndarray = None) -> None:
+        super()._reset(window)
+        if window is None:
+            window = np.empty((0, self.n_assets))
+        market = window.mean(axis=1)
+        self._sum_sq = (window**2).sum(axis=0)
+        self._sum_market = market.sum()
+        self._sum_market_sq = (market**2).sum()
+        self._sum_cross_market = window.T @ market
+
+    def _update(self, returns: np.ndarray, sign: int) -> None:
+        super()._update(returns, sign)
+        market = returns.mean()
+        self._sum_sq += sign * returns**2
+        self._sum_market += sign * market
+        self._sum_market_sq += sign * market**2
+        self._sum_cross_market += sign * returns * market
+
+    def covariance(self) -> FactorCovariance:
+        n = self.n_obs
+
+        # centered sums of squares and cross products
+        s_mm = self._sum_market_sq - self._sum_market**2 / n
+        s_xm = self._sum_cross_market - self._sum * self._sum_market / n
+        s_xx = self._sum_sq - self._sum**2 / n
+
+        beta = s_xm / s_mm
+        # variance of the regression residuals
+        omega = (s_xx - beta * s_xm) / n
+
+        return single_factor_covariance(beta, s_mm / (n - 1), omega)
+
+
+class RollingStatisticalFactor(RollingEstimator):
+    """Online ropacea.statistical_factor.statistical_factor
+
+    The SVD of each window starts from the singular vectors of the previous one, which
+    barely move from one month to the next. Large windows use an iterative SVD, whose
+    estimates only match across visiting orders to its tolerance.
+    """
+
+    def __init__(self, n_assets: int, sample_months: int = 60, resync_every: int = 12,
+                 explained_variance: float = None, max_factors: int = MAX_FACTORS) -> None:
+        self.explained_variance = explained_variance
+        self.max_factors = max_factors
+        self._subspace = None
+        super().__init__(n_assets, sample_months, resync_every)
+
+    def _reset(self, window: np.ndarray = None) -> None:
+        super()._reset(window)
+        if window is None:
+            window = np.empty((0, self.n_assets))
+        self._sum_sq = (window**2).sum(axis=0)
+
+    def _update(self, returns: np.ndarray, sign: int) -> None:
+        super()._update(returns, sign)
+        self._sum_sq += sign * returns**2
+
+    def covariance(self) -> FactorCovariance:
+        n = self.n_obs
+        centered = np.array(self._window) - self._sum / n
+        variance = (self._sum_sq - self._sum**2 / n) / (n - 1)
+
+        covariance, self._subspace = statistical_factor_covariance(
+            centered, variance, self.explained_variance, self.max_factors, start=self._subspace)
+        return covariance
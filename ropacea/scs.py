@@ -1,40 +1,76 @@
 #sample covariance matrix with shrinkage
 from datetime import date
-import data
 import numpy as np
-import pandas as pd
 
 def scs(data):
 
     # Pivot the data to create a DataFrame suitable for covariance calculation
-    pivot_data = data.pivot_table(values='Monthly Total Return', 
-                                    index='Monthly Calendar Date', 
+    pivot_data = data.pivot_table(values='Monthly Total Return',
+                                    index='Monthly Calendar Date',
                                     columns='Ticker')
 
     # Calculate the sample covariance matrix
-    sample_cov_matrix = pivot_data.cov()
+    sample_cov_matrix = pivot_data.cov().values
 
-    # Number of assets (variables)
-    n_assets = sample_cov_matrix.shape[0]
+    # Demeaned returns of each month, months a ticker has no data count as zero
+    returns = pivot_data.values
+    centered = np.nan_to_num(returns - np.nanmean(returns, axis=0))
+
+    if np.isnan(returns).any():
+        # covariances from the months both tickers have returns need not be positive semidefinite
+        sample_cov_matrix = clip_eigenvalues(sample_cov_matrix)
+
+    intensity = ledoit_wolf_intensity(sample_cov_matrix, (centered**2).sum(axis=1))
+    return shrink_covariance(sample_cov_matrix, intensity)
+
+
+def clip_eigenvalues(matrix: np.ndarray, floor: float = 0.0) -> np.ndarray:
+    """Nearest symmetric matrix, in Frobenius norm, with no eigenvalue below floor"""
+    eigenvalues, vectors = np.linalg.eigh(matrix)
+    if eigenvalues.min() >= floor:
+        return matrix
+    return (vectors * np.maximum(eigenvalues, floor)) @ vectors.T
+
+
+def ledoit_wolf_intensity(sample_cov_matrix: np.ndarray, row_norms_sq: np.ndarray) -> np.ndarray:
+    """Ledoit-Wolf (2004) shrinkage intensity towards a multiple of the identity.
 
-    # Calculate the average of the diagonal elements of the sample covariance matrix
-    trace_cov = np.trace(sample_cov_matrix) / n_assets
+    Parameters:
+        sample_cov_matrix: (... x N x N) unbiased sample covariance
+        row_norms_sq: (... x T) squared norm of the demeaned returns of each month
 
-    # Calculate the Ledoit-Wolf shrinkage target: diagonal matrix with average covariance on the diagonal
-    target_cov_matrix = np.full_like(sample_cov_matrix, trace_cov)
-    np.fill_diagonal(target_cov_matrix, np.diag(sample_cov_matrix))
+    Leading axes are batch axes, so a stack of windows is handled in one pass.
+    """
+    n_obs = row_norms_sq.shape[-1]
+    n_assets = sample_cov_matrix.shape[-1]
 
-    # Estimate the optimal shrinkage coefficient (Ledoit-Wolf method)
-    delta = np.mean(np.diag(sample_cov_matrix - target_cov_matrix))
-    gamma = np.linalg.norm(sample_cov_matrix - target_cov_matrix, ord='fro') ** 2
-    n_obs = data['Monthly Calendar Date'].nunique()  # Number of unique dates (observations)
+    # the estimator is defined on the biased (1/T) sample covariance
+    biased = sample_cov_matrix * ((n_obs - 1) / n_obs)
+    mu = np.trace(biased, axis1=-2, axis2=-1) / n_assets
+    norm_sq = (biased**2).sum(axis=(-2, -1))
+
+    # distance of the sample covariance to the target, and its estimation error
+    delta = (norm_sq - n_assets * mu**2) / n_assets
+    beta = ((row_norms_sq**2).sum(axis=-1) - n_obs * norm_sq) / (n_obs**2 * n_assets)
+
+    return np.clip(np.divide(beta, delta, out=np.ones_like(delta), where=delta > 0), 0.0, 1.0)
+
+
+def shrink_covariance(sample_cov_matrix: np.ndarray, intensity: np.ndarray) -> np.ndarray:
+    """Shrink a (... x N x N) sample covariance matrix towards its average variance times the identity."""
+
+    # Number of assets (variables)
+    n_assets = sample_cov_matrix.shape[-1]
+    intensity = np.asarray(intensity)[..., None, None]
 
-    alpha = max(0, (gamma - n_assets) / (delta * n_obs))
+    # Ledoit-Wolf shrinkage target: identity times the average of the diagonal elements
+    trace_cov = np.trace(sample_cov_matrix, axis1=-2, axis2=-1)[..., None, None] / n_assets
+    target_cov_matrix = trace_cov * np.eye(n_assets)
 
     # Calculate the shrunken covariance matrix
-    shrunken_cov_matrix = alpha * target_cov_matrix + (1 - alpha) * sample_cov_matrix
+    shrunken_cov_matrix = intensity * target_cov_matrix + (1 - intensity) * sample_cov_matrix
 
     # print("Shrunken Covariance Matrix:")
-    # print(shrunken_cov_matrix.values)
+    # print(shrunken_cov_matrix)
 
-    return shrunken_cov_matrix.values
\ No newline at end of file
+    return shrunken_cov_matrix
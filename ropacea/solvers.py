@@ -0,0 +1,680 @@
+"""Solver backends for the long only min risk model
+
+    minimize    x' V x
+    subject to  sum(x) == 1
+                mu' x >= min_return
+                x >= 0
+
+Two backends implement the MinRiskSolver interface:
+ - 'gurobi': GurobiSession builds the Gurobi model for a fixed number of assets once.
+   Each solve only replaces the quadratic objective and the coefficients and
+   right-hand side of the minimum return constraint.
+ - 'numpy': ActiveSetSolver is a primal active-set method that needs no licence.
+   It warm-starts its active set from the previous solution.
+
+The covariance is a dense matrix or a ropacea.covariance.FactorCovariance. Both
+backends use the factored form of the latter instead of the N x N matrix, so factor
+model solves take O(N K) memory.
+
+    >>> with ActiveSetSolver(n_assets=30) as solver:
+    ...     holdings = solver.solve(expected_returns, covariance, min_return)
+    ...     print(solver.stats)
+
+The backend used by ropacea.portfolios is chosen with set_default_backend() or the
+ROPACEA_SOLVER environment variable. gurobipy is only imported when a GurobiSession
+is created.
+"""
+
+
+import os
+import time
+import atexit
+from dataclasses import dataclass
+
+import numpy as np
+
+from ropacea.covariance import Covariance, FactorCovariance, as_covariance
+from ropacea.instrumentation import record_solve
+
+
+@dataclass
+class SolveStats:
+    """Time spent in a solver session"""
+
+    n_solves: int = 0
+    build_seconds: float = 0.0
+    """Creating the environment, variables and constraints"""
+    update_seconds: float = 0.0
+    """Replacing the objective and the return constraint before each solve"""
+    solve_seconds: float = 0.0
+    """Time the solver reports it spent optimizing"""
+    wall_seconds: float = 0.0
+    """Wall time of all solve() calls"""
+    iterations: int = 0
+    """Simplex or active-set iterations"""
+    status: str = None
+    """How the last solve ended, e.g. 'optimal'"""
+
+    @property
+    def overhead_per_solve(self) -> float:
+        """Average seconds per solve spent outside the optimizer"""
+        if self.n_solves == 0:
+            return 0.0
+        return (self.wall_seconds - self.solve_seconds) / self.n_solves
+
+    def __str__(self) -> str:
+        return (f"{self.n_solves} solves, {self.build_seconds*1e3:.1f} ms build, "
+                f"{self.solve_seconds*1e3:.1f} ms optimizing, "
+                f"{self.overhead_per_solve*1e3:.3f} ms overhead per solve")
+
+
+class MinRiskSolver:
+    """Interface of a min risk solver backend for a fixed number of assets"""
+
+    name: str
+
+    def __init__(self, n_assets: int, warm_start: bool = True) -> None:
+        self.n_assets = n_assets
+        self.warm_start = warm_start
+        self.stats = SolveStats()
+        self.previous_holdings = None
+        self._frontier_start = None
+        self.tickers = None
+        """Tickers of the previous problem, if the caller labels them with relabel()"""
+
+    def solve(self, expected_returns: np.ndarray, covariance: np.ndarray, min_return: float) -> np.ndarray:
+        """Optimal holdings for the given problem data"""
+        raise NotImplementedError
+
+    def solve_frontier(self, expected_returns: np.ndarray, covariance: np.ndarray,
+                       min_returns: np.ndarray) -> np.ndarray:
+        """Optimal holdings for every target in min_returns, as a (K x N) array.
+
+        Targets are solved in increasing order, each starting from the solution of the
+        previous one. A solution that already meets the next target is optimal for it
+        as well and is reused without solving. The lowest target starts from the lowest
+        target of the previous frontier.
+        """
+        min_returns = np.asarray(min_returns, dtype=float)
+        holdings = np.empty((len(min_returns), self.n_assets))
+
+        solution = None
+        for k, target in enumerate(np.argsort(min_returns, kind='stable')):
+            if solution is not None and expected_returns @ solution >= min_returns[target]:
+                holdings[target] = solution
+                continue
+
+            if k == 0 and self._frontier_start is not None:
+                self.previous_holdings = self._frontier_start
+            solution = holdings[target] = self.solve(expected_returns, covariance, min_returns[target])
+            if k == 0:
+                self._frontier_start = solution
+
+        return holdings
+
+    def relabel(self, tickers: tuple) -> None:
+        """Match the previous holdings to the assets of the next problem by ticker instead
+        of by position, so warm starts carry over when the universe changes.
+        Tickers new to the problem start at zero."""
+        tickers = tuple(tickers)
+        if self.tickers is not None and tickers != self.tickers:
+            position = {ticker: k for k, ticker in enumerate(self.tickers)}
+            self.previous_holdings = self._carry_over(self.previous_holdings, position, tickers)
+            self._frontier_start = self._carry_over(self._frontier_start, position, tickers)
+        self.tickers = tickers
+
+    @staticmethod
+    def _carry_over(holdings: np.ndarray, position: dict, tickers: tuple) -> np.ndarray:
+        if holdings is None:
+            return None
+        carried = np.array([holdings[position[ticker]] if ticker in position else 0.0 for ticker in tickers])
+        # nothing held anymore: start cold
+        return carried / carried.sum() if carried.sum() > 0 else None
+
+    def close(self) -> None:
+        """Release any resources held by the solver"""
+
+    def _check_shapes(self, expected_returns: np.ndarray, covariance: np.ndarray) -> None:
+        n_assets = len(expected_returns)
+        if n_assets != self.n_assets:
+            raise ValueError(f"{expected_returns.shape = } incompatible with {self.n_assets = }")
+        if covariance.shape != (n_assets, n_assets):
+            raise ValueError(f"{covariance.shape = } incompatible with {expected_returns.shape = }")
+
+    def __enter__(self) -> 'MinRiskSolver':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_GUROBI_STATUSES = {2: 'optimal', 3: 'infeasible', 4: 'infeasible_or_unbounded', 5: 'unbounded',
+                    7: 'iteration_limit', 9: 'time_limit', 11: 'interrupted', 12: 'numeric', 13: 'suboptimal'}
+"""Names of the Gurobi status codes a solve can end with, without importing gurobipy"""
+
+
+class GurobiSession(MinRiskSolver):
+    """Persistent, quiet Gurobi model for the min risk problem"""
+
+    name = 'gurobi'
+
+    def __init__(self, n_assets: int, warm_start: bool = True) -> None:
+        import gurobipy as gp
+        from gurobipy import GRB
+
+        start = time.perf_counter()
+        super().__init__(n_assets, warm_start)
+
+        self.env = gp.Env(empty=True)
+        self.env.setParam('OutputFlag', 0)
+        self.env.start()
+
+        self.model = gp.Model(env=self.env)
+        # dual simplex re-optimizes from the previous basis after the objective changes
+        self.model.Params.Method = 1
+
+        # allocation variables
+        self.holdings = self.model.addMVar(
+            shape = n_assets,
+            lb = 0.0, # long only
+            ub = float('inf'),
+            name = 'holdings'
+        )
+        self._holdings_vars = self.holdings.tolist()
+
+        # fully invested constraint
+        self.model.addConstr(self.holdings.sum() == 1, name='budget')
+
+        # minimum return constraint, coefficients are set for each solve
+        self._min_return = self.model.addLConstr(
+            gp.LinExpr([1.0] * n_assets, self._holdings_vars), GRB.GREATER_EQUAL, 0.0,
+            name='min_return'
+        )
+
+        # factor exposures y == B' x of factored covariances, added on first use
+        self._exposure_vars = []
+        self._exposures = []
+        self._loadings = None
+
+        self.model.update()
+        self.stats.build_seconds = time.perf_counter() - start
+
+    def solve(self, expected_returns: np.ndarray, covariance: np.ndarray, min_return: float) -> np.ndarray:
+        """Optimal holdings for the given problem data"""
+        from gurobipy import GRB
+
+        start = time.perf_counter()
+        self._check_shapes(expected_returns, covariance)
+
+        # set objective to minimize risk
+        if isinstance(covariance, FactorCovariance) and np.linalg.eigvalsh(covariance.factor_covariance).min() >= 0:
+            self._set_factor_objective(covariance)
+        else:
+            # a factor covariance F that is not positive semidefinite would make y' F y
+            # non-convex even though V is not
+            self.model.setMObjective(np.asarray(covariance, dtype=float), None, 0.0,
+                                     xQ_L=self.holdings, xQ_R=self.holdings, sense=GRB.MINIMIZE)
+
+        for var, coeff in zip(self._holdings_vars, expected_returns):
+            self.model.chgCoeff(self._min_return, var, float(coeff))
+        self._min_return.RHS = min_return
+
+        if not self.warm_start:
+            # discard the previous basis so the solve starts from scratch
+            self.model.reset()
+        elif self.previous_holdings is not None:
+            self.holdings.PStart = self.previous_holdings
+
+        updated = time.perf_counter()
+        self.model.optimize()
+
+        holdings = self.holdings.X
+        self.previous_holdings = holdings
+
+        self.stats.n_solves += 1
+        self.stats.update_seconds += updated - start
+        self.stats.solve_seconds += self.model.Runtime
+        self.stats.iterations += int(self.model.IterCount)
+        self.stats.wall_seconds += time.perf_counter() - start
+        self.stats.status = _GUROBI_STATUSES.get(self.model.Status, str(self.model.Status))
+        record_solve(self.name, self.stats.status, int(self.model.IterCount), self.model.Runtime)
+
+        return holdings
+
+    def _set_factor_objective(self, covariance: FactorCovariance) -> None:
+        """Minimize x' D x + y' F y with y == B' x, which keeps the N x N matrix out of the model"""
+        import gurobipy as gp
+        from gurobipy import GRB
+
+        loadings = covariance.loadings
+        if len(self._exposures) != covariance.n_factors:
+            self.model.remove(self._exposures + self._exposure_vars)
+            self._exposure_vars = self.model.addMVar(covariance.n_factors, lb=-float('inf'),
+                                                     name='exposure').tolist()
+            self._exposures = [
+                self.model.addLConstr(gp.LinExpr(loadings[:, k].tolist(), self._holdings_vars) - y,
+                                      GRB.EQUAL, 0.0, name=f'exposure[{k}]')
+                for k, y in enumerate(self._exposure_vars)
+            ]
+        elif not np.array_equal(loadings, self._loadings):
+            for constr, column in zip(self._exposures, loadings.T):
+                for var, coeff in zip(self._holdings_vars, column):
+                    self.model.chgCoeff(constr, var, float(coeff))
+        self._loadings = loadings
+
+        objective = gp.QuadExpr()
+        objective.addTerms(covariance.idiosyncratic.tolist(), self._holdings_vars, self._holdings_vars)
+        F = covariance.factor_covariance
+        rows, cols = np.indices(F.shape)
+        objective.addTerms(F.ravel().tolist(),
+                           [self._exposure_vars[k] for k in rows.ravel()],
+                           [self._exposure_vars[k] for k in cols.ravel()])
+        self.model.setObjective(objective, GRB.MINIMIZE)
+
+    def close(self) -> None:
+        """Dispose of the model and its environment"""
+        if self.model is not None:
+            self.model.dispose()
+            self.env.dispose()
+            self.model = self.env = None
+
+
+class ActiveSetSolver(MinRiskSolver):
+    """Primal active-set method for the min risk problem
+
+    The working set holds the bounds x_i >= 0 fixed at zero and, possibly, the minimum
+    return constraint. Each iteration solves the equality constrained problem on the
+    free assets in range-space form, which only needs V restricted to the free assets
+    applied to two vectors. When neither bounds nor the return constraint bind, the
+    closed form minimum variance portfolio is returned directly. Solves start from the
+    previous holdings, so the previous working set is the initial one. The first solve
+    starts from a guess of the assets held at the optimum, see _guess_start().
+
+    V is only used through solves and products, so with a FactorCovariance each
+    iteration costs O(N K^2) instead of O(N^3).
+    """
+
+    name = 'numpy'
+
+    def __init__(self, n_assets: int, warm_start: bool = True,
+                 tol: float = 1e-12, max_iter: int = None) -> None:
+        super().__init__(n_assets, warm_start)
+        self.tol = tol
+        self.max_iter = max_iter if max_iter is not None else 10 * n_assets + 50
+
+    def solve(self, expected_returns: np.ndarray, covariance: np.ndarray, min_return: float) -> np.ndarray:
+        start = time.perf_counter()
+        self._check_shapes(expected_returns, covariance)
+
+        expected_returns = np.asarray(expected_returns, dtype=float)
+        covariance = as_covariance(covariance)
+
+        holdings, iterations = self._solve(expected_returns, covariance, min_return)
+        self.previous_holdings = holdings
+
+        elapsed = time.perf_counter() - start
+        self.stats.n_solves += 1
+        self.stats.iterations += iterations
+        self.stats.solve_seconds += elapsed
+        self.stats.wall_seconds += elapsed
+        self.stats.status = 'optimal'
+        record_solve(self.name, self.stats.status, iterations, elapsed)
+
+        return holdings
+
+    def _solve(self, mu: np.ndarray, V: Covariance, min_return: float) -> tuple[np.ndarray, int]:
+        n = self.n_assets
+        ones = np.ones(n)
+
+        if mu.max() < min_return:
+            raise ValueError(f"No long only portfolio reaches {min_return = }")
+
+        # closed form minimum variance portfolio, if no constraint binds
+        x = V.solve(ones)
+        x /= x.sum()
+        if x.min() >= 0 and mu @ x >= min_return:
+            return x, 0
+
+        # equality constraints without and with the return constraint
+        A_budget, b_budget = ones[None, :], np.array([1.0])
+        A_return, b_return = np.vstack([ones, mu]), np.array([1.0, min_return])
+
+        # feasible starting point: the previous holdings, whose zeros are the previous
+        # working set, or a guess of the assets held at the optimum
+        return_active = False
+        if self.warm_start and self.previous_holdings is not None:
+            x = self.previous_holdings.copy()
+        else:
+            return_active = mu @ x < min_return
+            x = self._guess_start(V, *((A_return, b_return) if return_active else (A_budget, b_budget)))
+        at_bound = x <= 0.0
+
+        # move towards the highest return asset until the return constraint holds
+        if mu @ x < min_return:
+            best = np.argmax(mu)
+            t = (min_return - mu @ x) / (mu[best] - mu @ x)
+            x = (1 - t) * x
+            x[best] += t
+            at_bound[best] = False
+            return_active = True
+
+        for iteration in range(1, self.max_iter + 1):
+            free = ~at_bound
+            A, b = (A_return, b_return) if return_active else (A_budget, b_budget)
+
+            x_eq, multipliers = self._equality_step(V, A, b, free)
+            step = x_eq - x
+
+            if np.abs(step).max() <= self.tol * max(1.0, np.abs(x).max()):
+                x = x_eq
+
+                # multipliers of the bounds in the working set and of the return constraint
+                gradient = 2 * (V @ x)
+                bound_multipliers = gradient - A.T @ multipliers
+                bound_multipliers[free] = np.inf
+                return_multiplier = multipliers[1] if return_active else np.inf
+
+                scale = self.tol * max(1.0, np.abs(gradient).max())
+                drop = np.argmin(bound_multipliers)
+                if min(bound_multipliers[drop], return_multiplier) >= -scale:
+                    return x, iteration
+
+                if return_multiplier < bound_multipliers[drop]:
+                    return_active = False
+                else:
+                    at_bound[drop] = False
+                continue
+
+            # longest step along step that keeps every constraint satisfied
+            alpha, blocking = 1.0, None
+            decreasing = free & (step < 0)
+            if decreasing.any():
+                ratios = np.full(n, np.inf)
+                ratios[decreasing] = -x[decreasing] / step[decreasing]
+                i = np.argmin(ratios)
+                if ratios[i] < alpha:
+                    alpha, blocking = ratios[i], i
+            if not return_active and mu @ step < 0:
+                ratio = (mu @ x - min_return) / -(mu @ step)
+                if ratio < alpha:
+                    alpha, blocking = ratio, 'return'
+
+            if blocking is None:
+                x = x_eq
+            else:
+                x = x + alpha * step
+                if blocking == 'return':
+                    return_active = True
+                else:
+                    at_bound[blocking] = True
+                    x[blocking] = 0.0
+
+        raise RuntimeError(f"Active-set solver did not converge in {self.max_iter} iterations")
+
+    def _guess_start(self, V: Covariance, A: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Solve A x == b without the bounds, fix every asset with a negative holding at
+        zero and repeat, until all holdings are non-negative.
+
+        The assets left are usually close to the ones held at the optimum, which leaves
+        the active-set iterations only a few assets to add or remove.
+        """
+        free = np.ones(self.n_assets, dtype=bool)
+        while True:
+            x, _ = self._equality_step(V, A, b, free)
+            negative = free & (x < 0)
+            if x[negative].sum() >= -self.tol:
+                break
+            free &= ~negative
+
+        x = np.maximum(x, 0.0)
+        return x / x.sum()
+
+    @staticmethod
+    def _equality_step(V: Covariance, A: np.ndarray, b: np.ndarray, free: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Minimize x' V x subject to A x == b with x fixed to zero outside free.
+
+        Returns the minimizer and the multipliers of A x == b, scaled so that
+        2 V x == A' multipliers on the free assets.
+        """
+        A_free = A[:, free]
+        # V_free^-1 A_free'
+        VinvA = V.restrict(free).solve(A_free.T)
+        try:
+            multipliers = 2 * np.linalg.solve(A_free @ VinvA, b)
+        except np.linalg.LinAlgError:
+            # returns of the free assets are all equal, the constraints coincide
+            multipliers = 2 * np.linalg.lstsq(A_free @ VinvA, b, rcond=None)[0]
+
+        x = np.zeros(len(free))
+        x[free] = VinvA @ multipliers / 2
+        return x, multipliers
+
+
+def solve_min_risk_batch(expected_returns: np.ndarray,
+                         covariances: np.ndarray,
+                         min_returns: np.ndarray,
+                         tol: float = 1e-12,
+                         max_iter: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """(B x N) long only min risk holdings of B problems with dense (B x N x N)
+    covariances, and the number of iterations of each.
+
+    The iterations of ActiveSetSolver, run on all problems at once: each one solves the
+    (N + 2) x (N + 2) KKT systems of every unfinished problem in one batched solve, with
+    the rows of the assets fixed at zero and of an inactive return constraint replaced
+    by identity rows. Problems whose closed form minimum variance portfolio is optimal
+    take no iteration.
+    """
+    mu = np.asarray(expected_returns, dtype=float)
+    V = np.asarray(covariances, dtype=float)
+    min_returns = np.asarray(min_returns, dtype=float)
+    n_problems, n = mu.shape
+    max_iter = max_iter if max_iter is not None else 10 * n + 50
+
+    if (mu.max(axis=1) < min_returns).any():
+        raise ValueError(f"No long only portfolio reaches the min return of problems "
+                         f"{np.flatnonzero(mu.max(axis=1) < min_returns)}")
+
+    # closed form minimum variance portfolios
+    x = np.linalg.solve(V, np.ones((n_problems, n, 1)))[..., 0]
+    x /= x.sum(axis=1, keepdims=True)
+    iterations = np.zeros(n_problems, dtype=int)
+    done = (x.min(axis=1) >= 0) & (np.einsum('bi,bi->b', mu, x) >= min_returns)
+
+    # feasible start: the guess of ActiveSetSolver._guess_start(), moved towards the
+    # highest return asset until the return constraint holds
+    start = np.flatnonzero(~done)
+    return_active = ~done & (np.einsum('bi,bi->b', mu, x) < min_returns)
+    x[start] = _batch_guess_start(mu[start], V[start], min_returns[start], return_active[start], tol)
+    at_bound = x <= 0.0
+
+    shortfall = min_returns - np.einsum('bi,bi->b', mu, x)
+    move = np.flatnonzero(~done & (shortfall > 0))
+    best = np.argmax(mu[move], axis=1)
+    t = shortfall[move] / (mu[move, best] - (mu[move] * x[move]).sum(axis=1))
+    x[move] *= (1 - t)[:, None]
+    x[move, best] += t
+    at_bound[move, best] = False
+    return_active[move] = True
+
+    for iteration in range(1, max_iter + 1):
+        active = np.flatnonzero(~done)
+        if not len(active):
+            return x, iterations
+        iterations[active] = iteration
+
+        x_eq, multipliers = _batch_equality_step(mu[active], V[active], min_returns[active],
+                                                 at_bound[active], return_active[active])
+        x_active, step = x[active], x_eq - x[active]
+        converged = np.abs(step).max(axis=1) <= tol * np.maximum(1.0, np.abs(x_active).max(axis=1))
+
+        # at the minimizer of the working set: finished, or drop the most negative multiplier
+        c = converged
+        if c.any():
+            b = active[c]
+            x[b] = x_eq[c]
+            gradient = 2 * np.einsum('bij,bj->bi', V[b], x[b])
+            bound_multipliers = gradient - multipliers[c, :1] - multipliers[c, 1:] * mu[b]
+            bound_multipliers[~at_bound[b]] = np.inf
+            return_multiplier = np.where(return_active[b], multipliers[c, 1], np.inf)
+
+            scale = tol * np.maximum(1.0, np.abs(gradient).max(axis=1))
+            drop = np.argmin(bound_multipliers, axis=1)
+            lowest = bound_multipliers[np.arange(len(b)), drop]
+            done[b] = np.minimum(lowest, return_multiplier) >= -scale
+
+            release_return = ~done[b] & (return_multiplier < lowest)
+            release_bound = ~done[b] & ~release_return
+            return_active[b[release_return]] = False
+            at_bound[b[release_bound], drop[release_bound]] = False
+
+        # otherwise the longest step along step that keeps every constraint satisfied
+        m = ~converged
+        if m.any():
+            b, x_b, step_b = active[m], x_active[m], step[m]
+            decreasing = ~at_bound[b] & (step_b < 0)
+            ratios = np.full(step_b.shape, np.inf)
+            ratios[decreasing] = -x_b[decreasing] / step_b[decreasing]
+            blocking = np.argmin(ratios, axis=1)
+            alpha = np.minimum(ratios[np.arange(len(b)), blocking], 1.0)
+            bound_blocks = alpha < 1.0
+
+            return_slope = np.einsum('bi,bi->b', mu[b], step_b)
+            return_ratio = np.full(len(b), np.inf)
+            leaving = ~return_active[b] & (return_slope < 0)
+            return_ratio[leaving] = ((np.einsum('bi,bi->b', mu[b[leaving]], x_b[leaving]) - min_returns[b[leaving]])
+                                     / -return_slope[leaving])
+            return_blocks = return_ratio < alpha
+            alpha = np.where(return_blocks, return_ratio, alpha)
+            bound_blocks &= ~return_blocks
+
+            x[b] = x_b + alpha[:, None] * step_b
+            return_active[b[return_blocks]] = True
+            at_bound[b[bound_blocks], blocking[bound_blocks]] = True
+            x[b[bound_blocks], blocking[bound_blocks]] = 0.0
+
+    raise RuntimeError(f"Batched active-set solver did not converge in {max_iter} iterations")
+
+
+def _batch_guess_start(mu: np.ndarray, V: np.ndarray, min_returns: np.ndarray,
+                       return_active: np.ndarray, tol: float) -> np.ndarray:
+    """ActiveSetSolver._guess_start() of a batch of problems"""
+    at_bound = np.zeros(mu.shape, dtype=bool)
+    guessing = np.arange(len(mu))
+    x = np.empty_like(mu)
+    while len(guessing):
+        x[guessing], _ = _batch_equality_step(mu[guessing], V[guessing], min_returns[guessing],
+                                              at_bound[guessing], return_active[guessing])
+        negative = ~at_bound[guessing] & (x[guessing] < 0)
+        more = np.where(negative, x[guessing], 0.0).sum(axis=1) < -tol
+        at_bound[guessing[more]] |= negative[more]
+        guessing = guessing[more]
+
+    x = np.maximum(x, 0.0)
+    return x / x.sum(axis=1, keepdims=True)
+
+
+def _batch_equality_step(mu: np.ndarray, V: np.ndarray, min_returns: np.ndarray,
+                         at_bound: np.ndarray, return_active: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ActiveSetSolver._equality_step() of a batch of problems, from their KKT systems.
+
+    Returns the minimizers and the (B x 2) multipliers of the budget and the return
+    constraint, zero when the latter is not in the working set.
+    """
+    n_problems, n = mu.shape
+    diagonal = np.arange(n)
+
+    kkt = np.zeros((n_problems, n + 2, n + 2))
+    kkt[:, :n, :n] = 2 * V
+    kkt[:, :n, n] = -1.0
+    kkt[:, :n, n + 1] = -mu
+    # x_i == 0 for the assets at their bound
+    kkt[:, :n, :][at_bound] = 0.0
+    kkt[:, diagonal, diagonal] += at_bound
+    # 1' x == 1, and mu' x == min_return or a zero return multiplier
+    kkt[:, n, :n] = 1.0
+    kkt[:, n + 1, :n] = np.where(return_active[:, None], mu, 0.0)
+    kkt[:, n + 1, n + 1] = ~return_active
+
+    rhs = np.zeros((n_problems, n + 2))
+    rhs[:, n] = 1.0
+    rhs[:, n + 1] = np.where(return_active, min_returns, 0.0)
+
+    try:
+        solution = np.linalg.solve(kkt, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # returns of the free assets are all equal in some problem, the constraints coincide
+        solution = np.einsum('bij,bj->bi', np.linalg.pinv(kkt), rhs)
+    return solution[:, :n], solution[:, n:]
+
+
+SOLVER_BACKENDS = {
+    GurobiSession.name: GurobiSession,
+    ActiveSetSolver.name: ActiveSetSolver,
+}
+"""Available solver backends by name"""
+
+_default_backend = os.environ.get('ROPACEA_SOLVER', GurobiSession.name)
+
+_sessions = {}
+"""Shared solvers, keyed by backend name and number of assets"""
+
+# solver environments are not fork safe, child processes create their own
+os.register_at_fork(after_in_child=_sessions.clear)
+
+
+def set_default_backend(name: str) -> None:
+    """Select the solver backend used by get_session(), 'gurobi' or 'numpy'"""
+    global _default_backend
+    if name not in SOLVER_BACKENDS:
+        raise ValueError(f"Unknown solver backend {name!r}, expected one of {list(SOLVER_BACKENDS)}")
+    _default_backend = name
+
+
+def get_default_backend() -> str:
+    return _default_backend
+
+
+def get_session(n_assets: int, backend: str = None) -> MinRiskSolver:
+    """Shared solver for problems with n_assets, created on first use"""
+    backend = backend or _default_backend
+    if backend not in SOLVER_BACKENDS:
+        raise ValueError(f"Unknown solver backend {backend!r}, expected one of {list(SOLVER_BACKENDS)}")
+
+    key = (backend, n_assets)
+    if key not in _sessions:
+        _sessions[key] = SOLVER_BACKENDS[backend](n_assets)
+    return _sessions[key]
+
+
+@atexit.register
+def close_sessions() -> None:
+    """Dispose of all shared sessions"""
+    while _sessions:
+        _, session = _sessions.popitem()
+        session.close()
+
+
+# compare the backends, using Gurobi as the accuracy oracle
+if __name__ == '__main__':
+    from datetime import date
+    from dateutil.relativedelta import relativedelta
+    from ropacea.portfolios import PortfolioStrategy, _estimate
+
+    problems = []
+    for strategy in (PortfolioStrategy.SINGLE_FACTOR,
+                     PortfolioStrategy.CONSTANT_CORRELATION,
+                     PortfolioStrategy.SAMPLE_COVARIANCE,
+                     PortfolioStrategy.STATISTICAL_FACTOR):
+        mark_date = date(2016, 1, 1)
+        while mark_date < date(2023, 1, 1):
+            expected_returns, covariance = _estimate(mark_date, strategy)
+            problems.append((expected_returns, covariance, expected_returns.mean()))
+            mark_date += relativedelta(months=1)
+
+    n_assets = len(problems[0][0])
+    with GurobiSession(n_assets) as oracle, ActiveSetSolver(n_assets) as solver:
+        errors = [np.abs(oracle.solve(*problem) - solver.solve(*problem)).max()
+                  for problem in problems]
+        print(f"gurobi: {oracle.stats}")
+        print(f"numpy:  {solver.stats}")
+    print(f"max abs holdings difference: {max(errors):.2e}")
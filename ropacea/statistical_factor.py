@@ -0,0 +1,159 @@
+# Statistical (PCA) factor model
+
+from datetime import date
+from typing import Callable
+import numpy as np
+from ropacea.data import get_in_sample_data
+from ropacea.covariance import FactorCovariance
+
+
+MAX_FACTORS = 10
+"""Most factors a statistical factor model keeps"""
+
+_MIN_IDIOSYNCRATIC = 0.01
+"""Floor of the idiosyncratic variances, as a fraction of each ticker's variance"""
+
+
+def statistical_factor(data, explained_variance: float = None, max_factors: int = MAX_FACTORS) -> FactorCovariance:
+    '''Statistical factor covariance estimate from monthly-return-capitalization data.
+
+    The factors are the leading principal components of the returns. Months a ticker
+    has no data count as a zero deviation from its mean return.
+    '''
+
+    # months x tickers, tickers in alphabetical order
+    returns = data.pivot_table(values='Monthly Total Return',
+                               index='Monthly Calendar Date',
+                               columns='Ticker').values
+
+    centered = np.nan_to_num(returns - np.nanmean(returns, axis=0))
+    variance = np.nanvar(returns, axis=0, ddof=1)
+
+    covariance, _ = statistical_factor_covariance(centered, variance, explained_variance, max_factors)
+    return covariance
+
+
+def statistical_factor_covariance(centered: np.ndarray,
+                                  variance: np.ndarray = None,
+                                  explained_variance: float = None,
+                                  max_factors: int = MAX_FACTORS,
+                                  start: np.ndarray = None) -> tuple[FactorCovariance, np.ndarray]:
+    '''K factor covariance from the principal components of demeaned returns.
+
+    Parameters:
+        centered: (T x N) returns minus the mean return of each ticker
+        variance: (N,) variance of each ticker, by default that of centered
+        explained_variance: keep the fewest factors explaining this fraction of the
+            total variance instead of those above the noise level, see n_factors()
+        start: (N x L) subspace to start the SVD from, e.g. the one returned for the
+            previous month
+
+    Returns the covariance and the subspace of the leading singular vectors.
+    The sample covariance matrix is never formed.
+    '''
+    n_obs, n_assets = centered.shape
+    if variance is None:
+        variance = (centered**2).sum(axis=0) / (n_obs - 1)
+
+    n_components = min(max_factors + 5, n_obs, n_assets)
+    if 4 * n_components >= min(n_obs, n_assets):
+        # a full thin SVD costs about as much as a few subspace iterations
+        _, singular_values, vt = np.linalg.svd(centered, full_matrices=False)
+        singular_values, vectors = singular_values[:n_components], vt[:n_components].T
+    else:
+        noise_edge = noise_eigenvalue(variance.sum(), n_obs, n_assets)
+
+        def n_converged(singular_values: np.ndarray) -> int:
+            # only the factors that can be kept need to converge
+            if explained_variance is not None:
+                return max_factors
+            return int(np.clip((singular_values**2 / (n_obs - 1) > noise_edge).sum(), 1, max_factors))
+
+        singular_values, vectors = truncated_svd(centered, n_components, start, n_converged)
+
+    eigenvalues = singular_values**2 / (n_obs - 1)
+    k = n_factors(eigenvalues, variance.sum(), n_obs, n_assets, explained_variance, max_factors)
+
+    loadings = vectors[:, :k]
+    common = (loadings**2) @ eigenvalues[:k]
+    idiosyncratic = np.maximum(variance - common, _MIN_IDIOSYNCRATIC * variance)
+
+    return FactorCovariance(loadings, np.diag(eigenvalues[:k]), idiosyncratic), vectors
+
+
+def truncated_svd(X: np.ndarray,
+                  n_components: int,
+                  start: np.ndarray = None,
+                  n_converged: Callable[[np.ndarray], int] = None,
+                  tol: float = 1e-9,
+                  max_iter: int = 500) -> tuple[np.ndarray, np.ndarray]:
+    '''Leading singular values and right singular vectors of X by randomized subspace iteration.
+
+    Iterates from start, or from a fixed random subspace, until the leading singular
+    vectors move less than tol, so the result does not depend on the starting subspace
+    beyond tol. n_converged gives the number of leading vectors that must converge from
+    the current singular values, all n_components by default. A start close to the
+    answer, such as last month's subspace, saves most of the iterations.
+    '''
+    n_assets = X.shape[1]
+    if start is None or start.shape != (n_assets, n_components):
+        start = np.random.default_rng(0).standard_normal((n_assets, n_components))
+
+    vectors, _ = np.linalg.qr(start)
+    for _ in range(max_iter):
+        previous = vectors
+        left, _ = np.linalg.qr(X @ vectors)
+        subspace, r = np.linalg.qr(X.T @ left)
+
+        # rotate the subspace onto the singular vectors
+        u, singular_values, _ = np.linalg.svd(r)
+        vectors = subspace @ u
+
+        k = n_converged(singular_values) if n_converged is not None else n_components
+        # singular vectors are only defined up to sign
+        signs = np.sign((previous[:, :k] * vectors[:, :k]).sum(axis=0))
+        if np.abs(vectors[:, :k] - signs * previous[:, :k]).max() <= tol:
+            break
+
+    return singular_values, vectors
+
+
+def noise_eigenvalue(total_variance: float, n_obs: int, n_assets: int) -> float:
+    '''Marchenko-Pastur upper edge of the eigenvalues of the sample covariance of
+    n_obs returns of n_assets made of noise with the same average variance'''
+    return total_variance / n_assets * (1 + np.sqrt(n_assets / n_obs))**2
+
+
+def n_factors(eigenvalues: np.ndarray,
+              total_variance: float,
+              n_obs: int,
+              n_assets: int,
+              explained_variance: float = None,
+              max_factors: int = MAX_FACTORS) -> int:
+    '''Number of principal components to keep, between 1 and max_factors.
+
+    With explained_variance, the fewest components whose eigenvalues add up to that
+    fraction of total_variance. Otherwise the eigenvalues above noise_eigenvalue().
+    '''
+    if explained_variance is not None:
+        k = np.searchsorted(np.cumsum(eigenvalues) / total_variance, explained_variance) + 1
+    else:
+        k = (eigenvalues > noise_eigenvalue(total_variance, n_obs, n_assets)).sum()
+
+    return int(np.clip(k, 1, min(max_factors, len(eigenvalues))))
+
+
+# test functionality
+if __name__ == '__main__':
+    mark_date = date(year = 2017, month=1, day=1)
+    sample_months = 60
+    data = get_in_sample_data(mark_date, sample_months)
+    out = statistical_factor(data)
+
+    returns = data.pivot_table(values='Monthly Total Return',
+                               index='Monthly Calendar Date',
+                               columns='Ticker').values
+    sample_cov = np.cov(returns, rowvar=False)
+    print(f"{out.n_factors} factors")
+    print("max abs difference to the sample covariance:", np.abs(np.asarray(out) - sample_cov).max())
+    print("max abs difference of the variances:", np.abs(out.diagonal() - np.diag(sample_cov)).max())
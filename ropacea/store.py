@@ -0,0 +1,332 @@
+"""Append-only local store of tables, partitioned by month.
+
+A PartitionedTable keeps the rows of each month in their own directory. An ingest
+only writes the rows that are new or changed, as one new part file in each month
+they fall in, so adding a month of data costs that month and not a reparse of the
+whole history:
+
+    store/monthly-return-capitalization/
+        manifest.json       columns, category values and the part files of each month
+        2017-01/000012.npy  rows of the 12th ingest dated January 2017
+
+    >>> table = PartitionedTable(STORE_DIR / 'risk-free', RISK_FREE_STORE_SPEC)
+    >>> table.ingest_file(FEED_DIR / 'risk-free-2024-06.csv', mode='upsert')
+    >>> table.read(['Calendar Date', '10 Year Bond Returns']).columns['Calendar Date']
+
+Rows are identified by the unique_columns of the TableSpec. Ingesting a key again
+keeps the stored row with mode='append', like ropacea.columnar keeps the first row of
+a key, and replaces it with mode='upsert'. read() merges the parts of each month,
+later parts winning, into the same ColumnarTable as ropacea.columnar.load_table().
+Part files never change once written, so a PartitionedTable keeps the months it has
+merged and a later read() only loads the parts written since.
+
+The manifest is replaced atomically after the part files are written, so readers
+never see half an ingest. Only one process should ingest into a table at a time.
+"""
+
+
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from ropacea.columnar import ColumnarTable, TableSpec
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass
+class IngestReport:
+    """What one ingest changed"""
+
+    rows: int = 0
+    """Rows read, after dropping repeated keys"""
+    added: int = 0
+    """Rows with a key that was not stored yet"""
+    replaced: int = 0
+    """Stored rows replaced by a changed row, with mode='upsert'"""
+    months: list = field(default_factory=list)
+    """'YYYY-MM' of the partitions given a new part file"""
+
+    @property
+    def unchanged(self) -> int:
+        """Rows already stored, or left out by mode='append'"""
+        return self.rows - self.added - self.replaced
+
+    def __str__(self) -> str:
+        return (f"{self.rows} rows: {self.added} added, {self.replaced} replaced, {self.unchanged} unchanged, "
+                f"{len(self.months)} months written")
+
+
+class PartitionedTable:
+    """Rows of a table in one directory per month of the partition_column"""
+
+    def __init__(self, directory: Path, spec: TableSpec, partition_column: str = None) -> None:
+        if not spec.unique_columns:
+            raise ValueError("A partitioned table needs the unique_columns identifying its rows")
+        self.directory = Path(directory)
+        self.spec = spec
+        self.partition_column = partition_column or spec.date_columns[0]
+        self._merged = {}
+        """(part files, column arrays) of each month read so far"""
+
+    def exists(self) -> bool:
+        return (self.directory / 'manifest.json').exists()
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / 'manifest.json'
+
+    def months(self) -> list[str]:
+        """'YYYY-MM' of the stored partitions"""
+        return sorted(self._read_manifest()['partitions'])
+
+    def read(self, columns: list[str] = None) -> ColumnarTable:
+        """The requested columns (all if None) of the latest rows of every key"""
+        manifest = self._read_manifest()
+        if not manifest['partitions']:
+            raise FileNotFoundError(f"Nothing has been ingested into {self.directory}")
+
+        kinds = dict(manifest['columns'])
+        names = list(columns) if columns is not None else list(kinds)
+        for name in names:
+            if name not in kinds:
+                raise KeyError(f"{name!r} is not a column of {self.directory}")
+
+        partitions = [self._partition(month, manifest) for month in sorted(manifest['partitions'])]
+        arrays = {name: np.concatenate([partition[name] for partition in partitions]) for name in kinds}
+        if self.spec.sort_column is not None:
+            # the months are in order, sort within them like ropacea.columnar does
+            order = np.argsort(arrays[self.spec.sort_column], kind='stable')
+            arrays = {name: array[order] for name, array in arrays.items()}
+
+        table = ColumnarTable()
+        for name in names:
+            column = arrays[name]
+            if kinds[name] == 'category':
+                # codes into the sorted values, as pandas.factorize(sort=True) gives them
+                values = np.asarray(manifest['categories'][name], dtype=str)
+                ranks = np.empty(len(values), dtype=np.int32)
+                ranks[np.argsort(values, kind='stable')] = np.arange(len(values), dtype=np.int32)
+                table.columns[name] = ranks[column]
+                table.categories[name] = np.sort(values)
+            else:
+                table.columns[name] = column
+        return table
+
+    def ingest(self, frame: 'pd.DataFrame', mode: str = 'append', source: str = None) -> IngestReport:
+        """Write the rows of frame that are new, or changed with mode='upsert', to new
+        part files of their months. source names the file the rows came from, so that
+        ingest_file() skips it while it does not change."""
+        if mode not in ('append', 'upsert'):
+            raise ValueError(f"Unknown ingest mode {mode!r}, expected 'append' or 'upsert'")
+
+        manifest = self._read_manifest()
+        frame = self._prepare(frame, manifest)
+        report = IngestReport(rows=len(frame))
+        sequence = manifest['sequence'] + 1
+
+        months = frame[self.partition_column].values.astype('datetime64[M]')
+        for month in np.unique(months):
+            label = str(month)
+            batch = frame[months == month]
+            rows = self._changed_rows(batch, label, manifest, mode, report)
+            if len(rows):
+                part = f'{label}/{sequence:06d}.npy'
+                self._write_part(part, self._encode(rows, manifest))
+                manifest['partitions'].setdefault(label, []).append(part)
+                report.months.append(label)
+
+        if source is not None:
+            manifest['sources'][Path(source).name] = _digest(Path(source))
+        if report.months or source is not None:
+            manifest['sequence'] = sequence
+            self._write_manifest(manifest)
+        return report
+
+    def ingest_file(self, path: Path, mode: str = 'append') -> IngestReport:
+        """Ingest a CSV file, unless a file of the same name and contents was ingested before"""
+        import pandas as pd
+
+        path = Path(path)
+        if self._read_manifest()['sources'].get(path.name) == _digest(path):
+            return IngestReport()
+        return self.ingest(pd.read_csv(path), mode, source=path)
+
+    def compact(self) -> int:
+        """Merge the part files of each month into one, returns the number of months
+        compacted. Readers must not be reading the table meanwhile."""
+        manifest = self._read_manifest()
+        sequence = manifest['sequence'] + 1
+        removed = []
+        for month, parts in manifest['partitions'].items():
+            if len(parts) > 1:
+                part = f'{month}/{sequence:06d}.npy'
+                self._write_part(part, self._partition(month, manifest))
+                removed.append(parts)
+                manifest['partitions'][month] = [part]
+
+        if removed:
+            manifest['sequence'] = sequence
+            self._write_manifest(manifest)
+            for part in sum(removed, []):
+                (self.directory / part).unlink(missing_ok=True)
+        return len(removed)
+
+    def _read_manifest(self) -> dict:
+        try:
+            return json.loads(self.manifest_path.read_text())
+        except FileNotFoundError:
+            return {'columns': [], 'categories': {}, 'partitions': {}, 'sources': {}, 'sequence': 0}
+
+    def _write_manifest(self, manifest: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _write_part(self, part: str, arrays: dict) -> None:
+        """Write the columns as one structured array, which loads with a single header"""
+        path = self.directory / part
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rows = np.empty(len(next(iter(arrays.values()))), dtype=[(name, array.dtype) for name, array in arrays.items()])
+        for name, array in arrays.items():
+            rows[name] = array
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, rows)
+        os.replace(tmp_path, path)
+
+    def _read_part(self, part: str) -> dict:
+        rows = np.load(self.directory / part)
+        return {name: rows[name] for name in rows.dtype.names}
+
+    def _partition(self, month: str, manifest: dict) -> dict:
+        """Column arrays of the month, category columns as codes into the manifest's
+        values, with the row of each key from its latest part at its first position"""
+        parts = tuple(manifest['partitions'][month])
+        cached = self._merged.get(month)
+        if cached is not None and cached[0] == parts:
+            return cached[1]
+
+        names = [name for name, _ in manifest['columns']]
+        loaded = [self._read_part(part) for part in parts]
+        arrays = {name: np.concatenate([part[name] for part in loaded]) for name in names}
+        if len(parts) > 1:
+            keys = np.rec.fromarrays([arrays[name] for name in self.spec.unique_columns])
+            _, first = np.unique(keys, return_index=True)
+            _, last_reversed = np.unique(keys[::-1], return_index=True)
+            rows = (len(keys) - 1 - last_reversed)[np.argsort(first, kind='stable')]
+            arrays = {name: array[rows] for name, array in arrays.items()}
+
+        self._merged[month] = (parts, arrays)
+        return arrays
+
+    def _prepare(self, frame: 'pd.DataFrame', manifest: dict) -> 'pd.DataFrame':
+        """Parse the dates of frame, drop its repeated keys and check it has the stored columns"""
+        import pandas as pd
+
+        frame = frame.copy()
+        for name in self.spec.date_columns:
+            if not pd.api.types.is_datetime64_any_dtype(frame[name]):
+                frame[name] = pd.to_datetime(frame[name], format=self.spec.date_format)
+        frame = frame.drop_duplicates(subset=list(self.spec.unique_columns), keep='first')
+
+        if not manifest['columns']:
+            manifest['columns'] = [[name, _kind(frame[name], self.spec)] for name in frame.columns]
+        stored = [name for name, _ in manifest['columns']]
+        if sorted(stored) != sorted(frame.columns):
+            raise ValueError(f"Columns {list(frame.columns)} do not match the stored columns {stored}")
+
+        # the types of the stored columns, so that stored and ingested values compare equal
+        for name, kind in manifest['columns']:
+            if kind == 'date':
+                frame[name] = frame[name].astype('datetime64[ns]')
+            elif kind == 'float':
+                frame[name] = frame[name].astype(self.spec.float_dtype)
+            elif kind == 'category':
+                frame[name] = frame[name].astype(str)
+        return frame[stored].reset_index(drop=True)
+
+    def _changed_rows(self, batch: 'pd.DataFrame', month: str, manifest: dict, mode: str,
+                      report: IngestReport) -> 'pd.DataFrame':
+        """Rows of batch to write: the new keys, and with mode='upsert' the changed rows"""
+        keys = list(self.spec.unique_columns)
+        if month not in manifest['partitions']:
+            report.added += len(batch)
+            return batch
+
+        stored = self._decode(self._partition(month, manifest), manifest)
+        merged = batch.merge(stored, on=keys, how='left', suffixes=('', ' (stored)'), indicator=True)
+        new = (merged['_merge'] == 'left_only').values
+        report.added += int(new.sum())
+        if mode == 'append':
+            return batch[new]
+
+        changed = np.zeros(len(batch), dtype=bool)
+        for name in batch.columns.difference(keys):
+            value, previous = merged[name], merged[f'{name} (stored)']
+            changed |= ~((value == previous) | (value.isna() & previous.isna())).values
+        changed &= ~new
+        report.replaced += int(changed.sum())
+        return batch[new | changed]
+
+    def _encode(self, rows: 'pd.DataFrame', manifest: dict) -> dict:
+        """Column arrays of rows, adding their new category values to the manifest"""
+        arrays = {}
+        for name, kind in manifest['columns']:
+            values = rows[name]
+            if kind == 'category':
+                known = manifest['categories'].setdefault(name, [])
+                codes = {value: code for code, value in enumerate(known)}
+                for value in values.unique():
+                    if value not in codes:
+                        codes[value] = len(known)
+                        known.append(value)
+                arrays[name] = values.map(codes).values.astype(np.int32)
+            elif kind == 'date':
+                arrays[name] = values.values.astype('datetime64[D]')
+            elif kind == 'float':
+                arrays[name] = values.values.astype(self.spec.float_dtype)
+            else:
+                arrays[name] = values.values
+        return arrays
+
+    @staticmethod
+    def _decode(arrays: dict, manifest: dict) -> 'pd.DataFrame':
+        import pandas as pd
+
+        columns = {}
+        for name, kind in manifest['columns']:
+            if kind == 'category':
+                columns[name] = np.asarray(manifest['categories'][name], dtype=str)[arrays[name]]
+            elif kind == 'date':
+                columns[name] = arrays[name].astype('datetime64[ns]')
+            else:
+                columns[name] = arrays[name]
+        return pd.DataFrame(columns)
+
+
+def _kind(values: 'pd.Series', spec: TableSpec) -> str:
+    """How a column is stored, with the rules of ropacea.columnar.ingest()"""
+    import pandas as pd
+
+    if values.name in spec.date_columns:
+        return 'date'
+    if pd.api.types.is_float_dtype(values):
+        return 'float'
+    if pd.api.types.is_numeric_dtype(values):
+        return 'numeric'
+    return 'category'
+
+
+def _digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
@@ -0,0 +1,295 @@
+"""Backtests that stream their results and survive being interrupted.
+
+Iterating a BacktestStream yields each BacktestResult as soon as its mark date is
+backtested. With a checkpoint file, every completed mark date is appended to it (one
+JSON line, flushed to disk) before its results are yielded. Running the same stream
+again replays the completed mark dates from the file and carries on from the next one.
+
+    >>> stream = BacktestStream(date(2017, 1, 1), date(2022, 1, 1),
+    ...                         PortfolioStrategy.SAMPLE_COVARIANCE,
+    ...                         checkpoint='runs/scs.jsonl')
+    >>> for result in stream:
+    ...     print(result.mark_date, stream.summaries[1.0].sharpe_ratio)
+
+Running summaries are updated one result at a time, and written next to the checkpoint
+(runs/scs.summary.json above) after every mark date for anything watching the run.
+"""
+
+
+import os
+import json
+import math
+from pathlib import Path
+from datetime import date
+from dataclasses import dataclass
+from typing import Iterator
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from ropacea.data import FLOAT_DTYPE, get_missing_data_policy
+from ropacea.portfolios import Portfolio, PortfolioStrategy
+from ropacea.solvers import get_default_backend
+from ropacea.rebalancing import get_rebalancer
+from ropacea.universe import DEFAULT_UNIVERSE, UniverseRule
+from ropacea.batch import prefetch_estimates
+from ropacea.backtest import (BASIS_POINT, BacktestResult, BacktestSummary, backtest, backtest_frontier,
+                              mark_dates, rebalances_per_year, summary_from_moments)
+
+
+@dataclass
+class RunningSummary:
+    """Summary statistics of a backtest updated one result at a time
+
+    The mean and variance of the monthly excess returns use Welford's algorithm, so they
+    agree with ropacea.backtest.summarize_results() of the results seen so far to
+    rounding error.
+    """
+
+    count: int = 0
+    mean_bp: float = 0.0
+    """Mean monthly excess return (bp)"""
+    sum_squares_bp: float = 0.0
+    """Sum of squared deviations from mean_bp"""
+    growth: float = 1.0
+    """Growth of one dollar invested in the portfolio"""
+    last_mark_date: date = None
+    periods_per_year: float = 12
+    """Mark dates per year, see ropacea.backtest.rebalances_per_year()"""
+
+    def update(self, result: BacktestResult) -> None:
+        self.count += 1
+        excess_return_bp = result.excess_return / BASIS_POINT
+        delta = excess_return_bp - self.mean_bp
+        self.mean_bp += delta / self.count
+        self.sum_squares_bp += delta * (excess_return_bp - self.mean_bp)
+
+        self.growth *= 1 + result.portfolio.calc_portfolio_return(result.market_returns)
+        self.last_mark_date = result.mark_date
+
+    @property
+    def std_bp(self) -> float:
+        """Sample standard deviation of the monthly excess returns (bp)"""
+        return math.sqrt(self.sum_squares_bp / (self.count - 1)) if self.count > 1 else math.nan
+
+    @property
+    def cumulative_return(self) -> float:
+        return self.growth - 1
+
+    @property
+    def sharpe_ratio(self) -> float:
+        return self.summary().sharpe_ratio if self.count > 1 and self.std_bp > 0 else math.nan
+
+    def summary(self) -> BacktestSummary:
+        """Same as summarize_results() of the results seen so far"""
+        return summary_from_moments(self.mean_bp, self.std_bp, self.periods_per_year)
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'last_mark_date': self.last_mark_date.isoformat() if self.last_mark_date else None,
+            'monthly_returns_bp_mean': self.mean_bp,
+            'monthly_returns_bp_std': self.std_bp,
+            'sharpe_ratio': self.sharpe_ratio,
+            'cumulative_return': self.cumulative_return,
+        }
+
+
+class BacktestCheckpoint:
+    """Append-only JSON lines file of completed mark dates
+
+    The first line describes the run. Each further line holds every result of one mark
+    date, so a mark date is either completely in the file or not at all.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+
+    @property
+    def summary_path(self) -> Path:
+        return self.path.with_suffix('.summary.json')
+
+    def load(self, run: dict) -> list[list[BacktestResult]]:
+        """Results of the mark dates completed by an earlier run with the same parameters"""
+        if not self.path.exists():
+            return []
+
+        lines = self.path.read_bytes().split(b'\n')
+        try:
+            header, records = json.loads(lines[0]), []
+        except json.JSONDecodeError:
+            # a run interrupted while writing its header recorded no mark date yet
+            self.path.unlink()
+            return []
+        if header != run:
+            raise ValueError(f"{self.path} is a checkpoint of a different run: {header}")
+
+        valid_bytes = len(lines[0]) + 1
+        for line in lines[1:]:
+            try:
+                records.append(self._decode(json.loads(line)))
+            except (json.JSONDecodeError, KeyError):
+                # the last line of an interrupted run can be incomplete
+                break
+            valid_bytes += len(line) + 1
+
+        # drop the incomplete line so that the next append starts on a fresh one
+        os.truncate(self.path, min(valid_bytes, self.path.stat().st_size))
+        return records
+
+    def start(self, run: dict) -> None:
+        """Create the checkpoint with its header line, if it does not exist yet.
+        The header is written to a temporary file first, so it is never incomplete."""
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(run) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def append(self, results: list[BacktestResult], ratios: list[float]) -> None:
+        """Durably record the results of one mark date"""
+        self._append({
+            'mark_date': results[0].mark_date.isoformat(),
+            'tickers': list(results[0].portfolio.tickers),
+            'market_returns': [float(r) for r in results[0].market_returns],
+            'results': [
+                {'min_return_ratio': ratio,
+                 'holdings': [float(h) for h in result.portfolio.holdings],
+                 'excess_return': float(result.excess_return)}
+                for ratio, result in zip(ratios, results)
+            ],
+        })
+
+    def write_summaries(self, summaries: dict[float, RunningSummary]) -> None:
+        tmp_path = self.summary_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(
+            [{'min_return_ratio': ratio, **summary.to_dict()} for ratio, summary in summaries.items()],
+            indent=1
+        ))
+        os.replace(tmp_path, self.summary_path)
+
+    def _append(self, record: dict) -> None:
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _decode(record: dict) -> list[BacktestResult]:
+        mark_date = date.fromisoformat(record['mark_date'])
+        return [
+            BacktestResult(mark_date, Portfolio(result['holdings'], record['tickers']),
+                           record['market_returns'], result['excess_return'])
+            for result in record['results']
+        ]
+
+
+class BacktestStream:
+    """Backtest of a strategy from start_date (inclusive) to end_date (exclusive) that
+    yields its results as they are produced, see ropacea.backtest.backtest_loop()
+
+    Given a list of min_return_ratios, each mark date yields one result per ratio, in
+    the order of the ratios.
+    """
+
+    def __init__(self,
+                 start_date: date,
+                 end_date: date,
+                 strategy: PortfolioStrategy,
+                 frequency = relativedelta(months=1),
+                 min_return_ratio: float | list[float] = 1,
+                 sample_months: int = 60,
+                 universe: UniverseRule = DEFAULT_UNIVERSE,
+                 checkpoint: Path = None) -> None:
+        self.start_date = start_date
+        self.end_date = end_date
+        self.strategy = strategy
+        self.frequency = frequency
+        self.sample_months = sample_months
+        self.universe = universe
+
+        self.frontier = isinstance(min_return_ratio, (list, tuple, np.ndarray))
+        self.ratios = [float(r) for r in min_return_ratio] if self.frontier else [float(min_return_ratio)]
+
+        self.checkpoint = BacktestCheckpoint(checkpoint) if checkpoint is not None else None
+        self.summaries = {ratio: RunningSummary(periods_per_year=rebalances_per_year(self.frequency)) for ratio in self.ratios}
+        """Running summary of each min_return_ratio"""
+        self.resumed = 0
+        """Mark dates replayed from the checkpoint"""
+
+    def run_parameters(self) -> dict:
+        """Identify the run in the checkpoint, with the settings the backtest reads.
+        end_date is left out so that a run can be extended."""
+        rebalancer = get_rebalancer()
+        return {
+            'strategy': self.strategy.name,
+            'start_date': self.start_date.isoformat(),
+            'frequency': repr(self.frequency),
+            'min_return_ratios': self.ratios,
+            'sample_months': self.sample_months,
+            'universe': self.universe.key,
+            'missing_data': get_missing_data_policy().value,
+            'float_dtype': FLOAT_DTYPE,
+            'rebalancer': rebalancer.key if rebalancer is not None else None,
+            'solver': get_default_backend(),
+        }
+
+    def __iter__(self) -> Iterator[BacktestResult]:
+        self.summaries = {ratio: RunningSummary(periods_per_year=rebalances_per_year(self.frequency)) for ratio in self.ratios}
+        dates = mark_dates(self.start_date, self.end_date, self.frequency)
+
+        completed = []
+        if self.checkpoint is not None:
+            run = self.run_parameters()
+            completed = [results for results in self.checkpoint.load(run) if results[0].mark_date < self.end_date]
+            self.checkpoint.start(run)
+        self.resumed = len(completed)
+
+        for results in completed:
+            yield from self._record(results, replayed=True)
+
+        prefetch_estimates(dates[len(completed):], self.strategy, self.sample_months, self.universe)
+        for mark_date in dates[len(completed):]:
+            if self.frontier:
+                results = backtest_frontier(mark_date, self.strategy, self.frequency, self.ratios, self.sample_months,
+                                            self.universe)
+            else:
+                results = [backtest(mark_date, self.strategy, self.frequency, self.ratios[0], self.sample_months,
+                                    self.universe)]
+            yield from self._record(results)
+
+    def _record(self, results: list[BacktestResult], replayed: bool = False) -> Iterator[BacktestResult]:
+        for ratio, result in zip(self.ratios, results):
+            self.summaries[ratio].update(result)
+
+        if self.checkpoint is not None:
+            if not replayed:
+                self.checkpoint.append(results, self.ratios)
+            self.checkpoint.write_summaries(self.summaries)
+
+        yield from results
+
+
+# resume a run interrupted after a few mark dates
+if __name__ == '__main__':
+    import tempfile
+    from ropacea.backtest import backtest_loop
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'run.jsonl'
+        args = (date(2017, 1, 1), date(2018, 1, 1), PortfolioStrategy.SINGLE_FACTOR)
+
+        for k, _ in enumerate(BacktestStream(*args, checkpoint=path)):
+            if k == 4:
+                break
+
+        stream = BacktestStream(*args, checkpoint=path)
+        streamed = list(stream)
+        expected = backtest_loop(*args)
+
+        print(f"resumed after {stream.resumed} mark dates")
+        print("same results:", all(a.excess_return == b.excess_return for a, b in zip(streamed, expected)))
+        print(json.dumps(json.loads(stream.checkpoint.summary_path.read_text()), indent=1))
@@ -0,0 +1,108 @@
+"""Rules choosing the tickers a strategy invests in at each mark date.
+
+The default is the fixed ropacea.data.UNIVERSE. Other rules pick their tickers from
+every ticker in the data, using only the data before the mark date, so tickers enter
+and leave as they are listed and delisted.
+
+    >>> universe = TopMarketCap(20)
+    >>> universe.select(date(2017, 1, 1), sample_months=60)
+    >>> results = backtest_loop(date(2017, 1, 1), date(2022, 1, 1),
+    ...                         PortfolioStrategy.SINGLE_FACTOR, universe=universe)
+
+Rules are frozen dataclasses, so they can be compared, hashed, sent to worker
+processes and used in cache keys.
+"""
+
+
+from datetime import date
+from dataclasses import dataclass
+
+import numpy as np
+
+from ropacea.data import UNIVERSE, ReturnsPanel, get_returns_panel
+
+
+class UniverseRule:
+    """Base class of the universe rules"""
+
+    def select(self, mark_date: date, sample_months: int = 60) -> tuple[str, ...]:
+        """Tickers to invest in at mark_date"""
+        panel = get_returns_panel()
+        return tuple(panel.tickers[j] for j in self.columns(panel, mark_date, sample_months))
+
+    def columns(self, panel: ReturnsPanel, mark_date: date, sample_months: int) -> np.ndarray:
+        """Panel columns of the tickers to invest in at mark_date"""
+        raise NotImplementedError
+
+    @property
+    def key(self) -> str:
+        """Stable description of the rule, for cache keys"""
+        return repr(self)
+
+
+@dataclass(frozen=True)
+class StaticUniverse(UniverseRule):
+    """The same tickers at every mark date"""
+
+    tickers: tuple = tuple(UNIVERSE)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'tickers', tuple(self.tickers))
+
+    def select(self, mark_date: date, sample_months: int = 60) -> tuple[str, ...]:
+        return self.tickers
+
+    def columns(self, panel: ReturnsPanel, mark_date: date, sample_months: int) -> np.ndarray:
+        return panel.columns(self.tickers)
+
+
+@dataclass(frozen=True)
+class FullHistory(UniverseRule):
+    """Every ticker with a return in each of the sample_months before the mark date"""
+
+    def columns(self, panel: ReturnsPanel, mark_date: date, sample_months: int) -> np.ndarray:
+        return np.flatnonzero(_full_history(panel, mark_date, sample_months))
+
+
+@dataclass(frozen=True)
+class TopMarketCap(UniverseRule):
+    """The k largest tickers by market capitalization in the period before the mark date"""
+
+    k: int
+    full_history: bool = True
+    """Only rank the tickers with a return in each of the sample_months before the mark date"""
+
+    def columns(self, panel: ReturnsPanel, mark_date: date, sample_months: int) -> np.ndarray:
+        last_month = panel.market_cap[panel.rows_before(mark_date, 1)]
+        if last_month.shape[0] != 1:
+            raise ValueError(f"Market capitalizations missing for the period before {mark_date}")
+
+        market_caps = np.where(np.isnan(last_month[0]), -np.inf, last_month[0])
+        if self.full_history:
+            market_caps[~_full_history(panel, mark_date, sample_months)] = -np.inf
+
+        # stable, so ties keep the column order
+        largest = np.argsort(-market_caps, kind='stable')[:self.k]
+        largest = largest[np.isfinite(market_caps[largest])]
+
+        # keep the panel's column order
+        return np.sort(largest)
+
+
+DEFAULT_UNIVERSE = StaticUniverse()
+"""ropacea.data.UNIVERSE at every mark date"""
+
+
+def _full_history(panel: ReturnsPanel, mark_date: date, sample_months: int) -> np.ndarray:
+    """Mask of the columns with a return in each of the sample_months before mark_date"""
+    rows = panel.sample_window(mark_date, sample_months)
+    if rows.stop - rows.start < panel.sample_rows(sample_months):
+        return np.zeros(len(panel.tickers), dtype=bool)
+    return panel.coverage.complete(rows)
+
+
+if __name__ == '__main__':
+    mark_date = date(2017, 1, 1)
+    for universe in (DEFAULT_UNIVERSE, FullHistory(), TopMarketCap(10), TopMarketCap(10, full_history=False)):
+        tickers = universe.select(mark_date)
+        print(f"{universe.key}: {len(tickers)} tickers {tickers}")
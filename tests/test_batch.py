@@ -0,0 +1,65 @@
+from datetime import date
+
+import numpy as np
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from ropacea import portfolios
+from ropacea.backtest import mark_dates
+from ropacea.batch import _BATCH_ESTIMATORS, BATCH_BYTES, batch_estimates, batch_size
+from ropacea.covariance import FactorCovariance
+from ropacea.estimate_cache import EstimateStore, get_estimate_store, set_estimate_store
+from ropacea.portfolios import PortfolioStrategy
+from ropacea.universe import FullHistory
+
+
+MARK_DATE = date(2017, 1, 1)
+
+
+def test_batch_size_counts_dense_arrays():
+    # 1000 tickers over 60 months
+    size = batch_size(PortfolioStrategy.SAMPLE_COVARIANCE, 60, 1000)
+    assert 0 < size * 5 * 1000**2 * 8 <= BATCH_BYTES
+    assert batch_size(PortfolioStrategy.SINGLE_FACTOR, 60, 1000) * 60 * 1000 * 8 <= BATCH_BYTES
+    assert batch_size(PortfolioStrategy.SAMPLE_COVARIANCE, 60, 100_000) == 1
+
+
+def test_large_dense_estimates_are_not_stored(tmp_path):
+    store = EstimateStore(directory=tmp_path, max_dense_assets=10)
+    estimates = {
+        'dense': lambda n: (np.zeros(n), np.eye(n)),
+        'factor': lambda n: (np.zeros(n), FactorCovariance(np.ones((n, 1)), np.ones((1, 1)), np.ones(n))),
+    }
+    tickers = {n: tuple(f'T{i}' for i in range(n)) for n in (10, 11)}
+
+    for estimator, compute in estimates.items():
+        for n in tickers:
+            store.get_or_compute(estimator, MARK_DATE, 60, lambda: compute(n), tickers[n])
+
+    stored = {(estimator, n) for estimator in estimates for n in tickers
+              if store.contains(estimator, MARK_DATE, 60, tickers[n])}
+    assert stored == {('dense', 10), ('factor', 10), ('factor', 11)}
+    assert len(list(tmp_path.glob('*.npz'))) == 3
+
+
+@pytest.fixture
+def fresh_estimates():
+    previous = get_estimate_store()
+    set_estimate_store(EstimateStore(persist=False))
+    portfolios._rolling_estimators.clear()
+    yield
+    set_estimate_store(previous)
+    portfolios._rolling_estimators.clear()
+
+
+@pytest.mark.parametrize('strategy', list(_BATCH_ESTIMATORS), ids=lambda strategy: strategy.name)
+def test_batch_estimates_match_per_date(fresh_estimates, strategy):
+    dates = mark_dates(date(2016, 1, 1), date(2018, 1, 1), relativedelta(months=1))
+    tickers = FullHistory().select(dates[0], 60)
+    estimates = batch_estimates(dates, strategy, 60, tickers)
+
+    dense = estimates.dense()
+    for d, mark_date in enumerate(dates):
+        expected_returns, covariance = portfolios._compute_estimate(mark_date, strategy, 60, tickers)
+        np.testing.assert_allclose(estimates.expected_returns[d], expected_returns, rtol=1e-10, atol=1e-14)
+        np.testing.assert_allclose(dense[d], np.asarray(covariance), rtol=1e-8, atol=1e-14)
@@ -0,0 +1,6 @@
+from ropacea.benchmarks import check_golden
+
+
+def test_golden_outputs_unchanged():
+    # every strategy backtested on synthetic data, see ropacea.benchmarks.golden_outputs()
+    assert check_golden()
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from ropacea.covariance import DenseCovariance, FactorCovariance, relative_change
+
+
+def random_factor_covariance(n_assets: int, n_factors: int, seed: int = 0) -> FactorCovariance:
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(size=(n_factors, 2 * n_factors))
+    return FactorCovariance(rng.normal(size=(n_assets, n_factors)), np.cov(factors),
+                            rng.uniform(0.5, 2.0, n_assets))
+
+
+@pytest.mark.parametrize('n_factors', [1, 3])
+def test_woodbury_solve_matches_dense(n_factors):
+    covariance = random_factor_covariance(30, n_factors)
+    dense = covariance.to_dense()
+    rhs = np.random.default_rng(1).normal(size=(30, 2))
+
+    np.testing.assert_allclose(covariance.solve(rhs), np.linalg.solve(dense, rhs), rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(covariance.solve(rhs[:, 0]), np.linalg.solve(dense, rhs[:, 0]), rtol=1e-10, atol=1e-12)
+
+
+def test_singular_factor_covariance_solve():
+    covariance = random_factor_covariance(10, 2)
+    # perfectly correlated factors
+    covariance = FactorCovariance(covariance.loadings, np.ones((2, 2)), covariance.idiosyncratic)
+    rhs = np.ones(10)
+    np.testing.assert_allclose(covariance.solve(rhs), np.linalg.solve(covariance.to_dense(), rhs), rtol=1e-10)
+
+
+def test_factor_products_match_dense():
+    covariance = random_factor_covariance(20, 2)
+    dense = covariance.to_dense()
+    x = np.random.default_rng(2).normal(size=(20, 3))
+    assets = np.array([3, 0, 7, 11])
+
+    np.testing.assert_allclose(covariance @ x, dense @ x, rtol=1e-12)
+    np.testing.assert_allclose(covariance @ x[:, 0], dense @ x[:, 0], rtol=1e-12)
+    np.testing.assert_allclose(covariance.diagonal(), np.diag(dense), rtol=1e-12)
+    np.testing.assert_allclose(covariance.restrict(assets).to_dense(), dense[np.ix_(assets, assets)], rtol=1e-12)
+    assert relative_change(covariance, DenseCovariance(dense)) == pytest.approx(0, abs=1e-12)
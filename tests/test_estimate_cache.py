@@ -0,0 +1,31 @@
+from datetime import date
+
+import pytest
+
+from ropacea import data, estimate_cache
+from ropacea.estimate_cache import EstimateStore
+
+
+MARK_DATE = date(2017, 1, 1)
+TICKERS = ('AAPL', 'MSFT')
+
+
+@pytest.fixture
+def policy():
+    previous = data.get_missing_data_policy()
+    yield data.set_missing_data_policy
+    data.set_missing_data_policy(previous)
+
+
+def test_key_depends_on_missing_data_policy(policy):
+    keys = set()
+    for missing in data.MissingData:
+        policy(missing)
+        keys.add(EstimateStore.key('SAMPLE_COVARIANCE', MARK_DATE, 60, TICKERS))
+    assert len(keys) == len(data.MissingData)
+
+
+def test_key_depends_on_float_dtype(monkeypatch):
+    float64 = EstimateStore.key('SAMPLE_COVARIANCE', MARK_DATE, 60, TICKERS)
+    monkeypatch.setattr(estimate_cache, 'FLOAT_DTYPE', 'float32')
+    assert EstimateStore.key('SAMPLE_COVARIANCE', MARK_DATE, 60, TICKERS) != float64
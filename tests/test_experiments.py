@@ -0,0 +1,56 @@
+from datetime import date
+
+import pytest
+
+from ropacea import data, experiments, rebalancing
+from ropacea.backtest import backtest_loop
+from ropacea.experiments import Experiment, run_grid
+from ropacea.portfolios import PortfolioStrategy
+
+
+START_DATE, END_DATE = date(2017, 1, 1), date(2017, 3, 1)
+EXPERIMENT = Experiment(PortfolioStrategy.SINGLE_FACTOR, 1.0)
+
+
+class CountingBacktester:
+    def __init__(self) -> None:
+        self.runs = 0
+
+    def backtest_loop(self, *args, **kwargs):
+        self.runs += 1
+        return backtest_loop(*args, **kwargs)
+
+
+@pytest.fixture
+def policy():
+    previous = data.get_missing_data_policy()
+    yield data.set_missing_data_policy
+    data.set_missing_data_policy(previous)
+
+
+def test_switching_missing_data_policy_misses_the_cache(policy, tmp_path):
+    backtester = CountingBacktester()
+    policy(data.MissingData.DROP)
+    run_grid([EXPERIMENT], START_DATE, END_DATE, tmp_path, backtester)
+    run_grid([EXPERIMENT], START_DATE, END_DATE, tmp_path, backtester)
+    assert backtester.runs == 1
+
+    policy(data.MissingData.FORWARD_FILL)
+    run_grid([EXPERIMENT], START_DATE, END_DATE, tmp_path, backtester)
+    assert backtester.runs == 2
+
+
+def test_key_depends_on_settings(monkeypatch):
+    keys = {EXPERIMENT.key(START_DATE, END_DATE)}
+
+    monkeypatch.setattr(experiments, 'FLOAT_DTYPE', 'float32')
+    keys.add(EXPERIMENT.key(START_DATE, END_DATE))
+
+    monkeypatch.setattr(rebalancing, '_rebalancer', rebalancing.LazyRebalancer(0.05))
+    keys.add(EXPERIMENT.key(START_DATE, END_DATE))
+    monkeypatch.setattr(rebalancing, '_rebalancer', rebalancing.LazyRebalancer(0.05, strict=True))
+    keys.add(EXPERIMENT.key(START_DATE, END_DATE))
+
+    monkeypatch.setattr(experiments, 'get_default_backend', lambda: 'numpy')
+    keys.add(EXPERIMENT.key(START_DATE, END_DATE))
+    assert len(keys) == 5
@@ -0,0 +1,25 @@
+import pytest
+
+from ropacea.import_budget import CHECKED_MODULES, measure_import
+
+
+@pytest.fixture(scope='module', params=CHECKED_MODULES)
+def report(request):
+    return measure_import(request.param)
+
+
+def test_keeps_working_directory(report):
+    assert not report.changed_directory, str(report)
+
+
+def test_no_eager_heavy_dependencies(report):
+    # left in sys.modules of the fresh interpreter; the import time itself is too
+    # noisy on shared machines to assert, python -m ropacea.import_budget reports it
+    assert not {'gurobipy', 'pandas', 'statsmodels'} & set(report.eager_dependencies), str(report)
+    assert not report.eager_dependencies, str(report)
+
+
+def test_missing_import_line_is_an_error():
+    with pytest.raises(RuntimeError):
+        # imported before any script runs
+        measure_import('sys')
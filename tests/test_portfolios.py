@@ -0,0 +1,32 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from ropacea import data
+from ropacea.portfolios import PortfolioStrategy, _compute_estimate
+
+
+UNSORTED = ('MSFT', 'FB', 'AAPL', 'XOM')
+"""FB has missing returns before 2015, so the estimates take the pivoting fallback"""
+
+
+@pytest.fixture
+def pairwise():
+    previous = data.get_missing_data_policy()
+    data.set_missing_data_policy(data.MissingData.PAIRWISE)
+    yield
+    data.set_missing_data_policy(previous)
+
+
+@pytest.mark.parametrize('strategy', list(PortfolioStrategy)[2:], ids=lambda strategy: strategy.name)
+def test_fallback_estimates_follow_ticker_order(pairwise, strategy):
+    mark_date = date(2015, 1, 1)
+    assert np.isnan(data.get_in_sample_returns(mark_date, 60, UNSORTED)).any()
+
+    expected_returns, covariance = _compute_estimate(mark_date, strategy, 60, UNSORTED)
+    sorted_returns, sorted_covariance = _compute_estimate(mark_date, strategy, 60, tuple(sorted(UNSORTED)))
+
+    position = [sorted(UNSORTED).index(ticker) for ticker in UNSORTED]
+    np.testing.assert_allclose(expected_returns, sorted_returns[position])
+    np.testing.assert_allclose(np.asarray(covariance), np.asarray(sorted_covariance)[np.ix_(position, position)])
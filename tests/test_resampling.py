@@ -0,0 +1,24 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from ropacea.portfolios import PortfolioStrategy
+from ropacea.resampling import resampled_portfolio
+
+
+@pytest.mark.parametrize('strategy', [PortfolioStrategy.SAMPLE_COVARIANCE, PortfolioStrategy.SINGLE_FACTOR],
+                         ids=lambda strategy: strategy.name)
+def test_infeasible_draws_are_capped(strategy):
+    # some draws have no ticker with twice the average expected return
+    resampled = resampled_portfolio(date(2017, 1, 1), strategy, min_return_ratio=2.0, n_draws=200)
+
+    assert resampled.capped > 0
+    assert len(resampled.draw_holdings) == 200
+    np.testing.assert_allclose(resampled.draw_holdings.sum(axis=1), 1)
+    assert resampled.draw_holdings.min() > -1e-9
+
+
+def test_feasible_draws_are_not_capped():
+    resampled = resampled_portfolio(date(2017, 1, 1), PortfolioStrategy.SINGLE_FACTOR, n_draws=50)
+    assert resampled.capped == 0
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from ropacea.backtest import summary_from_moments
+from ropacea.results import BacktestResults, compare, excess_return_moments
+
+
+@pytest.fixture
+def weekly():
+    rng = np.random.default_rng(0)
+    n_periods, n_tickers = 120, 5
+    return BacktestResults(
+        np.datetime64('2015-01-05') + 7 * np.arange(n_periods),
+        tuple(f'T{j}' for j in range(n_tickers)),
+        np.full((n_periods, n_tickers), 1 / n_tickers),
+        rng.normal(0.002, 0.02, (n_periods, n_tickers)),
+        rng.normal(0.001, 0.01, n_periods),
+        periods_per_year=52,
+    )
+
+
+def test_metrics_use_periods_per_year(weekly):
+    expected = summary_from_moments(*excess_return_moments(weekly.excess_returns), 52)
+    assert weekly.summary().sharpe_ratio == pytest.approx(expected.sharpe_ratio)
+    assert weekly.metrics().annualized_std_pct == pytest.approx(expected.annualized_std_pct)
+    assert compare({'a': weekly})['sharpe_ratio'].iloc[0] == pytest.approx(expected.sharpe_ratio)
+
+
+def test_rolling_sharpe_window_is_one_year(weekly):
+    rolling = weekly.rolling_sharpe()
+    assert np.isnan(rolling[:51]).all() and not np.isnan(rolling[51:]).any()
+    expected = summary_from_moments(*excess_return_moments(weekly.excess_returns[:52]), 52)
+    assert rolling[51] == pytest.approx(expected.sharpe_ratio)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from ropacea import rolling
+from ropacea.scs import ledoit_wolf_intensity, shrink_covariance
+from ropacea.const_corr import constant_corr_covariance
+from ropacea.Single_factor import single_factor_covariance, single_factor_regression
+
+
+SAMPLE_MONTHS = 24
+_rng = np.random.default_rng(0)
+# 8 tickers with a common market return
+RETURNS = _rng.normal(0.01, 0.05, size=(100, 8)) + _rng.normal(0, 0.03, size=(100, 1))
+
+
+def direct_estimate(name: str, window: np.ndarray) -> np.ndarray:
+    """Covariance of the window from the estimator functions the rolling estimators follow"""
+    match name:
+        case 'RollingSampleCovariance':
+            sample_cov = np.cov(window, rowvar=False)
+            centered = window - window.mean(axis=0)
+            return shrink_covariance(sample_cov, ledoit_wolf_intensity(sample_cov, (centered**2).sum(axis=1)))
+        case 'RollingSingleFactor':
+            _, beta, omega, market_variance = single_factor_regression(window)
+            return single_factor_covariance(beta, market_variance, omega).to_dense()
+        case 'RollingConstantCorrelation':
+            correlation = np.corrcoef(window, rowvar=False)
+            avg_corr = correlation[np.triu_indices(window.shape[1], k=1)].mean()
+            return constant_corr_covariance(window.std(axis=0, ddof=1), avg_corr).to_dense()
+
+
+@pytest.mark.parametrize('name', ['RollingSampleCovariance', 'RollingSingleFactor', 'RollingConstantCorrelation',
+                                  'RollingStatisticalFactor'])
+def test_sliding_matches_rebuilding(name):
+    estimator_class = getattr(rolling, name)
+    sliding = estimator_class(RETURNS.shape[1], SAMPLE_MONTHS, resync_every=6)
+
+    for end in range(SAMPLE_MONTHS, len(RETURNS) + 1):
+        window = RETURNS[end - SAMPLE_MONTHS:end]
+        rebuilt = estimator_class(RETURNS.shape[1], SAMPLE_MONTHS).rebuild(window)
+        sliding.at(RETURNS, end)
+
+        np.testing.assert_allclose(sliding.expected_returns(), window.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(np.asarray(sliding.covariance()), np.asarray(rebuilt.covariance()),
+                                   rtol=1e-8, atol=1e-14)
+        if name != 'RollingStatisticalFactor':
+            np.testing.assert_allclose(np.asarray(rebuilt.covariance()), direct_estimate(name, window),
+                                       rtol=1e-10, atol=1e-14)
+
+
+def test_window_does_not_depend_on_visiting_order():
+    forward = rolling.RollingSampleCovariance(RETURNS.shape[1], SAMPLE_MONTHS)
+    for end in range(SAMPLE_MONTHS, 80):
+        forward.at(RETURNS, end)
+
+    jumped = rolling.RollingSampleCovariance(RETURNS.shape[1], SAMPLE_MONTHS).at(RETURNS, 90).at(RETURNS, 79)
+    np.testing.assert_array_equal(forward.covariance(), jumped.covariance())
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from ropacea.solvers import ActiveSetSolver, solve_min_risk_batch
+from ropacea.covariance import FactorCovariance
+
+
+def random_problem(n_assets: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """Expected returns and covariance of a sample of 2 n_assets returns"""
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.01, 0.05, size=(2 * n_assets, n_assets)) + rng.normal(0, 0.03, size=(2 * n_assets, 1))
+    return returns.mean(axis=0), np.cov(returns, rowvar=False)
+
+
+def assert_kkt(expected_returns, covariance, min_return, holdings, tol=1e-8):
+    """Holdings satisfy the KKT conditions of min x'Vx, sum x = 1, mu'x >= min_return, x >= 0"""
+    assert holdings.sum() == pytest.approx(1, abs=tol)
+    assert holdings.min() >= -tol
+    assert expected_returns @ holdings >= min_return - tol
+
+    # multipliers of the budget and return constraints from the held assets
+    gradient = 2 * covariance @ holdings
+    held = holdings > tol
+    return_active = expected_returns @ holdings <= min_return + tol
+    constraints = np.column_stack([np.ones_like(expected_returns), expected_returns])[:, :1 + return_active]
+    multipliers, *_ = np.linalg.lstsq(constraints[held], gradient[held], rcond=None)
+    bound_multipliers = gradient - constraints @ multipliers
+
+    scale = tol * max(1.0, np.abs(gradient).max())
+    np.testing.assert_allclose(bound_multipliers[held], 0, atol=scale)
+    assert bound_multipliers.min() >= -scale
+    if return_active:
+        assert multipliers[1] >= -scale
+
+
+def test_closed_form_when_no_constraint_binds():
+    expected_returns, covariance = random_problem(5, 0)
+    covariance = covariance + np.diag(np.full(5, 0.1))
+    closed_form = np.linalg.solve(covariance, np.ones(5))
+    closed_form /= closed_form.sum()
+    assert closed_form.min() > 0
+
+    holdings = ActiveSetSolver(5).solve(expected_returns, covariance, expected_returns @ closed_form - 1)
+    np.testing.assert_allclose(holdings, closed_form, rtol=1e-10)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('ratio', [0.5, 1.0, 1.5])
+def test_active_set_satisfies_kkt(seed, ratio):
+    expected_returns, covariance = random_problem(15, seed)
+    min_return = min(expected_returns.mean() * ratio, expected_returns.max())
+
+    holdings = ActiveSetSolver(15).solve(expected_returns, covariance, min_return)
+    assert_kkt(expected_returns, covariance, min_return, holdings)
+
+
+def test_factor_covariance_gives_dense_holdings():
+    rng = np.random.default_rng(3)
+    covariance = FactorCovariance(rng.normal(1, 0.3, size=(25, 2)), np.diag([0.002, 0.001]),
+                                  rng.uniform(0.001, 0.004, 25))
+    expected_returns = rng.normal(0.01, 0.005, 25)
+    min_return = expected_returns.mean() * 1.2
+
+    factored = ActiveSetSolver(25).solve(expected_returns, covariance, min_return)
+    dense = ActiveSetSolver(25).solve(expected_returns, covariance.to_dense(), min_return)
+    np.testing.assert_allclose(factored, dense, atol=1e-10)
+    assert_kkt(expected_returns, covariance.to_dense(), min_return, factored)
+
+
+def test_batch_solves_match_one_at_a_time():
+    problems = [random_problem(12, seed) for seed in range(10)]
+    expected_returns = np.stack([mu for mu, _ in problems])
+    covariances = np.stack([covariance for _, covariance in problems])
+    min_returns = np.minimum(expected_returns.mean(axis=1) * 1.5, expected_returns.max(axis=1))
+
+    holdings, _ = solve_min_risk_batch(expected_returns, covariances, min_returns)
+    for b in range(len(problems)):
+        single = ActiveSetSolver(12).solve(expected_returns[b], covariances[b], min_returns[b])
+        np.testing.assert_allclose(holdings[b], single, atol=1e-9)
+
+
+def test_batch_rejects_unreachable_min_return():
+    expected_returns, covariance = random_problem(4, 0)
+    with pytest.raises(ValueError):
+        solve_min_risk_batch(expected_returns[None], covariance[None], np.array([expected_returns.max() + 1]))
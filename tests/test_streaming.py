@@ -0,0 +1,40 @@
+from datetime import date
+
+import pytest
+
+from ropacea import data
+from ropacea.portfolios import PortfolioStrategy
+from ropacea.streaming import BacktestStream
+
+
+@pytest.mark.parametrize('header', [b'', b'{"strategy": "EQUALLY_WE'], ids=['empty', 'partial'])
+def test_resume_after_incomplete_header(tmp_path, header):
+    checkpoint = tmp_path / 'run.jsonl'
+    checkpoint.write_bytes(header)
+
+    stream = BacktestStream(date(2017, 1, 1), date(2017, 4, 1), PortfolioStrategy.EQUALLY_WEIGHTED,
+                            checkpoint=checkpoint)
+    assert len(list(stream)) == 3 and stream.resumed == 0
+
+    resumed = BacktestStream(date(2017, 1, 1), date(2017, 6, 1), PortfolioStrategy.EQUALLY_WEIGHTED,
+                             checkpoint=checkpoint)
+    assert len(list(resumed)) == 5 and resumed.resumed == 3
+
+
+@pytest.fixture
+def policy():
+    previous = data.get_missing_data_policy()
+    yield data.set_missing_data_policy
+    data.set_missing_data_policy(previous)
+
+
+def test_resume_under_other_settings_is_refused(tmp_path, policy):
+    checkpoint = tmp_path / 'run.jsonl'
+    policy(data.MissingData.DROP)
+    list(BacktestStream(date(2017, 1, 1), date(2017, 3, 1), PortfolioStrategy.EQUALLY_WEIGHTED,
+                        checkpoint=checkpoint))
+
+    policy(data.MissingData.FORWARD_FILL)
+    with pytest.raises(ValueError, match='different run'):
+        list(BacktestStream(date(2017, 1, 1), date(2017, 4, 1), PortfolioStrategy.EQUALLY_WEIGHTED,
+                            checkpoint=checkpoint))